@@ -1,10 +1,25 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, status, Form, Cookie
+from fastapi import FastAPI, Request, HTTPException, Depends, status, Form, Cookie, File, UploadFile
 from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from typing import Optional
 from datetime import datetime, timedelta
-from models import SessionLocal, ArticleSummary, SystemConfig
+import models
+from models import AsyncSessionLocal, ArticleSummary, SystemConfig, StatsTotal
+from sqlalchemy import select, func, text, table, column, literal_column, tuple_
+from sqlalchemy.orm import defer
 from security import create_access_token, verify_token
+import singleflight
+from scheduler import llm_scheduler
+import llm_client
+from cache import summary_cache, LRUCache
+from themes import theme_store
+import fingerprint
+from jobs import job_queue
+from events import event_log
+from storage import storage
+from shared_cache import shared_cache
+from sources import parse_batch, parse_datetime, check_url
+from summaries import extract_article_id
 from math import ceil
 import os
 from config import config  # 导入配置
@@ -13,6 +28,9 @@ from typing import Dict, Any
 import logging
 from fastapi.exceptions import RequestValidationError
 import json
+import base64
+import copy
+from config_store import config_store
 from fastapi import APIRouter
 
 logging.basicConfig(level=logging.INFO)
@@ -59,6 +77,12 @@ async def get_current_user(request: Request, access_token: Optional[str] = Cooki
             detail="Invalid token"
         )
 
+async def require_admin(user=Depends(get_current_user)):
+    """接口使用的验证，未登录时返回 401 而不是重定向"""
+    if not isinstance(user, str):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return user
+
 # 根路径重定向到登录页面
 @app.get("/")
 async def admin_root():
@@ -100,6 +124,49 @@ async def login(
         status_code=400
     )
 
+# 摘要列表可排序的列，均有 (列, article_id) 联合索引
+SORT_COLUMNS = ('last_updated', 'created_at', 'updated_at', 'article_id')
+# FTS5 trigram 分词可检索的最短搜索词，更短的搜索词使用 LIKE
+FTS_MIN_LENGTH = 3
+_fts = table('article_summaries_fts', column('rowid'))
+# 搜索结果总数缓存，键为搜索词
+search_counts = LRUCache(maxsize=256, ttl=60)
+
+def _search_filter(search: str):
+    if models.FTS_ENABLED and len(search) >= FTS_MIN_LENGTH:
+        phrase = '"' + search.replace('"', '""') + '"'
+        return literal_column('article_summaries.rowid').in_(
+            select(_fts.c.rowid).where(text("article_summaries_fts MATCH :phrase").bindparams(phrase=phrase))
+        )
+    return ArticleSummary.summary.ilike(f"%{search}%") | ArticleSummary.article_id.ilike(f"%{search}%")
+
+def encode_cursor(summary: ArticleSummary, sort: str) -> str:
+    """把一行的排序值和文章ID编码为翻页游标"""
+    value = getattr(summary, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, summary.article_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        value, article_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort != 'article_id' and value is not None:
+            value = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="无效的翻页游标")
+    return value, article_id
+
+async def _count_summaries(db, search: Optional[str]) -> int:
+    """总数：不搜索时读取触发器维护的计数，搜索时缓存一分钟"""
+    if not search:
+        return await db.scalar(select(StatsTotal.value).where(StatsTotal.key == 'summaries')) or 0
+    total = search_counts.get(search)
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(ArticleSummary).where(_search_filter(search)))
+        search_counts.set(search, total)
+    return total
+
 @app.get("/dashboard", response_class=HTMLResponse)
 async def admin_dashboard(
     request: Request,
@@ -108,32 +175,59 @@ async def admin_dashboard(
     per_page: int = 10,
     search: Optional[str] = None,
     sort: Optional[str] = None,
-    order: Optional[str] = None
+    order: Optional[str] = None,
+    cursor: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    db = SessionLocal()
-    try:
-        query = db.query(ArticleSummary)
-        
+    """摘要列表使用游标翻页：cursor 为下一页的起点，before 为上一页的终点，page 只用于显示页码"""
+    sort = sort if sort in SORT_COLUMNS else 'last_updated'
+    order = 'asc' if order == 'asc' else 'desc'
+    per_page = min(max(per_page, 1), 100)
+    sort_column = getattr(ArticleSummary, sort)
+    # 以 article_id 作为排序值相同时的次序，保证游标唯一
+    key = (sort_column,) if sort == 'article_id' else (sort_column, ArticleSummary.article_id)
+    # 向前翻页时反向查询，取出后再倒序
+    backward = bool(before) and not cursor
+    descending = (order == 'desc') != backward
+
+    async with AsyncSessionLocal() as db:
+        # 列表不显示正文，不读取也不解压
+        query = select(ArticleSummary).options(defer(ArticleSummary.content))
         if search:
-            query = query.filter(
-                ArticleSummary.summary.ilike(f"%{search}%") |
-                ArticleSummary.article_id.ilike(f"%{search}%")
-            )
-        
-        if sort and order:
-            if hasattr(ArticleSummary, sort):
-                order_by = getattr(ArticleSummary, sort)
-                if order == "desc":
-                    order_by = order_by.desc()
-                query = query.order_by(order_by)
+            query = query.where(_search_filter(search))
+
+        if page > 1 and not (cursor or before):
+            # 旧的 ?page=N 链接：按偏移量查出上一页的最后一行，重定向到以它为起点的游标地址
+            last = (await db.scalars(
+                query.order_by(*(column.desc() if descending else column.asc() for column in key))
+                .offset((page - 1) * per_page - 1).limit(1)
+            )).first()
+            if last is None:
+                return RedirectResponse(url=str(request.url.remove_query_params("page")))
+            return RedirectResponse(url=str(request.url.include_query_params(cursor=encode_cursor(last, sort))))
+        page = max(page, 1)
+
+        if cursor or before:
+            value, article_id = decode_cursor(cursor or before, sort)
+            bound = (value,) if sort == 'article_id' else (value, article_id)
+            query = query.where(tuple_(*key) < tuple_(*bound) if descending else tuple_(*key) > tuple_(*bound))
+        query = query.order_by(*(column.desc() if descending else column.asc() for column in key))
+
+        # 多取一行判断是否还有下一页
+        summaries = (await db.scalars(query.limit(per_page + 1))).all()
+        has_more = len(summaries) > per_page
+        summaries = summaries[:per_page]
+        if backward:
+            summaries.reverse()
+            has_next, has_prev = True, has_more
         else:
-            query = query.order_by(ArticleSummary.last_updated.desc())
-        
-        total = query.count()
+            has_next, has_prev = has_more, bool(cursor)
+
+        total = await _count_summaries(db, search)
         total_pages = ceil(total / per_page)
-        
-        summaries = query.offset((page - 1) * per_page).limit(per_page).all()
-        
+        next_cursor = encode_cursor(summaries[-1], sort) if summaries and has_next else None
+        prev_cursor = encode_cursor(summaries[0], sort) if summaries and has_prev else None
+
         # 获取主题列表
         themes = []
         themes_dir = os.path.join(os.getcwd(), 'themes')
@@ -154,6 +248,8 @@ async def admin_dashboard(
                 "summaries": summaries,
                 "page": page,
                 "per_page": per_page,
+                "next_cursor": next_cursor,
+                "prev_cursor": prev_cursor,
                 "total": total,
                 "total_pages": total_pages,
                 "search": search,
@@ -164,8 +260,6 @@ async def admin_dashboard(
                 "current_theme": current_config.get('THEME', 'light')
             }
         )
-    finally:
-        db.close()
 
 @app.get("/logout")
 async def logout():
@@ -178,33 +272,98 @@ async def delete_summary(
     article_id: str,
     username: str = Depends(get_current_user)
 ):
-    db = SessionLocal()
-    try:
-        summary = db.query(ArticleSummary).filter(ArticleSummary.article_id == article_id).first()
+    async with AsyncSessionLocal() as db:
+        summary = await db.get(ArticleSummary, article_id)
         if summary:
-            db.delete(summary)
-            db.commit()
+            await db.delete(summary)
+            await db.commit()
+            summary_cache.delete(article_id)
+            await shared_cache.invalidate((article_id,))
+            search_counts.clear()
             return JSONResponse(content={"status": "success"})
         raise HTTPException(status_code=404, detail="Summary not found")
-    finally:
-        db.close()
 
 @app.post("/api/refresh/{article_id}")
 async def refresh_summary(
     article_id: str,
-    username: str = Depends(get_current_user)
+    username: str = Depends(require_admin)
 ):
-    db = SessionLocal()
-    try:
-        summary = db.query(ArticleSummary).filter(
-            ArticleSummary.article_id == article_id
-        ).first()
+    async with AsyncSessionLocal() as db:
+        summary = await db.get(ArticleSummary, article_id)
         if not summary:
             raise HTTPException(status_code=404, detail="Summary not found")
-        
-        return JSONResponse(content={"status": "success"})
-    finally:
-        db.close()
+
+    # 加入预生成队列，由后台使用保存的正文重新生成
+    await job_queue.enqueue([{"article_id": article_id}], force=True)
+    return JSONResponse(content={"status": "success", "queued": True})
+
+# 预生成队列相关路由
+class JobRequest(BaseModel):
+    article_url: Optional[str] = None
+    article_id: Optional[str] = None
+    last_updated: Optional[str] = None
+    content: Optional[str] = None
+    force: bool = False
+
+@app.get("/api/jobs")
+async def get_jobs(username: str = Depends(require_admin)):
+    """队列进度"""
+    return await job_queue.progress()
+
+@app.post("/api/jobs")
+async def enqueue_job(job: JobRequest, username: str = Depends(require_admin)):
+    """为单篇文章排队生成摘要，未提供正文时使用保存的正文或抓取文章地址"""
+    try:
+        item = {
+            "article_id": job.article_id or extract_article_id(job.article_url or ''),
+            "article_url": job.article_url and check_url(job.article_url),
+            "last_updated": parse_datetime(job.last_updated),
+            "content": job.content,
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await job_queue.enqueue([item], force=job.force)
+    return {"status": "success", "queued": 1}
+
+@app.post("/api/jobs/batch")
+async def enqueue_batch(
+    file: Optional[UploadFile] = File(None),
+    path: Optional[str] = Form(None),
+    username: str = Depends(require_admin)
+):
+    """从上传的 NDJSON 文件或 JOB_IMPORT_DIR 目录中的 sitemap / 订阅源文件批量排队"""
+    if file is not None:
+        data = await file.read()
+    elif path:
+        import_dir = load_config().get('JOB_IMPORT_DIR')
+        if not import_dir:
+            raise HTTPException(status_code=400, detail="未配置 JOB_IMPORT_DIR，只能上传文件")
+        import_dir = os.path.realpath(import_dir)
+        full_path = os.path.realpath(os.path.join(import_dir, path))
+        # 只允许读取导入目录中的文件
+        if os.path.commonpath([import_dir, full_path]) != import_dir or not os.path.isfile(full_path):
+            raise HTTPException(status_code=404, detail="导入目录中没有该文件")
+        with open(full_path, 'rb') as f:
+            data = f.read()
+    else:
+        raise HTTPException(status_code=400, detail="请上传文件或填写文件路径")
+    try:
+        items, errors = parse_batch(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    queued = await job_queue.enqueue(items)
+    return {"status": "success", "queued": queued, "errors": errors[:50], "error_count": len(errors)}
+
+@app.post("/api/jobs/outdated")
+async def enqueue_outdated(username: str = Depends(require_admin)):
+    """重新生成模型或提示词已过期的摘要"""
+    queued = await job_queue.enqueue_outdated(load_config())
+    return {"status": "success", "queued": queued}
+
+@app.delete("/api/jobs")
+async def clear_jobs(username: str = Depends(require_admin)):
+    """清除已完成和已失败的任务"""
+    return {"status": "success", "deleted": await job_queue.clear_finished()}
 
 # 修改配置相关的模型
 class ConfigUpdate(BaseModel):
@@ -214,6 +373,7 @@ class ConfigUpdate(BaseModel):
     CORS_ORIGIN: str
     THEME: str
     MODEL: str  # 添加模型选项
+    MAX_INPUT_TOKENS: Optional[int] = None  # 输入 token 上限
 
 # 添加配置管理路由
 @app.get("/api/config")
@@ -227,58 +387,27 @@ async def get_config(username: str = Depends(get_current_user)):
             {"key": "SYSTEM_CONTENT", "value": config.get('SYSTEM_CONTENT', '')},
             {"key": "CORS_ORIGIN", "value": config.get('CORS_ORIGIN', '')},
             {"key": "THEME", "value": config.get('THEME', 'light')},
-            {"key": "MODEL", "value": config.get('MODEL', 'qwen-plus')}  # 添加模型配置
+            {"key": "MODEL", "value": config.get('MODEL', 'qwen-plus')},  # 添加模型配置
+            {"key": "MAX_INPUT_TOKENS", "value": config.get('MAX_INPUT_TOKENS')}
         ]
     }
 
 def load_config():
-    try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            # 确保配置中包含所有必要的字段
-            default_config = {
-                "DASHSCOPE_API_KEY": "",
-                "BASE_URL": "https://dashscope.aliyuncs.com/compatible-mode/v1",
-                "CORS_ORIGIN": "*",
-                "SYSTEM_CONTENT": "你是一个博客总结助手，用于自动生成博客的读者感兴趣的文章摘要，摘要只介绍最关键内容，不超100字。",
-                "THEME": "light",
-                "MODEL": "qwen-plus",
-                "admin": {
-                    "username": "admin",
-                    "password": "admin"
-                }
-            }
-            # 更新缺失的字段
-            for key, value in default_config.items():
-                if key not in config:
-                    config[key] = value
-            return config
-    except FileNotFoundError:
-        # 如果文件不存在，创建默认配置
-        default_config = {
-            "DASHSCOPE_API_KEY": "",
-            "BASE_URL": "https://dashscope.aliyuncs.com/compatible-mode/v1",
-            "CORS_ORIGIN": "*",
-            "SYSTEM_CONTENT": "你是一个博客总结助手，用于自动生成博客的读者感兴趣的文章摘要，摘要只介绍最关键内容，不超100字。",
-            "THEME": "light",
-            "MODEL": "qwen-plus",
-            "admin": {
-                "username": "admin",
-                "password": "admin"
-            }
-        }
-        save_config(default_config)
-        return default_config
+    """读取配置，返回的字典由缓存共享，修改前请先复制"""
+    return config_store.get()
 
-def save_config(config_data):
-    with open('config.json', 'w', encoding='utf-8') as f:
-        json.dump(config_data, f, ensure_ascii=False, indent=4)
+async def save_config(config_data):
+    config_store.save(config_data)
+    # 通知其他工作进程立即重新读取配置文件
+    await shared_cache.broadcast('config')
 
 @app.post("/api/config")
 async def update_config(config_update: ConfigUpdate, username: str = Depends(get_current_user)):
     """更新配置"""
     try:
+        # 在现有配置上合并，保留管理员账户等未在表单中出现的字段
         config_data = {
+            **load_config(),
             "DASHSCOPE_API_KEY": config_update.DASHSCOPE_API_KEY,
             "BASE_URL": config_update.BASE_URL,
             "SYSTEM_CONTENT": config_update.SYSTEM_CONTENT,
@@ -286,7 +415,9 @@ async def update_config(config_update: ConfigUpdate, username: str = Depends(get
             "THEME": config_update.THEME,
             "MODEL": config_update.MODEL
         }
-        save_config(config_data)
+        if config_update.MAX_INPUT_TOKENS is not None:
+            config_data["MAX_INPUT_TOKENS"] = config_update.MAX_INPUT_TOKENS
+        await save_config(config_data)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Error updating config: {str(e)}")
@@ -295,16 +426,13 @@ async def update_config(config_update: ConfigUpdate, username: str = Depends(get
 @app.delete("/api/config/{key}")
 async def delete_config(key: str, username: str = Depends(get_current_user)):
     """删除配置"""
-    db = SessionLocal()
-    try:
-        config = db.query(SystemConfig).filter(SystemConfig.key == key).first()
+    async with AsyncSessionLocal() as db:
+        config = await db.get(SystemConfig, key)
         if config:
-            db.delete(config)
-            db.commit()
+            await db.delete(config)
+            await db.commit()
             return {"status": "success"}
         raise HTTPException(status_code=404, detail="Config not found")
-    finally:
-        db.close()
 
 # 修改主题管理路由
 @app.get("/api/themes/{theme_name}")
@@ -334,6 +462,8 @@ async def save_theme(
         theme_path = os.path.join(themes_dir, f"{theme_name}.html")
         with open(theme_path, 'w', encoding='utf-8') as f:
             f.write(theme_content.content)
+        theme_store.invalidate()
+        await shared_cache.broadcast('theme')
         
         return {"status": "success"}
     except Exception as e:
@@ -346,47 +476,54 @@ async def delete_theme(theme_name: str, username: str = Depends(get_current_user
     theme_path = os.path.join(os.getcwd(), 'themes', f"{theme_name}.html")
     if os.path.exists(theme_path):
         os.remove(theme_path)
+        theme_store.invalidate()
+        await shared_cache.broadcast('theme')
         return {"status": "success"}
     raise HTTPException(status_code=404, detail="Theme not found")
 
 # 添加统计信息路由
 @app.get("/api/stats")
 async def get_stats(username: str = Depends(get_current_user)):
-    """获取统计信息"""
-    db = SessionLocal()
-    try:
-        # 总摘要数
-        total_summaries = db.query(ArticleSummary).count()
-        
-        # 今日生成的摘要数
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_summaries = db.query(ArticleSummary).filter(
-            ArticleSummary.created_at >= today_start
-        ).count()
-        
-        # 获取最近的摘要
-        recent_summaries = db.query(ArticleSummary)\
-            .order_by(ArticleSummary.last_updated.desc())\
-            .limit(5)\
-            .all()
-        
-        # 获取API调用次数和缓存命中率
-        total_requests = db.query(ArticleSummary).count()  # 总请求数
-        cache_hits = db.query(ArticleSummary).filter(
-            ArticleSummary.from_cache == True  # 需要在模型中添加此字段
-        ).count()
-        
-        # 计算缓存命中率
-        cache_hit_rate = round((cache_hits / total_requests * 100) if total_requests > 0 else 0, 2)
-        
-        # 获取API调用次数（非缓存的请求数）
-        api_calls = total_requests - cache_hits
-        
+    """获取统计信息，计数来自请求事件的汇总表，不扫描摘要表"""
+    events = await event_log.summary()
+    totals = events["totals"]
+    async with AsyncSessionLocal() as db:
+        # 获取最近的摘要（按 last_updated 索引读取）
+        recent_summaries = (await db.scalars(
+            select(ArticleSummary)
+            .options(defer(ArticleSummary.content))
+            .order_by(ArticleSummary.last_updated.desc())
+            .limit(5)
+        )).all()
+
         return {
-            "total_summaries": total_summaries,
-            "today_summaries": today_summaries,
-            "api_calls": api_calls,
-            "cache_hit_rate": cache_hit_rate,
+            "total_summaries": totals["summaries"],
+            # 今日生成（含重新生成）的摘要数
+            "today_summaries": events["today"]["generated"],
+            # 上游模型调用次数
+            "api_calls": totals["llm_calls"],
+            # 摘要请求中直接返回缓存的比例
+            "cache_hit_rate": round(totals["cache_hits"] / totals["requests"] * 100, 2) if totals["requests"] else 0,
+            # 请求、token 和耗时的汇总与趋势
+            "requests": events,
+            # 并发生成合并统计
+            "coalescing": singleflight.get_stats(),
+            # 模型调用并发和排队统计
+            "scheduler": llm_scheduler.get_stats(),
+            # 各上游的熔断状态、故障转移和对冲统计
+            "providers": llm_client.pool.get_stats(),
+            # 预生成队列进度
+            "jobs": await job_queue.progress(),
+            # 当前模型和提示词版本的摘要占比
+            "versions": await job_queue.version_progress(load_config()),
+            # 进程内摘要缓存统计
+            "memory_cache": summary_cache.get_stats(),
+            # 正文指纹比对结果
+            "fingerprint": dict(fingerprint.stats),
+            # 多进程共享缓存的命中和广播统计
+            "shared_cache": shared_cache.get_stats(),
+            # 摘要表的压缩、淘汰和 VACUUM 统计
+            "storage": await storage.get_stats(),
             "recent_summaries": [
                 {
                     "article_id": s.article_id,
@@ -396,8 +533,6 @@ async def get_stats(username: str = Depends(get_current_user)):
                 for s in recent_summaries
             ]
         }
-    finally:
-        db.close()
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -422,7 +557,7 @@ async def update_profile(
     new_password: str = Form(None),
     current_user: str = Depends(get_current_user)
 ):
-    config = load_config()
+    config = copy.deepcopy(load_config())
     
     # 验证当前密码
     if config['admin']['password'] != current_password:
@@ -436,7 +571,7 @@ async def update_profile(
         config['admin']['password'] = new_password
     
     # 保存配置
-    save_config(config)
+    await save_config(config)
     
     # 返回需要登出的信息
     return {"message": "账户信息更新成功", "logout": True}
@@ -5,10 +5,191 @@ const API_CONFIG = {
     BASE_URL: '',
     ENDPOINTS: {
         TEMPLATE: '/api/card-template',
-        SUMMARY: '/api/summary'
+        CARD: '/api/card',
+        LOOKUP: '/api/summary/lookup',
+        SUMMARY: '/api/summary',
+        STREAM: '/api/summary/stream'
     }
 };
 
+// 本地缓存配置：摘要按文章地址和更新时间缓存，超过条数或总大小时淘汰最久未使用的条目
+const CACHE_CONFIG = {
+    PREFIX: 'ai-summary:',
+    MAX_ENTRIES: 200,
+    MAX_BYTES: 1024 * 1024,
+    // 距上次验证超过该时间（毫秒）才在后台向服务器重新验证
+    REVALIDATE_AFTER: 10 * 60 * 1000
+};
+
+// 基于 localStorage 的 LRU 缓存，浏览器禁用存储时所有操作静默失败
+const localCache = {
+    _read(key) {
+        try {
+            return JSON.parse(localStorage.getItem(CACHE_CONFIG.PREFIX + key));
+        } catch (e) {
+            return null;
+        }
+    },
+    _write(key, value) {
+        localStorage.setItem(CACHE_CONFIG.PREFIX + key, JSON.stringify(value));
+    },
+    // 索引记录每个条目的最后使用时间和大小：{ key: [time, size] }
+    index() {
+        return this._read('index') || {};
+    },
+    get(key) {
+        const entry = this._read(key);
+        if (entry) this._touch(key, null);
+        return entry;
+    },
+    set(key, value) {
+        try {
+            this._write(key, value);
+            this._touch(key, JSON.stringify(value).length);
+        } catch (e) {
+            // 超出浏览器配额时清空本脚本的缓存
+            this.clear();
+        }
+    },
+    remove(key) {
+        const index = this.index();
+        delete index[key];
+        try {
+            localStorage.removeItem(CACHE_CONFIG.PREFIX + key);
+            this._write('index', index);
+        } catch (e) { /* 忽略 */ }
+    },
+    clear() {
+        try {
+            Object.keys(this.index()).concat('index').forEach(key => localStorage.removeItem(CACHE_CONFIG.PREFIX + key));
+        } catch (e) { /* 忽略 */ }
+    },
+    _touch(key, size) {
+        const index = this.index();
+        index[key] = [Date.now(), size === null && index[key] ? index[key][1] : (size || 0)];
+        // 淘汰最久未使用的条目
+        const keys = Object.keys(index).sort((a, b) => index[a][0] - index[b][0]);
+        let total = keys.reduce((sum, k) => sum + index[k][1], 0);
+        while (keys.length > 1 && (keys.length > CACHE_CONFIG.MAX_ENTRIES || total > CACHE_CONFIG.MAX_BYTES)) {
+            const oldest = keys.shift();
+            total -= index[oldest][1];
+            delete index[oldest];
+            try { localStorage.removeItem(CACHE_CONFIG.PREFIX + oldest); } catch (e) { /* 忽略 */ }
+        }
+        try { this._write('index', index); } catch (e) { /* 忽略 */ }
+    }
+};
+
+// 文章缓存键：去掉地址中的查询参数和锚点
+function articleKey(articleUrl) {
+    try {
+        const url = new URL(articleUrl, window.location.href);
+        return url.origin + url.pathname;
+    } catch (e) {
+        return articleUrl;
+    }
+}
+
+function summaryKey(articleUrl, lastUpdated) {
+    return `s:${articleKey(articleUrl)}@${lastUpdated}`;
+}
+
+// 保存摘要，同一文章旧的更新时间对应的条目一并删除
+function storeSummary(articleUrl, lastUpdated, summary, etag = null) {
+    const key = summaryKey(articleUrl, lastUpdated);
+    const prefix = `s:${articleKey(articleUrl)}@`;
+    Object.keys(localCache.index())
+        .filter(k => k.startsWith(prefix) && k !== key)
+        .forEach(k => localCache.remove(k));
+    localCache.set(key, { summary, etag, validatedAt: Date.now() });
+}
+
+// 合并相同的进行中请求，SPA 多次触发初始化时只请求一次
+const inflightRequests = new Map();
+
+function dedupe(key, factory) {
+    if (inflightRequests.has(key)) return inflightRequests.get(key);
+    const promise = factory().finally(() => inflightRequests.delete(key));
+    inflightRequests.set(key, promise);
+    return promise;
+}
+
+// 获取主题模板并缓存，带上次的 ETag 时服务器可返回 304
+function loadTemplate(cached = localCache.get('template')) {
+    return dedupe('template', () => fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TEMPLATE}`, {
+        headers: cached && cached.etag ? { 'If-None-Match': cached.etag } : {}
+    }).then(response => {
+        if (response.status === 304 && cached) {
+            localCache.set('template', { ...cached, validatedAt: Date.now() });
+            return { template: cached, changed: false };
+        }
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json().then(data => {
+            const template = { card: data.card, etag: response.headers.get('ETag'), validatedAt: Date.now() };
+            localCache.set('template', template);
+            return { template, changed: true };
+        });
+    }));
+}
+
+// 在主题模板的 .summary 元素中填入摘要，与服务端 ThemeEntry.render 一致
+function renderCard(template, summary) {
+    const container = document.createElement('div');
+    container.innerHTML = template;
+    const summaryElement = container.querySelector('.summary');
+    if (summaryElement) {
+        const existing = summaryElement.querySelector('span[class^="typing-effect"]');
+        const span = document.createElement('span');
+        span.className = existing ? existing.className : 'typing-effect';
+        span.textContent = summary;
+        summaryElement.innerHTML = '';
+        summaryElement.appendChild(span);
+    }
+    return container.innerHTML;
+}
+
+function showCard(card, html) {
+    card.innerHTML = html;
+    addEventListeners(card);
+}
+
+// 后台重新验证本地缓存的模板和摘要，有变化时重新渲染
+function revalidate(card, articleUrl, lastUpdated, cached, template) {
+    const now = Date.now();
+    const templateCheck = now - (template.validatedAt || 0) > CACHE_CONFIG.REVALIDATE_AFTER
+        ? loadTemplate(template).catch(() => ({ template, changed: false }))
+        : Promise.resolve({ template, changed: false });
+    const summaryCheck = now - (cached.validatedAt || 0) > CACHE_CONFIG.REVALIDATE_AFTER
+        ? getLookupParams(articleUrl, lastUpdated)
+            .then(params => fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.LOOKUP}?${params}`, {
+                headers: cached.etag ? { 'If-None-Match': cached.etag } : {}
+            }))
+            .then(response => {
+                if (response.status === 304) {
+                    storeSummary(articleUrl, lastUpdated, cached.summary, cached.etag);
+                    return { summary: cached.summary, changed: false };
+                }
+                if (response.status === 404) {
+                    // 服务器已删除该摘要，下次重新获取
+                    localCache.remove(summaryKey(articleUrl, lastUpdated));
+                    return { summary: cached.summary, changed: false };
+                }
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json().then(data => {
+                    storeSummary(articleUrl, lastUpdated, data.summary, response.headers.get('ETag'));
+                    return { summary: data.summary, changed: data.summary !== cached.summary };
+                });
+            })
+            .catch(() => ({ summary: cached.summary, changed: false }))
+        : Promise.resolve({ summary: cached.summary, changed: false });
+
+    Promise.all([templateCheck, summaryCheck]).then(([templateResult, summaryResult]) => {
+        if ((templateResult.changed || summaryResult.changed) && card.isConnected) {
+            showCard(card, renderCard(templateResult.template.card, summaryResult.summary));
+        }
+    });
+}
+
 // 骨架屏HTML模板
 const skeletonHTML = `
 <div class="card skeleton-theme">
@@ -142,21 +323,82 @@ function createAISummaryCard() {
     postElement.insertBefore(aiSummaryDiv, postElement.firstChild);
     aiSummaryDiv.innerHTML = skeletonHTML;
 
-    // 使用配置的API地址
-    fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TEMPLATE}`)
-        .then(response => response.json())
+    const { lastUpdated, articleUrl } = getArticleMeta();
+    if (!lastUpdated) {
+        console.error('Last updated time not found');
+        isInitializing = false;
+        return;
+    }
+
+    // 本地缓存中有模板和摘要时立即渲染，再在后台重新验证
+    const cached = localCache.get(summaryKey(articleUrl, lastUpdated));
+    const template = localCache.get('template');
+    if (cached && template) {
+        showCard(aiSummaryDiv, renderCard(template.card, cached.summary));
+        isInitializing = false;
+        revalidate(aiSummaryDiv, articleUrl, lastUpdated, cached, template);
+        return;
+    }
+
+    // 一次请求获取卡片，摘要已缓存时卡片中已包含摘要
+    getLookupParams(articleUrl, lastUpdated)
+        .then(params => dedupe(`card:${params}`, () =>
+            fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.CARD}?${params}`).then(response => response.json())
+        ))
         .then(data => {
-            aiSummaryDiv.innerHTML = data.card;
-            addEventListeners(aiSummaryDiv);
-            generateSummary(aiSummaryDiv); // 获取初始摘要
+            showCard(aiSummaryDiv, data.card);
+            if (data.summary && !data.stale) {
+                storeSummary(articleUrl, lastUpdated, data.summary);
+            }
+            if (!template) {
+                // 后台缓存主题模板，下次可直接在本地渲染
+                loadTemplate(null).catch(() => null);
+            }
+            if (data.pending) {
+                // 摘要未缓存，无需再次查询，直接提交文章内容生成
+                generateSummary(aiSummaryDiv, { skipLookup: true });
+            }
             isInitializing = false;
         })
         .catch(error => {
-            console.error('Failed to load card template:', error);
+            console.error('Failed to load card:', error);
             isInitializing = false;
         });
 }
 
+// 计算正文指纹，规则与服务端 fingerprint.normalize 一致；更新时间变化但正文未变时无需重新上传
+function contentHash(text) {
+    if (!window.crypto || !window.crypto.subtle || !window.TextEncoder) {
+        return Promise.resolve(null);
+    }
+    const normalized = text.normalize('NFKC').toLowerCase().replace(/\s+/g, ' ').trim();
+    return window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(normalized))
+        .then(buffer => Array.from(new Uint8Array(buffer))
+            .map(byte => byte.toString(16).padStart(2, '0'))
+            .join(''))
+        .catch(() => null);
+}
+
+// 构造缓存查询参数
+function getLookupParams(articleUrl, lastUpdated) {
+    const params = new URLSearchParams({ article_url: articleUrl, last_updated: lastUpdated });
+    const articleContainer = document.getElementById('article-container');
+    if (!articleContainer) return Promise.resolve(params);
+    return contentHash(articleContainer.innerText).then(hash => {
+        if (hash) params.set('content_hash', hash);
+        return params;
+    });
+}
+
+// 获取文章的最后更新时间和地址
+function getArticleMeta() {
+    // 获取最后更新时间，使用title属性获取完整时间
+    const lastUpdatedIcon = document.querySelector('span.post-meta-date i[title="最后更新时间"]');
+    const lastUpdatedElement = lastUpdatedIcon ? lastUpdatedIcon.nextElementSibling : null;
+    const lastUpdated = lastUpdatedElement ? lastUpdatedElement.getAttribute('title') : null;
+    return { lastUpdated, articleUrl: window.location.href };
+}
+
 // 添加事件监听器
 function addEventListeners(card) {
     const refreshButton = card.querySelector('.refresh-button');
@@ -188,16 +430,11 @@ function handleButtonClick(card, event) {
     }
 }
 
-// 生成摘要的核心函数
-function generateSummary(card) {
+// 生成摘要的核心函数，先按地址和更新时间查询缓存，未命中时才上传文章内容
+function generateSummary(card, { skipLookup = false } = {}) {
     const summaryElement = card.querySelector('.summary');
     const articleContainer = document.querySelector('article.post-content.line-numbers#article-container');
-    
-    // 获取最后更新时间，使用title属性获取完整时间
-    const lastUpdatedElement = document.querySelector('span.post-meta-date i[title="最后更新时间"]').nextElementSibling;
-    const lastUpdated = lastUpdatedElement ? lastUpdatedElement.getAttribute('title') : null;
-    
-    const articleUrl = window.location.href;
+    const { lastUpdated, articleUrl } = getArticleMeta();
 
     if (!articleContainer || !lastUpdated) {
         console.error('Required elements not found', {
@@ -209,28 +446,41 @@ function generateSummary(card) {
         return;
     }
 
-    const articleContent = articleContainer.innerText;
-    console.log("Generating summary for article length:", articleContent.length);
     console.log("Article URL:", articleUrl);
     console.log("Last updated:", lastUpdated);
     
     summaryElement.innerHTML = '<span class="loading"></span>正在生成AI摘要...';
 
-    // 使用配置的API地址
-    fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.SUMMARY}`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            message: articleContent,
-            last_updated: lastUpdated,
-            article_url: articleUrl
-        })
-    })
-    .then(response => response.json())
+    const lookup = skipLookup
+        ? Promise.resolve(null)
+        : getLookupParams(articleUrl, lastUpdated)
+            .then(params => fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.LOOKUP}?${params}`))
+            .then(response => response.ok
+                ? response.json().then(data => ({ ...data, etag: response.headers.get('ETag') }))
+                : null)
+            .catch(() => null);
+
+    const payload = {
+        message: articleContainer.innerText,
+        last_updated: lastUpdated,
+        article_url: articleUrl
+    };
+
+    // 同一文章同时只生成一次，重复点击或重复初始化共用同一个请求
+    dedupe(`summary:${summaryKey(articleUrl, lastUpdated)}`, () => lookup
+        .then(cached => cached || streamSummary(payload, partial => {
+            // 边生成边显示
+            summaryElement.innerHTML = '<span class="typing-effect"></span>';
+            summaryElement.firstChild.textContent = partial;
+        })))
     .then(data => {
         if (data.summary) {
             console.log("Summary received, length:", data.summary.length);
-            summaryElement.innerHTML = `<span class="typing-effect">${data.summary}</span>`;
+            if (!data.stale) {
+                storeSummary(articleUrl, lastUpdated, data.summary, data.etag || null);
+            }
+            summaryElement.innerHTML = '<span class="typing-effect"></span>';
+            summaryElement.firstChild.textContent = data.summary;
         } else {
             throw new Error('No summary in response');
         }
@@ -241,6 +491,60 @@ function generateSummary(card) {
     });
 }
 
+// 通过 SSE 接收摘要，每收到一段就回调一次，浏览器不支持流式读取时退回普通请求
+function streamSummary(payload, onPartial) {
+    return fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.STREAM}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify(payload)
+    }).then(response => {
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        if (!response.body || !window.TextDecoder) {
+            return fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.SUMMARY}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            }).then(res => res.json());
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+
+        const handleEvent = (block) => {
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) return null;
+            const parsed = JSON.parse(data);
+            if (event === 'delta') {
+                text += parsed.delta;
+                onPartial(text);
+                return null;
+            }
+            if (event === 'error') throw new Error(parsed.detail);
+            return event === 'done' ? parsed : null;
+        };
+
+        const read = () => reader.read().then(({ done, value }) => {
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const blocks = buffer.split('\n\n');
+            buffer = blocks.pop();
+            for (const block of blocks) {
+                const result = handleEvent(block);
+                if (result) return result;
+            }
+            if (done) return { summary: text };
+            return read();
+        });
+        return read();
+    });
+}
+
 // 检查并初始化
 function checkAndInitialize() {
     // 如果正在初始化或者已经存在摘要卡片，则不执行
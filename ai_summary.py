@@ -1,87 +1,160 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import openai
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 from datetime import datetime
-from models import SessionLocal, ArticleSummary
-import re
-import os
+import asyncio
+import hashlib
+import json
+import logging
 from admin import load_config  # 导入配置加载函数
+from config_store import config_store
+from scheduler import SchedulerBusy, background
+from metrics import JSONResponse, record_error
+from cache import summary_cache
+from events import event_log
+from themes import theme_store
+from summaries import (
+    extract_article_id, reuse_if_unchanged, get_cached_summary, mark_from_cache,
+    get_cached_summaries, mark_many_from_cache, generate_and_store, open_summary_stream, lookup_fresh, revalidate_summary
+)
+
+logger = logging.getLogger(__name__)
 
 # 添加 Article 模型类定义
 class Article(BaseModel):
     id: str
     content: str
 
-app = FastAPI()
+class BatchArticle(BaseModel):
+    id: str
+    content: str
+    last_updated: Optional[str] = None
 
-# 加载初始配置
-config = load_config()
+class BatchRequest(BaseModel):
+    items: List[BatchArticle]
 
-# CORS设置
-if config['CORS_ORIGIN'] == "*":
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-elif isinstance(config['CORS_ORIGIN'], list):
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=config['CORS_ORIGIN'],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-else:
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=[config['CORS_ORIGIN']],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
+app = FastAPI(default_response_class=JSONResponse)
+
+def configure_cache(config):
+    """按配置设置进程内摘要缓存，由应用启动时和配置变化时调用"""
+    summary_cache.configure(config['SUMMARY_CACHE_SIZE'], config['SUMMARY_CACHE_TTL'])
+
+def _on_config_change(old_config, new_config):
+    configure_cache(new_config)
+
+config_store.subscribe(_on_config_change)
+
+@app.exception_handler(SchedulerBusy)
+async def scheduler_busy_handler(request: Request, exc: SchedulerBusy):
+    """模型调用排队已满或超时，提示客户端稍后重试"""
+    record_error('scheduler', exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "摘要服务繁忙，请稍后重试。"},
+        headers={"Retry-After": str(exc.retry_after)}
     )
 
-# 初始化OpenAI客户端
-client = openai.OpenAI(
-    api_key=config['DASHSCOPE_API_KEY'],
-    base_url=config['BASE_URL']
-)
+class ConfiguredCORSMiddleware:
+    """按 CORS_ORIGIN 设置跨域，导入模块时不读取配置；配置变化后重新创建，修改后无需重启"""
+
+    def __init__(self, app):
+        self.app = app
+        self._cors = None
+        self._version = None
+
+    def _build(self, config):
+        origins = config['CORS_ORIGIN']
+        return CORSMiddleware(
+            self.app,
+            allow_origins=origins if isinstance(origins, list) else [origins],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["X-Summary-Stale", "ETag", "Retry-After"],
+        )
+
+    async def __call__(self, scope, receive, send):
+        config = load_config()
+        if self._cors is None or self._version != config_store.version:
+            self._cors = self._build(config)
+            self._version = config_store.version
+        await self._cors(scope, receive, send)
+
+# CORS设置
+app.add_middleware(ConfiguredCORSMiddleware)
 
 def get_theme_template(theme):
-    template_path = os.path.join(os.getcwd(), 'themes', f"{theme}.html")
-    if os.path.exists(template_path):
-        with open(template_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    else:
-        default_template_path = os.path.join(os.getcwd(), 'themes', 'light.html')
-        with open(default_template_path, 'r', encoding='utf-8') as f:
-            return f.read()
+    return theme_store.get(theme).content
 
 @app.get("/card-template")
-async def get_card_template():
-    # 重新加载配置以获取最新的主题设置
+async def get_card_template(request: Request):
+    # 配置和主题均已缓存，响应体预先压缩并带有 ETag
     current_config = load_config()
-    template = get_theme_template(current_config['THEME'])
-    return JSONResponse(content={"card": template})
+    entry = theme_store.get(current_config['THEME'])
+    return entry.response(request, current_config['THEME_CACHE_MAX_AGE'])
 
 class ChatRequest(BaseModel):
     message: str
     last_updated: str
     article_url: str
 
-def extract_article_id(url: str) -> str:
-    """从URL中提取文章ID"""
-    match = re.search(r'/archives/([^/]+)/?$', url)
-    if match:
-        return match.group(1)
-    raise ValueError("无法从URL中提取文章ID")
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def parse_lookup(article_url: str, last_updated: str):
+    """解析查询参数中的文章ID和更新时间"""
+    try:
+        return extract_article_id(article_url), datetime.strptime(last_updated, "%Y-%m-%d %H:%M:%S")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def summary_etag(summary: str) -> str:
+    return '"' + hashlib.sha1(summary.encode('utf-8')).hexdigest() + '"'
+
+@app.api_route("/summary/lookup", methods=["GET", "HEAD"])
+async def lookup_summary(request: Request, article_url: str, last_updated: str, content_hash: str = None):
+    """只按文章地址和更新时间查询缓存，未命中时返回 404，客户端再提交文章内容"""
+    article_id, last_updated_time = parse_lookup(article_url, last_updated)
+    cached_summary, _ = await lookup_fresh(article_id, last_updated_time, content_hash)
+    if cached_summary:
+        # 未命中时客户端随后提交正文，由 /summary 计数，这里只记录命中
+        event_log.request('lookup', 'hit', article_id)
+        # 客户端用 ETag 重新验证本地缓存的摘要，摘要未变时返回 304
+        headers = {"ETag": summary_etag(cached_summary.summary)}
+        if headers["ETag"] in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+        if request.method == "HEAD":
+            return Response(status_code=200, headers=headers)
+        return JSONResponse(content={"summary": cached_summary.summary}, headers=headers)
+    if request.method == "HEAD":
+        return Response(status_code=404)
+    return JSONResponse(status_code=404, content={"detail": "摘要需要生成", "need_content": True})
+
+@app.get("/card")
+async def get_card(article_url: str, last_updated: str, content_hash: str = None):
+    """一次请求返回卡片，摘要已缓存时直接填入卡片"""
+    article_id, last_updated_time = parse_lookup(article_url, last_updated)
+
+    current_config = load_config()
+    entry = theme_store.get(current_config['THEME'])
+    fresh_summary, cached_summary = await lookup_fresh(article_id, last_updated_time, content_hash)
+    if fresh_summary:
+        event_log.request('card', 'hit', article_id)
+        return JSONResponse(content={
+            "card": entry.render(fresh_summary.summary),
+            "summary": fresh_summary.summary
+        })
+
+    # 未命中缓存：客户端随后提交文章内容生成摘要
+    content = {"card": entry.content, "pending": True}
+    if cached_summary and current_config.get('STALE_WHILE_REVALIDATE'):
+        content.update(card=entry.render(cached_summary.summary), summary=cached_summary.summary, stale=True)
+    return JSONResponse(content=content)
 
 @app.post("/summary")
-async def chat(request: Request, chat_request: ChatRequest):
+async def chat(request: Request, chat_request: ChatRequest, background_tasks: BackgroundTasks):
     print(f"请求来源: {request.client.host}")
     
     try:
@@ -90,94 +163,198 @@ async def chat(request: Request, chat_request: ChatRequest):
         
         last_updated = datetime.strptime(chat_request.last_updated, "%Y-%m-%d %H:%M:%S")
         
-        db = SessionLocal()
-        try:
-            cached_summary = db.query(ArticleSummary).filter(
-                ArticleSummary.article_id == article_id
-            ).first()
+        cached_summary = await get_cached_summary(article_id, last_updated)
+        if cached_summary and cached_summary.last_updated >= last_updated:
+            print("上次更新时间:", cached_summary.last_updated)
+            print("返回的文章更新时间:", last_updated)
+            print("返回缓存的摘要")
+            event_log.request('summary', 'hit', article_id)
+            return JSONResponse(content={"summary": cached_summary.summary})
 
-            if cached_summary and cached_summary.last_updated >= last_updated:
-                print("上次更新时间:", cached_summary.last_updated)
-                print("返回的文章更新时间:", last_updated)
-                print("返回缓存的摘要")
-                return JSONResponse(content={"summary": cached_summary.summary})
+        # 加载配置获取模型设置
+        config = load_config()
+
+        if cached_summary and await reuse_if_unchanged(
+            article_id, cached_summary, chat_request.message, last_updated, config
+        ):
+            print("正文未变化，沿用缓存的摘要")
+            event_log.request('summary', 'hit', article_id)
+            return JSONResponse(content={"summary": cached_summary.summary})
+
+        if cached_summary and config.get('STALE_WHILE_REVALIDATE'):
+            # 先返回旧摘要，在后台重新生成，下一位访客即可拿到新摘要
+            print("返回过期摘要并在后台刷新")
+            event_log.request('summary', 'stale', article_id)
+            background_tasks.add_task(
+                revalidate_summary, article_id, last_updated, chat_request.message, config,
+                chat_request.article_url
+            )
+            return JSONResponse(
+                content={"summary": cached_summary.summary, "stale": True},
+                headers={"X-Summary-Stale": "1"}
+            )
 
+        try:
             print("开始生成新摘要")
-            # 加载配置获取模型设置
-            config = load_config()
-            completion = client.chat.completions.create(
-                model=config['MODEL'],  # 使用配置中的模型设置
-                messages=[
-                    {"role": "system", "content": config['SYSTEM_CONTENT']},
-                    {"role": "user", "content": chat_request.message}
-                ]
+            summary = await generate_and_store(
+                article_id, last_updated, chat_request.message, config, chat_request.article_url
             )
-            summary = completion.choices[0].message.content
             print("生成的摘要:", summary)
-
-            if cached_summary:
-                cached_summary.summary = summary
-                cached_summary.last_updated = last_updated
-            else:
-                cached_summary = ArticleSummary(
-                    article_id=article_id,
-                    last_updated=last_updated,
-                    summary=summary
-                )
-                db.add(cached_summary)
-
-            db.commit()
+            event_log.request('summary', 'miss', article_id)
             return JSONResponse(content={"summary": summary})
 
+        except SchedulerBusy:
+            event_log.request('summary', 'error', article_id)
+            raise
         except Exception as error:
-            db.rollback()
+            record_error('generate', error)
+            event_log.request('summary', 'error', article_id)
             print("错误:", str(error))
             raise HTTPException(status_code=500, detail="处理请求时发生错误。")
-        finally:
-            db.close()
             
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/summary/stream")
+async def chat_stream(chat_request: ChatRequest, background_tasks: BackgroundTasks):
+    """以 SSE 推送摘要，未命中缓存时边生成边推送"""
+    article_id, last_updated = parse_lookup(chat_request.article_url, chat_request.last_updated)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    cached_summary = await get_cached_summary(article_id, last_updated)
+    if cached_summary and cached_summary.last_updated >= last_updated:
+        event_log.request('stream', 'hit', article_id)
+        body = sse_event("done", {"summary": cached_summary.summary})
+        return StreamingResponse(iter([body]), media_type="text/event-stream", headers=headers)
+
+    config = load_config()
+    if cached_summary and await reuse_if_unchanged(
+        article_id, cached_summary, chat_request.message, last_updated, config
+    ):
+        event_log.request('stream', 'hit', article_id)
+        body = sse_event("done", {"summary": cached_summary.summary})
+        return StreamingResponse(iter([body]), media_type="text/event-stream", headers=headers)
+
+    if cached_summary and config.get('STALE_WHILE_REVALIDATE'):
+        event_log.request('stream', 'stale', article_id)
+        background_tasks.add_task(
+            revalidate_summary, article_id, last_updated, chat_request.message, config,
+            chat_request.article_url
+        )
+        body = sse_event("done", {"summary": cached_summary.summary, "stale": True})
+        return StreamingResponse(iter([body]), media_type="text/event-stream", headers=headers)
+
+    chunks = open_summary_stream(
+        article_id, last_updated, chat_request.message, config, chat_request.article_url
+    )
+
+    async def events():
+        parts = []
+        try:
+            async for delta in chunks:
+                parts.append(delta)
+                yield sse_event("delta", {"delta": delta})
+            yield sse_event("done", {"summary": "".join(parts)})
+            event_log.request('stream', 'miss', article_id)
+        except SchedulerBusy as error:
+            record_error('scheduler', error)
+            event_log.request('stream', 'error', article_id)
+            yield sse_event("error", {"detail": "摘要服务繁忙，请稍后重试。", "retry_after": error.retry_after})
+        except Exception as error:
+            record_error('generate', error)
+            event_log.request('stream', 'error', article_id)
+            logger.warning("流式生成摘要失败: %s: %s", article_id, error, exc_info=error)
+            yield sse_event("error", {"detail": "处理请求时发生错误。"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 @app.post("/api/summary")
 async def generate_summary(article: Article):
     """
     生成文章摘要的API端点
     """
-    db = SessionLocal()
+    # 检查缓存
+    cached_summary = await get_cached_summary(article.id)
+    if cached_summary:
+        if not cached_summary.from_cache:
+            await mark_from_cache(article.id)
+            summary_cache.set(article.id, cached_summary._replace(from_cache=True))
+        event_log.request('api', 'hit', article.id)
+        return {"summary": cached_summary.summary}
+
+    # 加载配置获取模型设置
+    config = load_config()
+    # 调用 AI API 生成摘要并保存到数据库
     try:
-        # 检查缓存
-        cached_summary = db.query(ArticleSummary).filter(
-            ArticleSummary.article_id == article.id
-        ).first()
-        
-        if cached_summary:
-            cached_summary.from_cache = True
-            db.commit()
-            return {"summary": cached_summary.summary}
-        
-        # 加载配置获取模型设置
-        config = load_config()
-        # 调用 AI API 生成摘要
-        completion = client.chat.completions.create(
-            model=config['MODEL'],  # 使用配置中的模型设置
-            messages=[
-                {"role": "system", "content": config['SYSTEM_CONTENT']},
-                {"role": "user", "content": article.content}
+        summary = await generate_and_store(article.id, None, article.content, config)
+    except Exception:
+        event_log.request('api', 'error', article.id)
+        raise
+    event_log.request('api', 'miss', article.id)
+
+    return {"summary": summary}
+
+async def _batch_item(item: BatchArticle, last_updated, cached_summary, config: dict, semaphore):
+    """处理批量请求中的一篇未命中文章，错误只影响该文章"""
+    try:
+        if cached_summary and await reuse_if_unchanged(item.id, cached_summary, item.content, last_updated, config):
+            event_log.request('batch', 'hit', item.id, timed=False)
+            return {"id": item.id, "summary": cached_summary.summary, "cached": True}
+        async with semaphore:
+            summary = await generate_and_store(item.id, last_updated, item.content, config)
+        event_log.request('batch', 'miss', item.id, timed=False)
+        return {"id": item.id, "summary": summary, "cached": False}
+    except Exception as error:
+        record_error('batch', error)
+        event_log.request('batch', 'error', item.id, timed=False)
+        logger.warning("批量生成摘要失败: %s: %s", item.id, error, exc_info=error)
+        detail = "摘要服务繁忙，请稍后重试。" if isinstance(error, SchedulerBusy) else "处理请求时发生错误。"
+        return {"id": item.id, "error": detail}
+
+@app.post("/api/summary/batch")
+async def generate_summary_batch(batch: BatchRequest):
+    """
+    批量生成文章摘要，以 NDJSON 逐行返回结果：缓存命中的文章先返回，其余按完成顺序返回
+    """
+    config = load_config()
+    if len(batch.items) > int(config['BATCH_MAX_ITEMS']):
+        raise HTTPException(status_code=413, detail=f"单次最多提交 {config['BATCH_MAX_ITEMS']} 篇文章")
+
+    lines, hits, misses = [], {}, []
+    cached_summaries = await get_cached_summaries([item.id for item in batch.items])
+    for item in batch.items:
+        try:
+            last_updated = datetime.strptime(item.last_updated, "%Y-%m-%d %H:%M:%S") if item.last_updated else None
+        except ValueError as e:
+            event_log.request('batch', 'error', item.id, timed=False)
+            lines.append({"id": item.id, "error": str(e)})
+            continue
+        cached_summary = cached_summaries.get(item.id)
+        # 与 /api/summary 一致：未提供更新时间时，已有摘要即视为命中
+        if cached_summary and (last_updated is None or cached_summary.last_updated >= last_updated):
+            hits[item.id] = cached_summary
+            event_log.request('batch', 'hit', item.id, timed=False)
+            lines.append({"id": item.id, "summary": cached_summary.summary, "cached": True})
+        else:
+            misses.append((item, last_updated, cached_summary))
+    await mark_many_from_cache(hits)
+
+    async def results():
+        for line in lines:
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        semaphore = asyncio.Semaphore(int(config['BATCH_CONCURRENCY']))
+        # 批量请求的模型调用排在访客请求之后
+        with background():
+            tasks = [
+                asyncio.ensure_future(_batch_item(item, last_updated, cached_summary, config, semaphore))
+                for item, last_updated, cached_summary in misses
             ]
-        )
-        summary = completion.choices[0].message.content
-        
-        # 保存到数据库
-        db_summary = ArticleSummary(
-            article_id=article.id,
-            summary=summary,
-            last_updated=datetime.utcnow(),
-            from_cache=False
-        )
-        db.add(db_summary)
-        db.commit()
-        
-        return {"summary": summary}
-    finally:
-        db.close()
\ No newline at end of file
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消尚未开始的文章，已开始的生成会继续完成并写入缓存
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
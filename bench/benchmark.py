@@ -0,0 +1,365 @@
+"""可复现的混合流量基准测试
+
+启动本地模拟 LLM 服务和 main:app，按固定随机种子回放混合流量：热门文章（缓存命中）、冷门文章、
+更新时间变化的文章、超长正文、流式摘要、卡片模板和管理后台。输出 RPS、p50/p95/p99 延迟和
+每个请求的模型调用次数，并把结果写成 JSON，便于在不同提交之间比较。
+
+    python bench/benchmark.py --requests 2000 --concurrency 20 --output bench-results/head.json
+    python bench/benchmark.py --error-rate 0.05 --jitter 0.5 --compare bench-results/base.json
+
+流量比例可以用 --mix 调整，例如 --mix hot=80,cold=10,card=10。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from load_test import ROOT, _prepare_workdir, _wait_ready
+
+DEFAULT_MIX = "hot=60,cold=8,edited=8,long=2,stream=4,card=15,admin=3"
+BASE_TIME = datetime(2024, 1, 1)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"未知的流量类型: {name}，可选 {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, quantile):
+    """最近秩法计算分位数，ordered 需已排序"""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(quantile * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _latency_summary(latencies):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(ordered, 0.50), 2),
+        "p95": round(percentile(ordered, 0.95), 2),
+        "p99": round(percentile(ordered, 0.99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+class Traffic:
+    """按随机种子生成请求序列，并记录各文章当前的更新时间和正文"""
+
+    def __init__(self, args):
+        self.random = random.Random(args.seed)
+        self.args = args
+        self.articles = {
+            f"hot-{i}": [BASE_TIME, self._body(f"hot-{i}", args.body_chars)] for i in range(args.hot_articles)
+        }
+        # 热门程度近似 Zipf 分布，排名靠前的文章被访问得更多
+        self.hot_ids = list(self.articles)
+        self.hot_weights = [1 / (rank + 1) for rank in range(len(self.hot_ids))]
+        self.counter = 0
+        self.etag = None
+
+    def _body(self, article_id, chars):
+        sentence = f"这是文章 {article_id} 的一段正文，用于模拟博客内容。"
+        return (sentence * (chars // len(sentence) + 1))[:chars]
+
+    def _new_id(self, prefix):
+        self.counter += 1
+        return f"{prefix}-{self.args.seed}-{self.counter}"
+
+    def _payload(self, article_id, last_updated, content):
+        return {
+            "message": content,
+            "last_updated": last_updated.strftime("%Y-%m-%d %H:%M:%S"),
+            "article_url": f"https://blog.example.com/archives/{article_id}",
+        }
+
+    def warmup(self):
+        """预热请求：生成全部热门文章的摘要"""
+        return [self._payload(article_id, *self.articles[article_id]) for article_id in self.hot_ids]
+
+    def plan(self, mix, count):
+        names = list(mix)
+        return self.random.choices(names, weights=[mix[name] for name in names], k=count)
+
+    def request(self, operation):
+        """返回 (方法, 路径, 关键字参数)"""
+        if operation == 'hot':
+            article_id = self.random.choices(self.hot_ids, weights=self.hot_weights)[0]
+            last_updated, content = self.articles[article_id]
+            return 'POST', '/api/summary', {"json": self._payload(article_id, last_updated, content)}
+        if operation == 'cold':
+            article_id = self._new_id('cold')
+            return 'POST', '/api/summary', {"json": self._payload(
+                article_id, BASE_TIME, self._body(article_id, self.args.body_chars))}
+        if operation == 'edited':
+            # 一半只改更新时间（正文指纹命中），一半修改正文
+            article_id = self.random.choice(self.hot_ids)
+            state = self.articles[article_id]
+            state[0] += timedelta(minutes=1)
+            if self.random.random() < 0.5:
+                state[1] = self._body(f"{article_id}-{state[0]:%H%M}", self.args.body_chars)
+            return 'POST', '/api/summary', {"json": self._payload(article_id, state[0], state[1])}
+        if operation == 'long':
+            article_id = self._new_id('long')
+            return 'POST', '/api/summary', {"json": self._payload(
+                article_id, BASE_TIME, self._body(article_id, self.args.long_chars))}
+        if operation == 'stream':
+            article_id = self._new_id('stream')
+            return 'STREAM', '/api/summary/stream', {"json": self._payload(
+                article_id, BASE_TIME, self._body(article_id, self.args.body_chars))}
+        if operation == 'card':
+            # 一半请求带上次响应的 ETag，模拟浏览器缓存
+            return 'CARD', '/api/card-template', {"conditional": self.random.random() < 0.5}
+        if operation == 'admin':
+            params = {"page": 1}
+            if self.random.random() < 0.3:
+                params["search"] = self.random.choice(self.hot_ids)
+            return 'GET', '/admin/dashboard', {"params": params}
+        raise ValueError(operation)
+
+
+OPERATIONS = ('hot', 'cold', 'edited', 'long', 'stream', 'card', 'admin')
+
+
+async def _send(client, traffic, method, path, kwargs):
+    if method == 'STREAM':
+        async with client.stream('POST', path, **kwargs) as response:
+            body = b"".join([chunk async for chunk in response.aiter_bytes()])
+        # 流式接口出错时仍返回 200，错误以 SSE error 事件下发
+        return 'sse_error' if b"event: error" in body else response.status_code
+    if method == 'CARD':
+        headers = {"If-None-Match": traffic.etag} if kwargs["conditional"] and traffic.etag else {}
+        response = await client.get(path, headers=headers)
+        if response.headers.get('etag'):
+            traffic.etag = response.headers['etag']
+        return response.status_code
+    response = await client.request(method, path, **kwargs)
+    return response.status_code
+
+
+async def _stub_stats(stub_url):
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{stub_url}/stats")).json()
+
+
+async def _login(client):
+    response = await client.post('/admin/login', data={"username": "admin", "password": "admin"},
+                                 follow_redirects=False)
+    token = response.cookies.get('access_token')
+    if token is None:
+        raise RuntimeError("管理后台登录失败，admin 流量无法测量")
+    client.cookies.set('access_token', token)
+
+
+async def run(args, app_url, stub_url):
+    traffic = Traffic(args)
+    warmup_payloads = traffic.warmup()
+    plan = traffic.plan(_parse_mix(args.mix), args.requests)
+    # 请求内容也提前生成，保证同一种子下的请求序列完全一致
+    requests = [(operation, *traffic.request(operation)) for operation in plan]
+
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as client:
+        if 'admin' in plan:
+            await _login(client)
+        # 预热：生成热门文章的摘要，不计入结果
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def warmup(payload):
+            async with semaphore:
+                await client.post('/api/summary', json=payload)
+
+        await asyncio.gather(*(warmup(payload) for payload in warmup_payloads))
+
+        before = await _stub_stats(stub_url)
+        results = {operation: {"latencies": [], "status": {}, "errors": 0} for operation in OPERATIONS}
+        queue = iter(requests)
+
+        async def worker():
+            for operation, method, path, kwargs in queue:
+                result = results[operation]
+                start = time.perf_counter()
+                try:
+                    status = await _send(client, traffic, method, path, kwargs)
+                except httpx.HTTPError as error:
+                    status = type(error).__name__
+                result["latencies"].append((time.perf_counter() - start) * 1000)
+                result["status"][str(status)] = result["status"].get(str(status), 0) + 1
+                if not isinstance(status, int) or status >= 500:
+                    result["errors"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - started
+        after = await _stub_stats(stub_url)
+
+    latencies = [value for result in results.values() for value in result["latencies"]]
+    llm_calls = after["calls"] - before["calls"]
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "params": {name: value for name, value in vars(args).items() if name not in ('output', 'compare')},
+        "duration_s": round(duration, 3),
+        "requests": len(latencies),
+        "rps": round(len(latencies) / duration, 2),
+        "errors": sum(result["errors"] for result in results.values()),
+        "latency_ms": _latency_summary(latencies),
+        "llm": {
+            "calls": llm_calls,
+            "calls_per_request": round(llm_calls / len(latencies), 4) if latencies else 0,
+            "errors": after["errors"] - before["errors"],
+            "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+            "completion_tokens": after["completion_tokens"] - before["completion_tokens"],
+        },
+        "operations": {
+            operation: {
+                "count": len(result["latencies"]),
+                "errors": result["errors"],
+                "status": result["status"],
+                "latency_ms": _latency_summary(result["latencies"]),
+            }
+            for operation, result in results.items() if result["latencies"]
+        },
+    }
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def _format(value):
+    return f"{value:9.2f}" if value is not None else f"{'-':>9}"
+
+
+def report(result):
+    print(f"提交 {result['commit']}，{result['requests']} 个请求，耗时 {result['duration_s']}s，"
+          f"{result['rps']} req/s，错误 {result['errors']}")
+    llm = result["llm"]
+    print(f"模型调用 {llm['calls']} 次（每请求 {llm['calls_per_request']}），上游错误 {llm['errors']}，"
+          f"token {llm['prompt_tokens']} + {llm['completion_tokens']}")
+    print(f"{'类型':<8}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    rows = list(result["operations"].items()) + [("total", {
+        "count": result["requests"], "errors": result["errors"], "latency_ms": result["latency_ms"]})]
+    for name, op in rows:
+        latency = op["latency_ms"]
+        print(f"{name:<8}{op['count']:>8}{op['errors']:>6} {_format(latency['p50'])} "
+              f"{_format(latency['p95'])} {_format(latency['p99'])}")
+
+
+def compare(result, baseline, max_regression, min_samples=20):
+    """与基线结果比较，吞吐下降或 p95 上升超过 max_regression 时视为退化"""
+    print(f"\n与基线 {baseline.get('commit')}（{baseline.get('timestamp')}）比较:")
+    regressions = []
+
+    def change(new, old):
+        return (new - old) / old if old else 0.0
+
+    rps_change = change(result["rps"], baseline["rps"])
+    print(f"{'rps':<16}{baseline['rps']:>10} -> {result['rps']:<10} {rps_change:+.1%}")
+    if rps_change < -max_regression:
+        regressions.append("rps")
+    rows = [("total", result, baseline)] + [
+        (name, op, baseline.get("operations", {}).get(name)) for name, op in result["operations"].items()
+    ]
+    for name, new, old in rows:
+        if not old:
+            continue
+        new_p95, old_p95 = new["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        if new_p95 is None or old_p95 is None:
+            continue
+        p95_change = change(new_p95, old_p95)
+        print(f"{name + ' p95':<16}{old_p95:>10} -> {new_p95:<10} {p95_change:+.1%}")
+        samples = new.get("count", result["requests"])
+        if p95_change > max_regression and samples >= min_samples:
+            regressions.append(f"{name} p95")
+    if regressions:
+        print(f"FAIL: 超过 {max_regression:.0%} 的退化: {', '.join(regressions)}")
+        return 1
+    print("OK: 未发现明显退化")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="测量阶段的请求总数")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="各类流量的权重")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子，相同种子生成相同的请求序列")
+    parser.add_argument("--hot-articles", type=int, default=50, help="预热的热门文章数")
+    parser.add_argument("--body-chars", type=int, default=2000, help="普通文章的正文长度")
+    parser.add_argument("--long-chars", type=int, default=40000, help="超长文章的正文长度，会触发分段摘要")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟上游延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="上游延迟的随机浮动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上游返回 500 的比例")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="上游流式输出中途断开的比例")
+    parser.add_argument("--app-config", default="{}", help="额外的 config.json 字段（JSON）")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=9101)
+    parser.add_argument("--output", help="结果 JSON 的保存路径")
+    parser.add_argument("--compare", help="作为基线的结果 JSON")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+    _parse_mix(args.mix)
+
+    workdir = _prepare_workdir(args.stub_port, json.loads(args.app_config))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "bench", "stub_llm.py"),
+        "--port", str(args.stub_port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--stream-error-rate", str(args.stream_error_rate),
+        "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--port", str(args.app_port), "--log-level", "warning",
+    ], cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    try:
+        asyncio.run(_wait_ready(f"{stub_url}/stats"))
+        asyncio.run(_wait_ready(f"{app_url}/api/card-template"))
+        result = asyncio.run(run(args, app_url, stub_url))
+    finally:
+        for process in (server, stub):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            sys.exit(compare(result, json.load(f), args.max_regression))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""写入进行中的读取吞吐压测
+
+在临时数据库上，让若干写入协程持续保存摘要，同时统计读取协程的吞吐和延迟，
+对比 WAL 与默认 DELETE 日志模式。
+
+    python bench/db_bench.py --duration 5 --writers 4 --readers 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在临时目录中导入 models，避免在仓库中创建 config.json 和数据库
+os.chdir(tempfile.mkdtemp(prefix="ai-summary-db-bench-"))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa: E402
+
+from models import ArticleSummary, Base, make_async_engine  # noqa: E402
+
+
+async def _seed(session_factory, rows):
+    async with session_factory() as db:
+        for i in range(rows):
+            db.add(ArticleSummary(
+                article_id=f"article-{i}",
+                last_updated=datetime(2024, 1, 1),
+                summary="摘要内容。" * 40
+            ))
+        await db.commit()
+
+
+async def _writer(session_factory, rows, stop, stats):
+    i = 0
+    while not stop.is_set():
+        try:
+            async with session_factory() as db:
+                await db.merge(ArticleSummary(
+                    article_id=f"article-{i % rows}",
+                    last_updated=datetime.utcnow(),
+                    summary=f"更新后的摘要 {i}。" * 40
+                ))
+                await db.commit()
+            stats["writes"] += 1
+        except OperationalError:
+            stats["write_errors"] += 1
+        i += 1
+        await asyncio.sleep(0)
+
+
+async def _reader(session_factory, rows, stop, latencies, stats):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            async with session_factory() as db:
+                result = await db.execute(select(ArticleSummary.summary).where(
+                    ArticleSummary.article_id == f"article-{i % rows}"
+                ))
+                result.scalar_one_or_none()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except OperationalError:
+            stats["read_errors"] += 1
+        i += 7
+
+
+async def run_mode(journal_mode, args):
+    path = os.path.abspath(f"bench-{journal_mode.lower()}.db")
+    engine = make_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        journal_mode=journal_mode,
+        busy_timeout=args.busy_timeout,
+        pool_size=args.readers + args.writers,
+        max_overflow=0
+    )
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await _seed(session_factory, args.rows)
+
+    stop = asyncio.Event()
+    latencies = []
+    stats = {"writes": 0, "write_errors": 0, "read_errors": 0}
+    tasks = [asyncio.create_task(_writer(session_factory, args.rows, stop, stats)) for _ in range(args.writers)]
+    tasks += [
+        asyncio.create_task(_reader(session_factory, args.rows, stop, latencies, stats))
+        for _ in range(args.readers)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await engine.dispose()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{journal_mode:<7} reads/s={len(latencies) / args.duration:9.1f}  "
+        f"p50={statistics.median(latencies) if latencies else 0:7.2f}ms  p95={p95:7.2f}ms  "
+        f"writes/s={stats['writes'] / args.duration:8.1f}  "
+        f"errors={stats['read_errors'] + stats['write_errors']}"
+    )
+    return len(latencies)
+
+
+async def run(args):
+    results = {}
+    for mode in ("DELETE", "WAL"):
+        results[mode] = await run_mode(mode, args)
+    if results["DELETE"]:
+        print(f"WAL 读取吞吐为 DELETE 模式的 {results['WAL'] / results['DELETE']:.2f} 倍")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5.0, help="每种模式的测量时长（秒）")
+    parser.add_argument("--writers", type=int, default=4, help="并发写入协程数")
+    parser.add_argument("--readers", type=int, default=16, help="并发读取协程数")
+    parser.add_argument("--rows", type=int, default=1000, help="预置的摘要条数")
+    parser.add_argument("--busy-timeout", type=int, default=5000, help="SQLite busy_timeout（毫秒）")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""缓存命中延迟压测
+
+启动本地模拟 LLM 服务和 main:app，在 N 个摘要生成挂起期间测量缓存命中请求的延迟，
+验证慢速上游调用不会阻塞事件循环。
+
+    python bench/load_test.py --pending 200 --latency 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _prepare_workdir(stub_port, extra_config=None):
+    """创建独立的工作目录，避免污染仓库中的 config.json 和数据库"""
+    workdir = tempfile.mkdtemp(prefix="ai-summary-bench-")
+    for name in ("themes", "templates", "static"):
+        os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "DASHSCOPE_API_KEY": "stub-key",
+            "BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "MODEL": "stub-model",
+            **(extra_config or {}),
+        }, f)
+    return workdir
+
+
+async def _wait_ready(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"服务未能启动: {url}")
+
+
+def _summary_payload(article_id):
+    return {
+        "message": f"文章 {article_id} 的正文内容。" * 20,
+        "last_updated": "2024-01-01 00:00:00",
+        "article_url": f"https://blog.example.com/archives/{article_id}",
+    }
+
+
+async def _measure_hits(client, base_url, count, concurrency):
+    """并发请求已缓存的文章，返回每个请求的耗时（毫秒）"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"{base_url}/api/summary", json=_summary_payload("hot"))
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<12} n={len(latencies):<5} p50={p50:7.2f}ms  p95={p95:7.2f}ms  max={latencies[-1]:7.2f}ms")
+    return p95
+
+
+async def run(args):
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    limits = httpx.Limits(max_connections=args.pending + args.concurrency + 10)
+    async with httpx.AsyncClient(timeout=args.latency * 10 + 30, limits=limits) as client:
+        # 预热：生成一次热门文章的摘要
+        (await client.post(f"{base_url}/api/summary", json=_summary_payload("hot"))).raise_for_status()
+
+        baseline = await _measure_hits(client, base_url, args.requests, args.concurrency)
+
+        # 发起 N 个未缓存文章的生成请求，在其挂起期间测量缓存命中延迟
+        pending = [
+            asyncio.create_task(client.post(f"{base_url}/api/summary", json=_summary_payload(f"cold-{i}")))
+            for i in range(args.pending)
+        ]
+        await asyncio.sleep(min(0.5, args.latency / 4))
+        loaded = await _measure_hits(client, base_url, args.requests, args.concurrency)
+        still_pending = sum(1 for task in pending if not task.done())
+        results = await asyncio.gather(*pending, return_exceptions=True)
+
+    failures = sum(1 for r in results if isinstance(r, Exception) or r.status_code != 200)
+    print(f"上游延迟 {args.latency}s，测量期间仍挂起的生成请求: {still_pending}/{args.pending}，失败: {failures}")
+    base_p95 = _report("baseline", baseline)
+    load_p95 = _report("with-pending", loaded)
+
+    limit = max(base_p95 * args.max_ratio, args.min_budget_ms)
+    if load_p95 > limit:
+        print(f"FAIL: 生成挂起时缓存命中 p95 {load_p95:.2f}ms 超过 {limit:.2f}ms")
+        return 1
+    print("OK: 缓存命中延迟未受挂起生成请求影响")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pending", type=int, default=100, help="同时挂起的生成请求数")
+    parser.add_argument("--latency", type=float, default=3.0, help="模拟上游延迟（秒）")
+    parser.add_argument("--requests", type=int, default=500, help="缓存命中请求数")
+    parser.add_argument("--concurrency", type=int, default=10, help="缓存命中请求并发数")
+    parser.add_argument("--max-ratio", type=float, default=5.0, help="允许的 p95 放大倍数")
+    parser.add_argument("--min-budget-ms", type=float, default=100.0, help="p95 的最小容忍值")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=9101)
+    args = parser.parse_args()
+
+    workdir = _prepare_workdir(args.stub_port)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "bench", "stub_llm.py"),
+        "--port", str(args.stub_port), "--latency", str(args.latency),
+    ])
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--port", str(args.app_port), "--log-level", "warning",
+    ], cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{args.stub_port}/stats"))
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{args.app_port}/api/card-template"))
+        sys.exit(asyncio.run(run(args)))
+    finally:
+        for process in (server, stub):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""多上游故障转移、熔断和对冲请求的验证脚本
+
+启动一个快速和一个慢速的模拟服务，再配合一个不可用的地址，检查:
+故障转移是否成功、熔断后是否跳过故障上游、对冲请求是否降低慢速上游的延迟。
+
+    python bench/provider_test.py
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from load_test import _wait_ready  # noqa: E402
+from providers import ProviderPool  # noqa: E402
+
+MESSAGES = [
+    {"role": "system", "content": "你是一个博客总结助手。"},
+    {"role": "user", "content": "文章正文"},
+]
+
+
+def _config(providers, **extra):
+    return {
+        "DASHSCOPE_API_KEY": "stub-key",
+        "BASE_URL": "",
+        "MODEL": "stub-model",
+        "HTTP_CONNECT_TIMEOUT": 1,
+        "PROVIDERS": providers,
+        **extra,
+    }
+
+
+def _check(name, ok, detail=""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name} {detail}")
+    return ok
+
+
+async def failover(args):
+    pool = ProviderPool()
+    pool.configure(_config([
+        {"name": "dead", "BASE_URL": f"http://127.0.0.1:{args.dead_port}/v1", "weight": 1},
+        {"name": "fast", "BASE_URL": f"http://127.0.0.1:{args.fast_port}/v1", "weight": 0},
+    ], CIRCUIT_FAILURES=2, CIRCUIT_COOLDOWN=60))
+    results = [await pool.complete(MESSAGES) for _ in range(5)]
+    dead, fast = pool.backends
+    ok = _check("故障转移", all(r.startswith("摘要") for r in results), f"failovers={pool.stats['failovers']}")
+    ok &= _check("熔断", dead.breaker.state == "open" and dead.stats["requests"] == 2,
+                 f"dead 请求 {dead.stats['requests']} 次，状态 {dead.breaker.state}")
+
+    parts = [delta async for delta in pool.stream(MESSAGES)]
+    ok &= _check("流式调用跳过熔断上游", "".join(parts).startswith("摘要"))
+    await pool.close()
+    return ok
+
+
+async def hedging(args):
+    pool = ProviderPool()
+    providers = [
+        {"name": "slow", "BASE_URL": f"http://127.0.0.1:{args.slow_port}/v1", "weight": 1},
+        {"name": "fast", "BASE_URL": f"http://127.0.0.1:{args.fast_port}/v1", "weight": 0},
+    ]
+    pool.configure(_config(providers))
+    start = time.perf_counter()
+    await pool.complete(MESSAGES)
+    plain = time.perf_counter() - start
+
+    pool.configure(_config(providers, HEDGE_REQUESTS=True, HEDGE_DELAY_MS=args.hedge_ms))
+    start = time.perf_counter()
+    await pool.complete(MESSAGES)
+    hedged = time.perf_counter() - start
+    ok = _check("对冲请求", hedged < plain / 2 and pool.stats["hedge_wins"] == 1,
+                f"未对冲 {plain * 1000:.0f}ms，对冲 {hedged * 1000:.0f}ms")
+    await pool.close()
+    return ok
+
+
+async def run(args):
+    ok = await failover(args)
+    ok &= await hedging(args)
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fast-port", type=int, default=9110)
+    parser.add_argument("--slow-port", type=int, default=9111)
+    parser.add_argument("--dead-port", type=int, default=9119, help="不启动服务的端口，模拟故障上游")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--hedge-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    stubs = [
+        subprocess.Popen([
+            sys.executable, os.path.join(ROOT, "bench", "stub_llm.py"),
+            "--port", str(port), "--latency", str(latency),
+        ])
+        for port, latency in ((args.fast_port, 0.05), (args.slow_port, args.slow_latency))
+    ]
+    try:
+        for port in (args.fast_port, args.slow_port):
+            asyncio.run(_wait_ready(f"http://127.0.0.1:{port}/stats"))
+        sys.exit(asyncio.run(run(args)))
+    finally:
+        for process in stubs:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""冷启动基准测试
+
+在新的解释器中分别测量导入 main、create_app()、init_db()（新数据库和表结构已是最新的数据库）的耗时，
+再启动 uvicorn main:create_app --factory，测量从启动进程到首个请求成功的时间。
+每项重复多次取中位数，超过预算时以非零状态退出，可用于 CI。
+
+    python bench/startup.py --repeat 5
+    python bench/startup.py --budget-import-ms 800 --budget-ready-ms 2500 --output bench-results/startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmark import _git_commit
+from load_test import ROOT, _prepare_workdir
+
+# 在子进程中执行，输出各阶段耗时（毫秒）
+PHASES = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+created = time.perf_counter()
+import models
+models.init_db()
+migrated = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "init_db_ms": (migrated - created) * 1000,
+    "openai_imported": "openai" in sys.modules,
+}))
+"""
+
+
+def _phases(workdir, env):
+    output = subprocess.run([sys.executable, "-c", PHASES], cwd=workdir, env=env, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+async def _wait_ok(url, timeout):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.01)
+    raise RuntimeError(f"服务未能启动: {url}")
+
+
+def _ready(workdir, env, port, timeout):
+    """启动服务，返回到首个请求成功的耗时（毫秒）"""
+    start = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:create_app", "--factory", "--port", str(port), "--log-level", "warning",
+    ], cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_ok(f"http://127.0.0.1:{port}/api/card-template", timeout))
+        return (time.perf_counter() - start) * 1000
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def _median(samples, key):
+    return round(statistics.median(sample[key] for sample in samples), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的次数，取中位数")
+    parser.add_argument("--budget-import-ms", type=float, default=1000, help="导入 main 的耗时预算")
+    parser.add_argument("--budget-ready-ms", type=float, default=4000, help="启动到首个请求成功的耗时预算")
+    parser.add_argument("--app-port", type=int, default=9101)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="结果 JSON 的保存路径")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    fresh, current, ready_fresh, ready_current = [], [], [], []
+    for _ in range(args.repeat):
+        # 每次使用新的工作目录，测量新数据库的建表耗时
+        workdir = _prepare_workdir(0)
+        try:
+            fresh.append(_phases(workdir, env))
+            current.append(_phases(workdir, env))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        workdir = _prepare_workdir(0)
+        try:
+            ready_fresh.append({"ms": _ready(workdir, env, args.app_port, args.timeout)})
+            ready_current.append({"ms": _ready(workdir, env, args.app_port, args.timeout)})
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "commit": _git_commit(),
+        "repeat": args.repeat,
+        "import_ms": _median(current, "import_ms"),
+        "create_app_ms": _median(current, "create_app_ms"),
+        "init_db_fresh_ms": _median(fresh, "init_db_ms"),
+        "init_db_current_ms": _median(current, "init_db_ms"),
+        # 导入 main 和创建应用时不应导入 openai
+        "openai_imported": any(sample["openai_imported"] for sample in fresh + current),
+        "ready_fresh_ms": _median(ready_fresh, "ms"),
+        "ready_current_ms": _median(ready_current, "ms"),
+    }
+
+    print(f"提交 {result['commit']}，每项 {args.repeat} 次取中位数")
+    print(f"导入 main              {result['import_ms']:8.1f}ms")
+    print(f"create_app()           {result['create_app_ms']:8.1f}ms")
+    print(f"init_db() 新数据库     {result['init_db_fresh_ms']:8.1f}ms")
+    print(f"init_db() 表结构已最新 {result['init_db_current_ms']:8.1f}ms")
+    print(f"启动到首个请求 新数据库 {result['ready_fresh_ms']:8.1f}ms")
+    print(f"启动到首个请求 已有数据库 {result['ready_current_ms']:8.1f}ms")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    failures = []
+    if result["openai_imported"]:
+        failures.append("创建应用时导入了 openai")
+    if result["import_ms"] > args.budget_import_ms:
+        failures.append(f"导入 main 耗时 {result['import_ms']}ms 超过预算 {args.budget_import_ms}ms")
+    if result["ready_current_ms"] > args.budget_ready_ms:
+        failures.append(f"启动到首个请求 {result['ready_current_ms']}ms 超过预算 {args.budget_ready_ms}ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: 启动耗时在预算之内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""本地 OpenAI 兼容的模拟服务，用于压测
+
+    python bench/stub_llm.py --port 9000 --latency 2 --jitter 0.5 --error-rate 0.05 --seed 1
+
+运行中可以通过 POST /control 调整延迟和故障注入，GET /stats 返回调用次数
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+app.state.latency = 1.0
+# 延迟在 latency * (1 ± jitter) 之间均匀分布
+app.state.jitter = 0.0
+# 返回 500 的比例，以及流式输出中途断开的比例
+app.state.error_rate = 0.0
+app.state.stream_error_rate = 0.0
+app.state.random = random.Random()
+app.state.calls = 0
+app.state.stream_calls = 0
+app.state.errors = 0
+app.state.prompt_tokens = 0
+app.state.completion_tokens = 0
+
+
+def _latency():
+    jitter = app.state.jitter
+    return max(0.0, app.state.latency * (1 + app.state.random.uniform(-jitter, jitter)))
+
+
+def _usage(messages, content):
+    # 粗略按字符数估算，便于观察 token 统计
+    prompt_tokens = sum(len(message.get("content", "")) for message in messages)
+    completion_tokens = len(content)
+    app.state.prompt_tokens += prompt_tokens
+    app.state.completion_tokens += completion_tokens
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _completion(model, content, usage):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
+
+
+def _chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+
+
+async def _stream(model, content, usage, pieces=10):
+    """把延迟平均分摊到各个分片上，模拟逐字输出"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    latency = _latency()
+    fail_at = pieces // 2 if app.state.random.random() < app.state.stream_error_rate else None
+    size = max(1, len(content) // pieces)
+    for index, start in enumerate(range(0, len(content), size)):
+        if index == fail_at:
+            app.state.errors += 1
+            raise RuntimeError("模拟流式输出中断")
+        await asyncio.sleep(latency / pieces)
+        chunk = _chunk(completion_id, model, {"content": content[start:start + size]})
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps(_chunk(completion_id, model, {}, 'stop'))}\n\n"
+    yield f"data: {json.dumps({**_chunk(completion_id, model, {}), 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.calls += 1
+    model = body.get("model", "stub")
+    user_message = body["messages"][-1]["content"]
+    content = f"摘要: {user_message[:50]}"
+    usage = _usage(body["messages"], content)
+    if body.get("stream"):
+        app.state.stream_calls += 1
+        return StreamingResponse(_stream(model, content, usage), media_type="text/event-stream")
+    await asyncio.sleep(_latency())
+    if app.state.random.random() < app.state.error_rate:
+        app.state.errors += 1
+        return JSONResponse({"error": {"message": "模拟上游错误", "type": "server_error"}}, status_code=500)
+    return JSONResponse(_completion(model, content, usage))
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "calls": app.state.calls,
+        "stream_calls": app.state.stream_calls,
+        "errors": app.state.errors,
+        "prompt_tokens": app.state.prompt_tokens,
+        "completion_tokens": app.state.completion_tokens,
+    }
+
+
+@app.post("/control")
+async def control(request: Request):
+    """调整 latency、jitter、error_rate、stream_error_rate，返回调整后的设置"""
+    settings = await request.json()
+    for name in ("latency", "jitter", "error_rate", "stream_error_rate"):
+        if name in settings:
+            setattr(app.state, name, float(settings[name]))
+    if "seed" in settings:
+        app.state.random.seed(settings["seed"])
+    return {name: getattr(app.state, name) for name in ("latency", "jitter", "error_rate", "stream_error_rate")}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=1.0, help="每次调用的模拟延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机浮动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="流式输出中途断开的比例")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+    args = parser.parse_args()
+    app.state.latency = args.latency
+    app.state.jitter = args.jitter
+    app.state.error_rate = args.error_rate
+    app.state.stream_error_rate = args.stream_error_rate
+    app.state.random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
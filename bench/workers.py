@@ -0,0 +1,176 @@
+"""多进程扩展性基准测试
+
+启动本地模拟 LLM 服务，依次以 1、2、4 个工作进程（python main.py --workers N）运行服务，
+预热一批热门文章后从多个客户端进程并发请求，比较不同进程数下的吞吐量、延迟和模型调用次数。
+启用共享缓存时，一个进程生成的摘要其他进程直接读取，模型调用次数不随进程数增加。
+
+    python bench/workers.py --workers 1,2,4 --requests 20000 --concurrency 64
+    python bench/workers.py --shared-cache "" --output bench-results/workers.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+from benchmark import _latency_summary, _git_commit
+from load_test import ROOT, _prepare_workdir, _wait_ready, _summary_payload
+
+
+async def _client(app_url, article_ids, count, concurrency, seed):
+    """按固定种子随机请求热门文章的摘要，返回 (耗时列表, 错误数)"""
+    rng = random.Random(seed)
+    plan = [rng.choice(article_ids) for _ in range(count)]
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=app_url, timeout=60, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            while plan:
+                article_id = plan.pop()
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/api/summary", json=_summary_payload(article_id))
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _run_client(args):
+    return asyncio.run(_client(*args))
+
+
+async def _stub_calls(stub_url):
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{stub_url}/stats")).json()["calls"]
+
+
+async def _warmup(app_url, article_ids):
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        semaphore = asyncio.Semaphore(16)
+
+        async def one(article_id):
+            async with semaphore:
+                (await client.post("/api/summary", json=_summary_payload(article_id))).raise_for_status()
+
+        await asyncio.gather(*(one(article_id) for article_id in article_ids))
+
+
+def measure(args, workers, stub_url):
+    """以指定进程数启动服务并测量一轮"""
+    workdir = _prepare_workdir(args.stub_port, {
+        "SHARED_CACHE": args.shared_cache,
+        "GENERATION_LOCK": "file" if args.shared_cache else "",
+        "JOB_WORKERS": 0,
+        **json.loads(args.app_config),
+    })
+    server = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "main.py"), "--workers", str(workers), "--port", str(args.app_port),
+    ], cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    article_ids = [f"hot-{i}" for i in range(args.hot_articles)]
+    try:
+        asyncio.run(_wait_ready(f"{app_url}/api/card-template", timeout=60))
+        calls_before = asyncio.run(_stub_calls(stub_url))
+        asyncio.run(_warmup(app_url, article_ids))
+        per_client = args.requests // args.clients
+        jobs = [
+            (app_url, article_ids, per_client, args.concurrency // args.clients or 1, args.seed + index)
+            for index in range(args.clients)
+        ]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(args.clients) as pool:
+            results = list(pool.map(_run_client, jobs))
+        duration = time.perf_counter() - start
+        calls = asyncio.run(_stub_calls(stub_url)) - calls_before
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "duration_s": round(duration, 3),
+        "rps": round(len(latencies) / duration, 1) if duration else None,
+        "latency_ms": _latency_summary(latencies),
+        # 预热和测量期间的模型调用次数，共享缓存生效时应等于热门文章数
+        "llm_calls": calls,
+    }
+
+
+def report(result):
+    print(f"提交 {result['commit']}，共享缓存 {result['shared_cache'] or '未启用'}，"
+          f"热门文章 {result['hot_articles']} 篇")
+    print(f"{'进程数':<6}{'req/s':>10}{'加速比':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'错误':>6}{'模型调用':>8}")
+    base = result["runs"][0]["rps"]
+    for run in result["runs"]:
+        latency = run["latency_ms"]
+        print(f"{run['workers']:<8}{run['rps']:>10.1f}{run['rps'] / base:>9.2f}x{latency['p50']:>10.2f}"
+              f"{latency['p95']:>10.2f}{latency['p99']:>10.2f}{run['errors']:>6}{run['llm_calls']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="依次测量的工作进程数")
+    parser.add_argument("--requests", type=int, default=10000, help="每轮测量的请求总数")
+    parser.add_argument("--concurrency", type=int, default=64, help="所有客户端进程的总并发数")
+    parser.add_argument("--clients", type=int, default=4, help="客户端进程数，避免压测端成为瓶颈")
+    parser.add_argument("--hot-articles", type=int, default=200)
+    parser.add_argument("--shared-cache", default="file", help="SHARED_CACHE 的取值，空字符串表示不启用")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟上游延迟（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--app-config", default="{}", help="额外的 config.json 字段（JSON）")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=9101)
+    parser.add_argument("--output", help="结果 JSON 的保存路径")
+    args = parser.parse_args()
+
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "bench", "stub_llm.py"),
+        "--port", str(args.stub_port), "--latency", str(args.latency), "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    try:
+        asyncio.run(_wait_ready(f"{stub_url}/stats"))
+        runs = [measure(args, int(workers), stub_url) for workers in args.workers.split(",")]
+    finally:
+        stub.terminate()
+        try:
+            stub.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            stub.kill()
+
+    result = {
+        "commit": _git_commit(),
+        "shared_cache": args.shared_cache,
+        "hot_articles": args.hot_articles,
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+    }
+    report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict, namedtuple
+
+# 内存缓存中保存的摘要记录，避免持有 ORM 对象
+CachedSummary = namedtuple(
+    'CachedSummary', ['summary', 'last_updated', 'from_cache', 'content_hash', 'simhash'],
+    defaults=[None, None]
+)
+
+
+class LRUCache:
+    """带容量和过期时间限制的进程内 LRU 缓存"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def configure(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._shrink()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        self._shrink()
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def _shrink(self):
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups * 100, 2) if lookups else 0,
+        }
+
+
+# 摘要缓存，键为文章ID
+summary_cache = LRUCache()
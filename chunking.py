@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import re
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 为可选依赖，未安装时按字符估算
+    tiktoken = None
+
+import llm_client
+
+logger = logging.getLogger(__name__)
+
+# 分段摘要使用的提示词，最终摘要仍使用配置中的 SYSTEM_CONTENT
+CHUNK_PROMPT = "你是一个文章分段总结助手。下面是一篇长文章中的一个片段，请用简洁的语言概括该片段的关键内容，保留重要的术语和结论。"
+
+_CJK = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+_HEADING = re.compile(r'\n(?=#{1,6}\s|\S[^\n]{0,60}\n[=-]{3,}\n)')
+_SENTENCE = re.compile(r'(?<=[。！？!?.；;])\s*')
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """本地估算 token 数，安装了 tiktoken 时使用 cl100k_base 编码"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    # 中日韩字符约每字一个 token，其余字符约每 4 个一个 token
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _hard_split(text: str, max_tokens: int):
+    """按句子切分超长段落，单句仍超长时按字符截断"""
+    pieces = []
+    for sentence in _SENTENCE.split(text):
+        while count_tokens(sentence) > max_tokens:
+            # 按比例估算截断位置
+            cut = max(1, len(sentence) * max_tokens // count_tokens(sentence))
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """截断到不超过 max_tokens"""
+    while text and count_tokens(text) > max_tokens:
+        cut = len(text) * max_tokens // count_tokens(text)
+        text = text[:min(cut, len(text) - 1)]
+    return text
+
+
+def split_chunks(text: str, max_tokens: int):
+    """按章节和段落切分文章，尽量让每段接近 max_tokens 而不超过"""
+    blocks = []
+    for section in _HEADING.split(text):
+        for paragraph in re.split(r'\n\s*\n', section):
+            if not paragraph.strip():
+                continue
+            if count_tokens(paragraph) > max_tokens:
+                blocks.extend(_hard_split(paragraph, max_tokens))
+            else:
+                blocks.append(paragraph)
+
+    chunks = []
+    current, current_tokens = [], 0
+    # 段落之间的分隔符也计入 token 数
+    separator = count_tokens("\n\n")
+    for block in blocks:
+        tokens = count_tokens(block)
+        if current and current_tokens + separator + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current_tokens += tokens + (separator if current else 0)
+        current.append(block)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+async def _map(config, chunks):
+    semaphore = asyncio.Semaphore(max(1, int(config['CHUNK_CONCURRENCY'])))
+    total = len(chunks)
+
+    async def summarize_chunk(index, chunk):
+        async with semaphore:
+            content = f"（第 {index + 1}/{total} 段）\n{chunk}"
+            return await llm_client.complete(config, CHUNK_PROMPT, content)
+
+    return await asyncio.gather(*(summarize_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+
+
+async def prepare_input(config, content: str) -> str:
+    """返回最终交给模型的输入：短文章原样返回，超长文章先分段摘要再合并"""
+    max_tokens = int(config['MAX_INPUT_TOKENS'])
+    if max_tokens <= 0:
+        return content
+    for _ in range(int(config['CHUNK_MAX_ROUNDS'])):
+        if count_tokens(content) <= max_tokens:
+            return content
+        chunks = split_chunks(content, max_tokens)
+        logger.info("文章超过 %d tokens，分为 %d 段摘要", max_tokens, len(chunks))
+        partials = await _map(config, chunks)
+        content = "以下是一篇长文章各部分的摘要：\n\n" + "\n\n".join(
+            f"第 {i + 1} 部分：{partial}" for i, partial in enumerate(partials)
+        )
+    if count_tokens(content) > max_tokens:
+        # 分段摘要的轮数用完仍超过上限，截断后再交给模型，避免上游拒绝请求
+        logger.warning("分段摘要 %s 轮后仍超过 %d tokens，截断输入", config['CHUNK_MAX_ROUNDS'], max_tokens)
+        content = truncate(content, max_tokens)
+    return content
@@ -0,0 +1,191 @@
+import copy
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，config.json 中缺失的字段使用这里的值
+DEFAULT_CONFIG = {
+    "DASHSCOPE_API_KEY": "",
+    "BASE_URL": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+    "CORS_ORIGIN": "*",
+    "SYSTEM_CONTENT": "你是一个博客总结助手，用于自动生成博客的读者感兴趣的文章摘要，摘要只介绍最关键内容，不超100字。",
+    "THEME": "light",
+    "MODEL": "qwen-plus",
+    # 多个 OpenAI 兼容上游，按顺序排列，每项可包含 name、BASE_URL、API_KEY、MODEL、weight、timeout，
+    # 未填写的字段沿用上面的全局设置；为空时只使用 BASE_URL 一个上游。weight 为 0 的上游只作备用
+    "PROVIDERS": [],
+    # 同一上游连续失败多少次后熔断，以及熔断后的冷却时间（秒）
+    "CIRCUIT_FAILURES": 5,
+    "CIRCUIT_COOLDOWN": 30,
+    # 首个请求超过阈值仍未返回时向下一个上游发送对冲请求，HEDGE_DELAY_MS 为 0 时使用该上游最近请求耗时的 p95
+    "HEDGE_REQUESTS": False,
+    "HEDGE_DELAY_MS": 0,
+    # 单次请求的输入 token 上限，超过时分段摘要后再合并，0 表示不限制；
+    # 同时摘要的分段数，以及合并后仍超过上限时最多再分段摘要的轮数
+    "MAX_INPUT_TOKENS": 6000,
+    "CHUNK_CONCURRENCY": 4,
+    "CHUNK_MAX_ROUNDS": 3,
+    # /card-template 响应的浏览器缓存时间（秒）
+    "THEME_CACHE_MAX_AGE": 300,
+    # 上游HTTP连接池设置
+    "HTTP_MAX_CONNECTIONS": 100,
+    "HTTP_MAX_KEEPALIVE": 20,
+    "HTTP_KEEPALIVE_EXPIRY": 30,
+    "HTTP_TIMEOUT": 60,
+    "HTTP_CONNECT_TIMEOUT": 10,
+    # 模型调用调度：最大并发数、每分钟请求数和 token 数（0 表示不限制）、
+    # 等待队列长度和排队超时（秒），以及为输出预留的 token 数
+    "LLM_MAX_CONCURRENCY": 8,
+    "LLM_RPM": 0,
+    "LLM_TPM": 0,
+    "LLM_QUEUE_SIZE": 100,
+    "LLM_QUEUE_TIMEOUT": 30,
+    "LLM_OUTPUT_TOKENS": 300,
+    # SQLite 连接池大小和锁等待时间（毫秒），修改后需重启
+    "DB_POOL_SIZE": 10,
+    "DB_MAX_OVERFLOW": 20,
+    "DB_POOL_TIMEOUT": 30,
+    "DB_BUSY_TIMEOUT": 5000,
+    # 进程内摘要缓存的容量和过期时间（秒）
+    "SUMMARY_CACHE_SIZE": 1024,
+    "SUMMARY_CACHE_TTL": 300,
+    # 更新时间变化但正文相同（或 SimHash 汉明距离不超过阈值）时沿用旧摘要，阈值为 0 时只接受完全相同
+    "CONTENT_FINGERPRINT": True,
+    "SIMHASH_THRESHOLD": 3,
+    # 文章更新后先返回旧摘要，并在后台重新生成
+    "STALE_WHILE_REVALIDATE": False,
+    # 多进程部署时的跨进程生成锁: ""（不启用）、"file" 或 "db"
+    "GENERATION_LOCK": "",
+    "GENERATION_LOCK_DIR": ".locks",
+    "GENERATION_LOCK_TTL": 120,
+    # 批量摘要接口：单次请求的文章数上限和同时生成的文章数
+    "BATCH_MAX_ITEMS": 1000,
+    "BATCH_CONCURRENCY": 4,
+    # 预生成队列：后台消费协程数（修改后需重启）、最大尝试次数、重试间隔（秒，按次数递增）、
+    # 空闲时的轮询间隔（秒），以及运行超过多久的任务视为中断并重新领取（秒）
+    "JOB_WORKERS": 2,
+    "JOB_MAX_ATTEMPTS": 3,
+    "JOB_RETRY_DELAY": 60,
+    "JOB_POLL_INTERVAL": 5,
+    "JOB_TIMEOUT": 600,
+    # 管理后台按文件名导入 sitemap / 订阅源文件的服务器目录，为空时只能上传文件
+    "JOB_IMPORT_DIR": "",
+    # 修改模型或提示词后自动为旧版本摘要排队重新生成，重新生成期间继续返回旧摘要；
+    # RESUMMARIZE_RATE 为每分钟最多重新生成的旧版本摘要数（0 表示不限制），多进程部署时只由主进程重新生成
+    "RESUMMARIZE_ON_CHANGE": True,
+    "RESUMMARIZE_RATE": 30,
+    # 请求事件日志：批量写入的间隔（秒）和条数，原始事件和分钟汇总的保留时间，按天汇总长期保留
+    "EVENT_FLUSH_INTERVAL": 5,
+    "EVENT_BATCH_SIZE": 500,
+    "EVENT_RETENTION_DAYS": 7,
+    "STATS_MINUTE_RETENTION_HOURS": 48,
+    # 摘要存储：正文超过 COMPRESS_MIN_BYTES 字节时压缩保存（0 表示不压缩）；超过 SUMMARY_TTL_DAYS 天未访问的摘要
+    # 被淘汰，条数或大小（字节）超过 SUMMARY_MAX_ROWS、SUMMARY_MAX_BYTES 时淘汰最久未访问的摘要，均为 0 表示不限制
+    "COMPRESS_MIN_BYTES": 1024,
+    "SUMMARY_TTL_DAYS": 0,
+    "SUMMARY_MAX_ROWS": 0,
+    "SUMMARY_MAX_BYTES": 0,
+    # 访问时间批量写入的间隔和存储维护（淘汰、压缩旧正文、VACUUM）的间隔（秒），
+    # 空闲页占数据库文件的比例超过 VACUUM_FREE_RATIO 时执行 VACUUM
+    "ACCESS_FLUSH_INTERVAL": 60,
+    "STORAGE_MAINTENANCE_INTERVAL": 3600,
+    "VACUUM_FREE_RATIO": 0.25,
+    # 多进程共用的摘要缓存: ""（不启用）、"file"（共享内存目录，同一台机器）、"redis" 或 "memory"（进程内替身），
+    # 同时用于向各进程广播配置、主题和摘要的变化；修改后需重启
+    "SHARED_CACHE": "",
+    "SHARED_CACHE_DIR": "",
+    "SHARED_CACHE_URL": "redis://127.0.0.1:6379/0",
+    "SHARED_CACHE_TTL": 3600,
+    "SHARED_CACHE_POLL": 0.5,
+    # 启动后预先载入进程内缓存的最近访问摘要数
+    "WARMUP_SUMMARIES": 256,
+    # python main.py --production 启动的工作进程数（--workers 优先），0 表示与 CPU 核数相同
+    "WORKERS": 0,
+    # 多进程部署时主进程（负责存储维护和旧版本摘要的重新生成）租约的有效期（秒），主进程退出后由其他进程接替
+    "LEADER_LEASE_TTL": 30,
+    "admin": {
+        "username": "admin",
+        "password": "admin"
+    }
+}
+
+
+class ConfigStore:
+    """缓存解析后的配置，仅在文件变化或保存时重新加载"""
+
+    def __init__(self, path='config.json', check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        # 配置版本号，每次内容变化时递增，其他缓存可以以此为键
+        self.version = 0
+        self._config = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """注册配置变化回调，参数为 (旧配置, 新配置)"""
+        self._listeners.append(listener)
+
+    def refresh(self):
+        """下次读取时立即检查配置文件，用于其他进程修改配置后"""
+        self._checked_at = 0.0
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        now = time.monotonic()
+        if self._config is not None and now - self._checked_at < self.check_interval:
+            return self._config
+        self._checked_at = now
+        stamp = self._file_stamp()
+        if self._config is None or stamp != self._stamp:
+            self._reload(stamp)
+        return self._config
+
+    def _reload(self, stamp):
+        if stamp is None:
+            # 如果文件不存在，创建默认配置
+            self.save(copy.deepcopy(DEFAULT_CONFIG))
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self._stamp = stamp
+        self._apply(config)
+
+    def save(self, config_data):
+        # 先写临时文件再替换，其他进程不会读到写了一半的配置
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(config_data, f, ensure_ascii=False, indent=4)
+        os.replace(temp_path, self.path)
+        self._stamp = self._file_stamp()
+        self._checked_at = time.monotonic()
+        self._apply(copy.deepcopy(config_data))
+
+    def _apply(self, config):
+        # 更新缺失的字段
+        for key, value in DEFAULT_CONFIG.items():
+            if key not in config:
+                config[key] = copy.deepcopy(value)
+        if config == self._config:
+            return
+        old_config = self._config
+        self._config = config
+        self.version += 1
+        for listener in self._listeners:
+            try:
+                listener(old_config, config)
+            except Exception as e:
+                logger.error(f"Config listener failed: {str(e)}")
+
+
+config_store = ConfigStore()
@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, insert
+from sqlalchemy.dialects.sqlite import insert as upsert
+
+from config_store import config_store
+from metrics import request_elapsed
+from models import AsyncSessionLocal, RequestEvent, StatsRollup, StatsLatency, StatsTotal, ROLLUP_COUNTERS
+
+logger = logging.getLogger(__name__)
+
+# 耗时分桶上界（毫秒），超过最后一个分桶的计入最后一个
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000, 120000)
+# 写入失败时最多保留的未写入事件数，超过后丢弃最早的
+MAX_PENDING = 10000
+# 清理过期事件和分钟汇总的间隔（秒）
+PRUNE_INTERVAL = 3600
+
+
+def _bucket(duration_ms):
+    index = bisect.bisect_left(LATENCY_BUCKETS_MS, duration_ms)
+    return LATENCY_BUCKETS_MS[min(index, len(LATENCY_BUCKETS_MS) - 1)]
+
+
+def _counters(event):
+    """单个事件对应的汇总计数"""
+    kind, outcome = event['kind'], event['outcome']
+    if kind == 'request':
+        return {
+            'requests': 1,
+            'cache_hits': int(outcome == 'hit'),
+            'stale_hits': int(outcome == 'stale'),
+            'errors': int(outcome == 'error'),
+        }
+    if kind == 'llm':
+        return {
+            'llm_calls': 1,
+            'llm_errors': int(outcome == 'error'),
+            'prompt_tokens': event['prompt_tokens'] or 0,
+            'completion_tokens': event['completion_tokens'] or 0,
+        }
+    return {'generated': 1}
+
+
+def percentiles(buckets, quantiles=(0.5, 0.95, 0.99)):
+    """根据 {分桶上界: 次数} 估算分位数，返回各分位所在分桶的上界（毫秒）"""
+    total = sum(buckets.values())
+    result = {}
+    for quantile in quantiles:
+        name = f"p{round(quantile * 100)}"
+        if not total:
+            result[name] = None
+            continue
+        cumulative = 0
+        for le in sorted(buckets):
+            cumulative += buckets[le]
+            if cumulative >= quantile * total:
+                result[name] = le
+                break
+    return result
+
+
+class EventLog:
+    """请求事件日志：事件先缓存在内存中，由后台协程批量写入，并同时累加按分钟、按天的汇总"""
+
+    def __init__(self):
+        self._pending = []
+        self._task = None
+        self._wakeup = None
+        self._last_prune = None
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "flushes": 0}
+
+    def record(self, kind, outcome, route=None, article_id=None, backend=None, duration=None,
+               prompt_tokens=None, completion_tokens=None):
+        """记录一个事件，不等待数据库写入"""
+        self._pending.append({
+            'created_at': datetime.now(),
+            'kind': kind,
+            'route': route,
+            'outcome': outcome,
+            'article_id': article_id,
+            'backend': backend,
+            'duration_ms': round(duration * 1000, 2) if duration is not None else None,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+        })
+        self.stats["recorded"] += 1
+        if len(self._pending) > MAX_PENDING:
+            dropped = len(self._pending) - MAX_PENDING
+            del self._pending[:dropped]
+            self.stats["dropped"] += dropped
+        if self._wakeup is not None and len(self._pending) >= int(config_store.get().get('EVENT_BATCH_SIZE', 500)):
+            self._wakeup.set()
+
+    def request(self, route, outcome, article_id=None, timed=True):
+        """记录一次摘要请求，timed 为真时同时记录当前请求的耗时"""
+        self.record('request', outcome, route=route, article_id=article_id,
+                    duration=request_elapsed() if timed else None)
+
+    def _rollups(self, events):
+        counters, latency = {}, {}
+        for event in events:
+            minute = event['created_at'].replace(second=0, microsecond=0)
+            periods = (('minute', minute), ('day', minute.replace(hour=0, minute=0)))
+            for period in periods:
+                row = counters.setdefault(period, dict.fromkeys(ROLLUP_COUNTERS, 0))
+                for name, value in _counters(event).items():
+                    row[name] += value
+                if event['duration_ms'] is not None and event['kind'] in ('request', 'llm'):
+                    key = period + (event['kind'], _bucket(event['duration_ms']))
+                    latency[key] = latency.get(key, 0) + 1
+        return counters, latency
+
+    async def flush(self):
+        """把缓存的事件写入日志表，并累加到汇总表"""
+        events, self._pending = self._pending, []
+        if not events:
+            return 0
+        counters, latency = self._rollups(events)
+        totals = dict.fromkeys(ROLLUP_COUNTERS, 0)
+        for (granularity, _), row in counters.items():
+            if granularity == 'day':
+                for name, value in row.items():
+                    totals[name] += value
+        try:
+            async with AsyncSessionLocal() as db:
+                if int(config_store.get().get('EVENT_RETENTION_DAYS', 7)) > 0:
+                    await db.execute(insert(RequestEvent), events)
+                statement = upsert(StatsRollup).values([
+                    {'granularity': granularity, 'period': period, **row}
+                    for (granularity, period), row in counters.items()
+                ])
+                await db.execute(statement.on_conflict_do_update(
+                    index_elements=['granularity', 'period'],
+                    set_={name: getattr(StatsRollup, name) + statement.excluded[name] for name in ROLLUP_COUNTERS}
+                ))
+                if latency:
+                    statement = upsert(StatsLatency).values([
+                        {'granularity': granularity, 'period': period, 'metric': metric, 'le': le, 'count': count}
+                        for (granularity, period, metric, le), count in latency.items()
+                    ])
+                    await db.execute(statement.on_conflict_do_update(
+                        index_elements=['granularity', 'period', 'metric', 'le'],
+                        set_={'count': StatsLatency.count + statement.excluded['count']}
+                    ))
+                statement = upsert(StatsTotal).values([
+                    {'key': name, 'value': value} for name, value in totals.items() if value
+                ])
+                await db.execute(statement.on_conflict_do_update(
+                    index_elements=['key'], set_={'value': StatsTotal.value + statement.excluded['value']}
+                ))
+                await db.commit()
+        except asyncio.CancelledError:
+            self._pending[:0] = events
+            raise
+        except Exception as error:
+            # 写入失败时放回队列，下次再试
+            logger.warning("写入请求事件失败: %s", error)
+            self._pending[:0] = events
+            return 0
+        self.stats["written"] += len(events)
+        self.stats["flushes"] += 1
+        return len(events)
+
+    async def prune(self, config):
+        """删除过期的原始事件和分钟汇总，按天汇总保留"""
+        now = datetime.now()
+        event_before = now - timedelta(days=float(config.get('EVENT_RETENTION_DAYS', 7)))
+        minute_before = now - timedelta(hours=float(config.get('STATS_MINUTE_RETENTION_HOURS', 48)))
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(RequestEvent).where(RequestEvent.created_at < event_before))
+            await db.execute(delete(StatsRollup).where(
+                StatsRollup.granularity == 'minute', StatsRollup.period < minute_before
+            ))
+            await db.execute(delete(StatsLatency).where(
+                StatsLatency.granularity == 'minute', StatsLatency.period < minute_before
+            ))
+            await db.commit()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            config = config_store.get()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), float(config.get('EVENT_FLUSH_INTERVAL', 5)))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._last_prune is None or loop.time() - self._last_prune >= PRUNE_INTERVAL:
+                self._last_prune = loop.time()
+                try:
+                    await self.prune(config)
+                except Exception as error:
+                    logger.warning("清理请求事件失败: %s", error)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入，并写入剩余的事件"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def summary(self, minutes=60, days=30):
+        """读取汇总统计：累计值、今日值、今日耗时分位数，以及最近若干分钟和天的趋势"""
+        now = datetime.now()
+        minute = now.replace(second=0, microsecond=0)
+        today = minute.replace(hour=0, minute=0)
+        minute_start = minute - timedelta(minutes=minutes - 1)
+        day_start = today - timedelta(days=days - 1)
+        async with AsyncSessionLocal() as db:
+            totals = dict((await db.execute(select(StatsTotal.key, StatsTotal.value))).all())
+            rows = (await db.scalars(select(StatsRollup).where(
+                ((StatsRollup.granularity == 'minute') & (StatsRollup.period >= minute_start)) |
+                ((StatsRollup.granularity == 'day') & (StatsRollup.period >= day_start))
+            ))).all()
+            latency_rows = (await db.execute(
+                select(StatsLatency.metric, StatsLatency.le, func.sum(StatsLatency.count))
+                .where(StatsLatency.granularity == 'day', StatsLatency.period == today)
+                .group_by(StatsLatency.metric, StatsLatency.le)
+            )).all()
+
+        by_period = {(row.granularity, row.period): row for row in rows}
+
+        def series(granularity, start, count, step, label_format):
+            points = []
+            for index in range(count):
+                period = start + step * index
+                row = by_period.get((granularity, period))
+                points.append({
+                    "period": period.strftime(label_format),
+                    **{name: (getattr(row, name) or 0) if row else 0 for name in ROLLUP_COUNTERS},
+                })
+            return points
+
+        latency = {}
+        for metric, le, count in latency_rows:
+            latency.setdefault(metric, {})[le] = count
+        today_row = by_period.get(('day', today))
+        return {
+            "totals": {name: totals.get(name, 0) for name in ('summaries',) + ROLLUP_COUNTERS},
+            "today": {name: (getattr(today_row, name) or 0) if today_row else 0 for name in ROLLUP_COUNTERS},
+            "latency_ms": {metric: percentiles(latency.get(metric, {})) for metric in ('request', 'llm')},
+            "minutes": series('minute', minute_start, minutes, timedelta(minutes=1), "%H:%M"),
+            "days": series('day', day_start, days, timedelta(days=1), "%m-%d"),
+            "pending": len(self._pending),
+            **self.stats,
+        }
+
+
+event_log = EventLog()
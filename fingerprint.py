@@ -0,0 +1,65 @@
+import hashlib
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+Fingerprint = namedtuple('Fingerprint', ['content_hash', 'simhash'])
+
+# 指纹比对结果统计
+stats = {"unchanged": 0, "near_duplicate": 0, "changed": 0, "no_fingerprint": 0}
+
+SHINGLE_SIZE = 3
+
+
+def normalize(text: str) -> str:
+    """统一全半角、大小写和空白，客户端计算 content_hash 时需使用相同规则"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode('utf-8')).hexdigest()
+
+
+def simhash(text: str) -> str:
+    """基于字符 3-gram 的 64 位 SimHash，中英文通用"""
+    normalized = normalize(text).replace(' ', '')
+    if len(normalized) < SHINGLE_SIZE:
+        shingles = Counter([normalized])
+    else:
+        shingles = Counter(
+            normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)
+        )
+    weights = [0] * 64
+    for shingle, count in shingles.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += count if value >> bit & 1 else -count
+    result = 0
+    for bit in range(64):
+        if weights[bit] > 0:
+            result |= 1 << bit
+    return f"{result:016x}"
+
+
+def compute(text: str) -> Fingerprint:
+    return Fingerprint(content_hash(text), simhash(text))
+
+
+def distance(a: str, b: str) -> int:
+    """两个 SimHash 之间的汉明距离"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def compare(stored: Fingerprint, current: Fingerprint, threshold: int) -> str:
+    """比较已保存的指纹和当前内容，返回 unchanged / near_duplicate / changed / no_fingerprint"""
+    if not stored.content_hash:
+        decision = "no_fingerprint"
+    elif stored.content_hash == current.content_hash:
+        decision = "unchanged"
+    elif threshold > 0 and stored.simhash and distance(stored.simhash, current.simhash) <= threshold:
+        decision = "near_duplicate"
+    else:
+        decision = "changed"
+    stats[decision] += 1
+    return decision
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func, or_, and_
+from sqlalchemy.exc import IntegrityError
+
+from config_store import config_store
+from metrics import record_error
+from models import AsyncSessionLocal, ArticleSummary, SummaryJob, StatsTotal, StatsVersion
+from scheduler import background, SchedulerBusy, TokenBucket
+from singleflight import prompt_hash, leader
+from sources import fetch_article
+from summaries import generate_and_store
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pending', 'running', 'done', 'failed')
+# 模型或提示词变更后重新生成旧版本摘要的任务
+MIGRATE = 'migrate'
+# 批量入队时每次查询的文章数，避免超过 SQLite 的参数个数限制
+ENQUEUE_BATCH = 500
+# 其他进程同时为同一文章排队导致唯一索引冲突时的重试次数
+ENQUEUE_RETRIES = 3
+
+
+def is_current(row, config) -> bool:
+    """摘要是否由当前配置的模型和提示词生成"""
+    return row.model == config['MODEL'] and row.prompt_hash == prompt_hash(config['SYSTEM_CONTENT'])
+
+
+class JobQueue:
+    """保存在 SQLite 中的摘要预生成队列，由若干后台协程消费，多个进程可以共用"""
+
+    def __init__(self):
+        self._workers = []
+        self._wakeup = None
+        self._tasks = set()
+        # 旧版本摘要的重新生成速度，只有主进程领取这类任务
+        self._migrate_rate = TokenBucket()
+        self.stats = {"succeeded": 0, "skipped": 0, "retried": 0, "failed": 0}
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def enqueue(self, items, force=False, reason=None) -> int:
+        """加入任务；同一文章已有等待中的任务时合并到该任务，不重复排队
+
+        合并时只要有一方不是限速的重新生成任务，合并后的任务就不再限速。
+        每篇文章最多一个等待中的任务由唯一索引保证，与其他进程冲突时重新读取后合并
+        """
+        for attempt in range(ENQUEUE_RETRIES):
+            try:
+                await self._enqueue(items, force, reason)
+                break
+            except IntegrityError:
+                if attempt == ENQUEUE_RETRIES - 1:
+                    raise
+        self._wake()
+        return len(items)
+
+    async def _enqueue(self, items, force, reason):
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(items), ENQUEUE_BATCH):
+                batch = items[start:start + ENQUEUE_BATCH]
+                pending = {
+                    job.article_id: job for job in (await db.scalars(select(SummaryJob).where(
+                        SummaryJob.article_id.in_([item['article_id'] for item in batch]),
+                        SummaryJob.status == 'pending'
+                    ))).all()
+                }
+                for item in batch:
+                    job = pending.get(item['article_id'])
+                    if job is None:
+                        job = SummaryJob(
+                            article_id=item['article_id'], status='pending', attempts=0, force=False, reason=reason
+                        )
+                        db.add(job)
+                        pending[item['article_id']] = job
+                    elif reason is None:
+                        job.reason = None
+                    for field in ('article_url', 'last_updated', 'content'):
+                        if item.get(field) is not None:
+                            setattr(job, field, item[field])
+                    job.force = bool(job.force or force)
+                    job.run_after = datetime.utcnow()
+            await db.commit()
+
+    async def enqueue_outdated(self, config) -> int:
+        """为模型或提示词与当前配置不一致的摘要排队重新生成"""
+        current_hash = prompt_hash(config['SYSTEM_CONTENT'])
+        async with AsyncSessionLocal() as db:
+            article_ids = (await db.scalars(select(ArticleSummary.article_id).where(or_(
+                ArticleSummary.model.is_(None),
+                ArticleSummary.model != config['MODEL'],
+                ArticleSummary.prompt_hash.is_(None),
+                ArticleSummary.prompt_hash != current_hash
+            )))).all()
+        return await self.enqueue([{"article_id": article_id} for article_id in article_ids], reason=MIGRATE)
+
+    async def version_progress(self, config):
+        """当前模型和提示词生成的摘要占全部摘要的比例，读取触发器维护的计数"""
+        async with AsyncSessionLocal() as db:
+            total = await db.scalar(select(StatsTotal.value).where(StatsTotal.key == 'summaries')) or 0
+            current = await db.scalar(select(StatsVersion.count).where(
+                StatsVersion.model == config['MODEL'],
+                StatsVersion.prompt_hash == prompt_hash(config['SYSTEM_CONTENT'])
+            )) or 0
+            migrating = await db.scalar(select(func.count()).select_from(SummaryJob).where(
+                SummaryJob.reason == MIGRATE, SummaryJob.status.in_(('pending', 'running'))
+            ))
+        return {
+            "model": config['MODEL'],
+            "prompt_hash": prompt_hash(config['SYSTEM_CONTENT']),
+            "current": current,
+            "outdated": max(total - current, 0),
+            "total": total,
+            "migrating": migrating,
+            "progress": round(current / total * 100, 2) if total else 100,
+        }
+
+    def _on_config_change(self, old_config, new_config):
+        """模型或提示词变化时为旧版本摘要排队重新生成"""
+        rate = int(new_config.get('RESUMMARIZE_RATE', 0))
+        if rate != self._migrate_rate.rate:
+            self._migrate_rate.configure(rate)
+        # 多进程部署时只由主进程排队，避免各进程重复入队
+        if old_config is None or not new_config.get('RESUMMARIZE_ON_CHANGE') or not leader.is_leader:
+            return
+        if (old_config['MODEL'], old_config['SYSTEM_CONTENT']) == (new_config['MODEL'], new_config['SYSTEM_CONTENT']):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self.enqueue_outdated(new_config))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info("模型或提示词已变更，旧版本摘要将在后台逐步重新生成")
+
+    async def progress(self):
+        async with AsyncSessionLocal() as db:
+            counts = dict.fromkeys(STATUSES, 0)
+            counts.update((await db.execute(
+                select(SummaryJob.status, func.count()).group_by(SummaryJob.status)
+            )).all())
+            failures = (await db.execute(
+                select(SummaryJob.article_id, SummaryJob.error, SummaryJob.updated_at)
+                .where(SummaryJob.status == 'failed')
+                .order_by(SummaryJob.updated_at.desc())
+                .limit(10)
+            )).all()
+        total = sum(counts.values())
+        finished = counts['done'] + counts['failed']
+        return {
+            **counts,
+            "total": total,
+            "progress": round(finished / total * 100, 2) if total else 100,
+            "workers": len(self._workers),
+            **self.stats,
+            "recent_failures": [
+                {"article_id": f.article_id, "error": f.error, "updated_at": f.updated_at.strftime("%Y-%m-%d %H:%M:%S")}
+                for f in failures
+            ],
+        }
+
+    async def clear_finished(self) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(SummaryJob).where(SummaryJob.status.in_(('done', 'failed'))))
+            await db.commit()
+        return result.rowcount
+
+    async def _claim(self, config):
+        """领取一个到期的任务；运行超时的任务视为其进程已退出，重新领取
+
+        重新生成旧版本摘要的任务只由主进程领取，速度超过 RESUMMARIZE_RATE 时只领取其他任务
+        """
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=float(config.get('JOB_TIMEOUT', 600)))
+        claimable = or_(
+            and_(SummaryJob.status == 'pending', SummaryJob.run_after <= now),
+            and_(SummaryJob.status == 'running', SummaryJob.started_at < stale_before)
+        )
+        if not leader.is_leader or self._migrate_rate.wait_time(1) > 0:
+            claimable = and_(claimable, or_(SummaryJob.reason.is_(None), SummaryJob.reason != MIGRATE))
+        async with AsyncSessionLocal() as db:
+            while True:
+                job = (await db.execute(
+                    select(SummaryJob.id, SummaryJob.reason).where(claimable).order_by(SummaryJob.id).limit(1)
+                )).first()
+                if job is None:
+                    return None
+                job_id = job.id
+                result = await db.execute(
+                    update(SummaryJob)
+                    .where(SummaryJob.id == job_id, claimable)
+                    .values(status='running', started_at=now)
+                )
+                await db.commit()
+                # 其他进程抢先领取时继续找下一个
+                if result.rowcount == 1:
+                    if job.reason == MIGRATE:
+                        self._migrate_rate.take(1)
+                    return job_id
+
+    async def _finish(self, job_id, **values):
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(update(SummaryJob).where(SummaryJob.id == job_id).values(**values))
+                await db.commit()
+            except IntegrityError:
+                # 放回队列时该文章已有新的等待中任务，由新任务代替
+                await db.rollback()
+                await db.execute(delete(SummaryJob).where(SummaryJob.id == job_id))
+                await db.commit()
+
+    async def _process(self, job_id, config):
+        async with AsyncSessionLocal() as db:
+            job = await db.get(SummaryJob, job_id)
+            row = await db.get(ArticleSummary, job.article_id)
+
+        if row is not None and not job.force and is_current(row, config) and (
+            job.last_updated is None or row.last_updated >= job.last_updated
+        ):
+            self.stats["skipped"] += 1
+            await self._finish(job_id, status='done', content=None, error=None)
+            return
+
+        article_url = job.article_url or (row.article_url if row else None)
+        content = job.content or (row.content if row else None)
+        if not content:
+            if not article_url:
+                raise ValueError("没有保存的正文，也没有可抓取的文章地址")
+            content = await fetch_article(article_url, float(config.get('HTTP_TIMEOUT', 60)))
+        last_updated = job.last_updated or (row.last_updated if row else None) or datetime.utcnow()
+
+        with background():
+            await generate_and_store(job.article_id, last_updated, content, config, article_url)
+        self.stats["succeeded"] += 1
+        await self._finish(job_id, status='done', content=None, error=None)
+
+    async def _run(self, job_id):
+        config = config_store.get()
+        try:
+            await self._process(job_id, config)
+        except asyncio.CancelledError:
+            # 服务关闭时放回队列，下次启动继续
+            await self._finish(job_id, status='pending')
+            raise
+        except Exception as error:
+            record_error('job', error)
+            async with AsyncSessionLocal() as db:
+                attempts = (await db.get(SummaryJob, job_id)).attempts or 0
+            # 排队已满不计入重试次数
+            if not isinstance(error, SchedulerBusy):
+                attempts += 1
+            if attempts < int(config.get('JOB_MAX_ATTEMPTS', 3)):
+                self.stats["retried"] += 1
+                delay = float(config.get('JOB_RETRY_DELAY', 60)) * max(attempts, 1)
+                await self._finish(
+                    job_id, status='pending', attempts=attempts, error=str(error),
+                    run_after=datetime.utcnow() + timedelta(seconds=delay)
+                )
+            else:
+                self.stats["failed"] += 1
+                await self._finish(job_id, status='failed', attempts=attempts, error=str(error))
+            logger.warning("摘要任务 %s 失败: %s", job_id, error)
+
+    async def _worker(self):
+        while True:
+            config = config_store.get()
+            try:
+                job_id = await self._claim(config)
+            except Exception as error:
+                logger.error("领取摘要任务失败: %s", error)
+                job_id = None
+            if job_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._idle_timeout(config))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job_id)
+
+    def _idle_timeout(self, config):
+        """空闲等待时间，限速中时等到下一个令牌可用"""
+        timeout = float(config.get('JOB_POLL_INTERVAL', 5))
+        wait = self._migrate_rate.wait_time(1)
+        return min(timeout, wait) if wait > 0 else timeout
+
+    def start(self, config):
+        """启动后台消费协程，数量由 JOB_WORKERS 决定，为 0 时只入队不消费"""
+        self._wakeup = asyncio.Event()
+        self._migrate_rate.configure(int(config.get('RESUMMARIZE_RATE', 0)))
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(int(config.get('JOB_WORKERS', 2)))]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+job_queue = JobQueue()
+config_store.subscribe(job_queue._on_config_change)
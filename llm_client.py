@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+import chunking
+from config_store import config_store
+from providers import ProviderPool
+from scheduler import llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 上游连接池，配置变化时更新
+pool = ProviderPool()
+_configured = False
+# 等待关闭的旧客户端任务，保留引用以免被回收
+_closing = set()
+
+
+def get_pool(config) -> ProviderPool:
+    """获取共享的上游连接池，首次使用时按配置构建"""
+    global _configured
+    if not _configured:
+        pool.configure(config)
+        _configured = True
+    return pool
+
+
+async def _close_after(backends, delay):
+    await asyncio.sleep(delay)
+    await pool.close(backends)
+
+
+def _close_later(backends):
+    """等已发出的请求超时后再关闭被移除上游的客户端"""
+    if not backends:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    delay = max(backend.settings.timeout for backend in backends)
+    task = loop.create_task(_close_after(backends, delay))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def _on_config_change(old_config, new_config):
+    """上游列表、密钥或连接池设置变化时更新连接池，未变化的上游保留连接"""
+    if _configured:
+        _close_later(pool.configure(new_config))
+
+
+config_store.subscribe(_on_config_change)
+
+
+async def close_client():
+    """关闭所有上游客户端，释放连接池"""
+    global _configured
+    await pool.close()
+    _configured = False
+
+
+def _messages(system, content):
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": content}
+    ]
+
+
+def _estimate_tokens(config, system, content):
+    """预估本次调用消耗的 token 数，用于每分钟 token 配额"""
+    return chunking.count_tokens(system) + chunking.count_tokens(content) + int(config.get('LLM_OUTPUT_TOKENS', 300))
+
+
+async def complete(config, system: str, content: str) -> str:
+    """使用指定的系统提示词调用模型"""
+    providers = get_pool(config)
+    tokens = _estimate_tokens(config, system, content)
+    async with llm_scheduler.slot(tokens):
+        return await providers.complete(_messages(system, content), tokens)
+
+
+async def summarize(config, content: str) -> str:
+    """调用模型生成摘要"""
+    return await complete(config, config['SYSTEM_CONTENT'], content)
+
+
+async def stream_summary(config, content: str):
+    """流式调用模型，逐段产出摘要文本"""
+    providers = get_pool(config)
+    system = config['SYSTEM_CONTENT']
+    # 流式调用在整个输出期间占用名额
+    async with llm_scheduler.slot(_estimate_tokens(config, system, content)):
+        async for delta in providers.stream(_messages(system, content)):
+            yield delta
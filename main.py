@@ -1,31 +1,180 @@
-from fastapi import FastAPI, Request
-from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
-from admin import app as admin_app
-from ai_summary import app as ai_app
+from config_store import config_store
+from metrics import MetricsMiddleware, registry, metrics_response
 
-app = FastAPI()
+# 管理后台、摘要接口和数据库相关模块在 create_app 和 lifespan 中导入，
+# 只导入 main（如 python main.py --migrate）时不加载
 
-# 静态文件
-app.mount("/static", StaticFiles(directory="static"), name="static")
+logger = logging.getLogger(__name__)
 
-# 根路径重定向到登录页面
-@app.get("/")
-async def root():
-    return RedirectResponse(url="/admin/login")
 
-# 合并路由
-app.mount("/admin", admin_app)  # 管理后台路由
-app.mount("/api", ai_app)      # AI摘要API路由
+async def warm_up(config):
+    """启动后在后台预热：主题模板的压缩响应、最近访问的摘要和 openai 模块"""
+    import providers
+    from summaries import preload_recent
+    from themes import theme_store
+    try:
+        theme_store.get(config['THEME'])
+        loaded = await preload_recent(int(config.get('WARMUP_SUMMARIES', 256)))
+        # 模型客户端仍在首次调用时创建，这里只提前完成耗时的导入
+        await asyncio.to_thread(providers.openai_module)
+        logger.info("预热完成，载入 %d 条摘要", loaded)
+    except Exception as error:
+        logger.warning("预热失败: %s", error)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    import llm_client
+    from models import init_db, async_engine
+    from jobs import job_queue
+    from events import event_log
+    from storage import storage
+    from shared_cache import shared_cache
+    from singleflight import leader
+    from ai_summary import configure_cache
+    from scheduler import llm_scheduler
+
+    # 配置在启动时读取，导入模块和创建应用时不读取
+    config = config_store.get()
+    configure_cache(config)
+    llm_scheduler.configure(config)
+    # 建表和迁移在开始接收请求之前完成，表结构未变化时只读取一次 user_version
+    init_db()
+    # 选举主进程，连接多进程共享缓存，启动预生成队列的后台消费协程、请求事件的批量写入和摘要表的存储维护
+    leader.start()
+    shared_cache.start(config)
+    job_queue.start(config)
+    event_log.start()
+    storage.start()
+    warmup = asyncio.create_task(warm_up(config))
+    yield
+    warmup.cancel()
+    await asyncio.gather(warmup, return_exceptions=True)
+    # 关闭上游连接池和数据库连接
+    await job_queue.stop()
+    await event_log.stop()
+    await storage.stop()
+    await shared_cache.stop()
+    await leader.stop()
+    await llm_client.close_client()
+    await async_engine.dispose()
+
+
+@registry.collector
+def collect_stats():
+    """把各模块已有的统计转换为指标"""
+    import fingerprint
+    import llm_client
+    import singleflight
+    from cache import summary_cache
+    from scheduler import llm_scheduler
+    from shared_cache import shared_cache
+    from storage import storage
+
+    coalescing = singleflight.get_stats()
+    scheduler = llm_scheduler.get_stats()
+    providers = llm_client.pool.get_stats()
+    return [
+        ("ai_summary_memory_cache_entries", "gauge", "进程内摘要缓存条数",
+         [({}, summary_cache.get_stats()["size"])]),
+        ("ai_summary_memory_cache_evictions_total", "counter", "进程内摘要缓存淘汰次数",
+         [({"reason": "capacity"}, summary_cache.stats["evictions"]), ({"reason": "ttl"}, summary_cache.stats["expired"])]),
+        ("ai_summary_generations_in_flight", "gauge", "进行中的摘要生成数", [({}, coalescing["in_flight"])]),
+        ("ai_summary_generations_total", "counter", "摘要生成请求数，coalesced 为合并到已有生成的请求",
+         [({"role": "leader"}, coalescing["leaders"]), ({"role": "coalesced"}, coalescing["coalesced"])]),
+        ("ai_summary_llm_active", "gauge", "占用调度名额的模型调用数", [({}, scheduler["active"])]),
+        ("ai_summary_llm_queue_depth", "gauge", "等待调度名额的模型调用数", [({}, scheduler["queue_depth"])]),
+        ("ai_summary_llm_queue_rejected_total", "counter", "因排队已满或超时被拒绝的模型调用数",
+         [({"reason": "queue_full"}, scheduler["rejected"]), ({"reason": "timeout"}, scheduler["timeouts"])]),
+        ("ai_summary_shared_cache_broadcasts_total", "counter", "多进程共享缓存发出和收到的广播数",
+         [({"direction": "published"}, shared_cache.stats["published"]),
+          ({"direction": "received"}, shared_cache.stats["received"])]),
+        ("ai_summary_storage_evictions_total", "counter", "按存储策略淘汰的摘要数",
+         [({"reason": name}, storage.stats[f"evicted_{name}"]) for name in ("ttl", "rows", "bytes")]),
+        ("ai_summary_fingerprint_decisions_total", "counter", "正文指纹比对结果",
+         [({"decision": name}, value) for name, value in fingerprint.stats.items()]),
+        ("ai_summary_provider_up", "gauge", "上游熔断器是否闭合",
+         [({"backend": b["name"]}, int(b["state"] == "closed")) for b in providers["backends"]]),
+        ("ai_summary_provider_events_total", "counter",
+         "上游故障转移和对冲请求次数，hedge_skipped 为没有空闲调度名额而放弃的对冲",
+         [({"event": name}, providers[name]) for name in ("failovers", "hedged", "hedge_wins", "hedge_skipped")]),
+    ]
+
+
+def create_app() -> FastAPI:
+    """创建应用，供 uvicorn main:create_app --factory 使用"""
+    from admin import app as admin_app
+    from ai_summary import app as ai_app
+
+    app = FastAPI(lifespan=lifespan)
+    # 请求计数、耗时和 Server-Timing 响应头
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus 文本格式的指标"""
+        return metrics_response()
+
+    # 静态文件
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    # 根路径重定向到登录页面
+    @app.get("/")
+    async def root():
+        return RedirectResponse(url="/admin/login")
+
+    # 合并路由
+    app.mount("/admin", admin_app)  # 管理后台路由
+    app.mount("/api", ai_app)      # AI摘要API路由
+    return app
+
+
+def __getattr__(name):
+    # 兼容 uvicorn main:app 和 from main import app，首次访问时创建
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
+    import argparse
+    import os
     import uvicorn
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=4000,
-        reload=True,           # 启用热重载
-        reload_dirs=["./"],    # 监视的目录
-        reload_delay=0.25,     # 重载延迟
-    ) 
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="AI 摘要服务，默认以开发模式（单进程、热重载）启动")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--production", action="store_true", help="生产模式：不热重载，启动 WORKERS 个工作进程")
+    parser.add_argument("--workers", type=int, help="工作进程数，指定时即为生产模式，0 表示与 CPU 核数相同")
+    parser.add_argument("--migrate", action="store_true", help="只建表和迁移数据库，然后退出")
+    args = parser.parse_args()
+
+    from models import init_db
+    # 在启动工作进程之前完成迁移，各进程启动时只需确认表结构版本
+    init_db()
+    if args.migrate:
+        print("数据库表结构已是最新")
+    elif args.production or args.workers is not None:
+        startup_config = config_store.get()
+        workers = args.workers if args.workers is not None else int(startup_config.get('WORKERS', 0))
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and not startup_config.get('SHARED_CACHE'):
+            print("提示：多进程部署时建议设置 SHARED_CACHE 和 GENERATION_LOCK，否则各进程的缓存互不共享")
+        uvicorn.run("main:create_app", factory=True, host=args.host, port=args.port, workers=workers)
+    else:
+        uvicorn.run(
+            "main:create_app",
+            factory=True,
+            host=args.host,
+            port=args.port,
+            reload=True,           # 启用热重载
+            reload_dirs=["./"],    # 监视的目录
+            reload_delay=0.25,     # 重载延迟
+        )
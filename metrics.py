@@ -0,0 +1,256 @@
+import bisect
+import contextvars
+import time
+
+from fastapi.responses import JSONResponse as _JSONResponse, Response
+from starlette.datastructures import MutableHeaders
+
+# 请求耗时的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 模型调用耗时的分桶（秒）
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, self.labels, labels, value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for name, names, values, value in self.samples():
+            yield f"{name}{_format_labels(names, values)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, *labels, value):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ('le',)
+        for labels, (counts, total, value_sum) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(value_sum)}"
+
+
+class Registry:
+    """指标注册表；已有的统计字典通过 collector 在抓取时转换为指标"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """注册返回 [(指标名, 类型, 说明, [(标签字典, 值)])] 的函数"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'ai_summary_http_requests_total', 'HTTP 请求数', ('route', 'method', 'status'))
+http_duration = registry.histogram(
+    'ai_summary_http_request_duration_seconds', 'HTTP 请求耗时', ('route', 'method'))
+cache_lookups = registry.counter(
+    'ai_summary_cache_lookups_total', '各级缓存的命中和未命中次数', ('tier', 'result'))
+llm_duration = registry.histogram(
+    'ai_summary_llm_request_duration_seconds', '上游模型调用耗时', ('backend', 'model', 'outcome'), LLM_BUCKETS)
+llm_tokens = registry.counter(
+    'ai_summary_llm_tokens_total', '上游返回的 token 用量', ('backend', 'model', 'type'))
+llm_queue_wait = registry.histogram(
+    'ai_summary_llm_queue_wait_seconds', '模型调用等待调度名额的时间，未排队的调用计为 0', ('priority',),
+    (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+db_duration = registry.histogram(
+    'ai_summary_db_query_duration_seconds', '数据库语句耗时', ('operation',),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+errors = registry.counter(
+    'ai_summary_errors_total', '按阶段和异常类型统计的错误数', ('stage', 'type'))
+
+
+def record_error(stage, error):
+    errors.inc(stage, type(error).__name__)
+
+
+def record_usage(backend, model, usage):
+    """记录上游响应中的 token 用量，响应不含 usage 时忽略"""
+    if usage is None:
+        return
+    llm_tokens.inc(backend, model, 'prompt', amount=usage.prompt_tokens or 0)
+    llm_tokens.inc(backend, model, 'completion', amount=usage.completion_tokens or 0)
+
+
+class Timing:
+    """单个请求各阶段的累计耗时（秒），用于 Server-Timing 响应头"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {"db": 0.0, "llm": 0.0, "serialize": 0.0}
+
+    def header(self):
+        total = time.perf_counter() - self.start
+        parts = [f"{name};dur={value * 1000:.1f}" for name, value in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(parts)
+
+
+_timing = contextvars.ContextVar('request_timing', default=None)
+
+
+def add_time(stage, seconds):
+    """把耗时计入当前请求，生成任务中的调用会计入发起生成的请求"""
+    timing = _timing.get()
+    if timing is not None:
+        timing.stages[stage] += seconds
+
+
+def request_elapsed():
+    """当前请求已经过的时间（秒），不在请求中时返回 None"""
+    timing = _timing.get()
+    if timing is None:
+        return None
+    return time.perf_counter() - timing.start
+
+
+class JSONResponse(_JSONResponse):
+    """统计序列化耗时的 JSONResponse"""
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        body = super().render(content)
+        add_time("serialize", time.perf_counter() - start)
+        return body
+
+
+def _route_label(scope):
+    route = scope.get('route')
+    if route is None:
+        return 'unmatched'
+    return scope.get('root_path', '') + getattr(route, 'path', '')
+
+
+class MetricsMiddleware:
+    """统计每个路由的请求数和耗时，并在响应头中附带 Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timing = Timing()
+        token = _timing.set(timing)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                MutableHeaders(scope=message).append('Server-Timing', timing.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as error:
+            record_error('request', error)
+            raise
+        finally:
+            _timing.reset(token)
+            route = _route_label(scope)
+            http_requests.inc(route, scope['method'], str(status))
+            http_duration.observe(route, scope['method'], value=time.perf_counter() - timing.start)
+
+
+def instrument_engine(engine):
+    """统计数据库语句耗时，并计入当前请求的 db 阶段"""
+    # 只在创建数据库引擎时需要，导入 metrics 时不加载 sqlalchemy
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        db_duration.observe(statement.split(None, 1)[0].upper(), value=elapsed)
+        add_time("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start'):
+            connection.info['query_start'].pop()
+        record_error('db', exception_context.original_exception)
+
+
+def metrics_response():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,10 +1,48 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Text, JSON, Boolean
+import hashlib
+import logging
+import zlib
+from sqlalchemy import create_engine, event, inspect, text, Index, Column, String, DateTime, Text, JSON, Boolean, Integer, Float
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+from config_store import config_store
+from metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# 正文压缩统计：压缩的次数和压缩前后的字节数
+compression_stats = {"compressed": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+class CompressedText(TypeDecorator):
+    """超过 COMPRESS_MIN_BYTES 的文本用 zlib 压缩后以 BLOB 保存，读取时自动解压；未压缩的文本原样保存"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        threshold = int(config_store.get().get('COMPRESS_MIN_BYTES', 0))
+        data = value.encode('utf-8')
+        if threshold <= 0 or len(data) < threshold:
+            return value
+        compressed = zlib.compress(data)
+        if len(compressed) >= len(data):
+            return value
+        compression_stats["compressed"] += 1
+        compression_stats["raw_bytes"] += len(data)
+        compression_stats["stored_bytes"] += len(compressed)
+        return compressed
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode('utf-8')
+        return value
+
 class ArticleSummary(Base):
     __tablename__ = 'article_summaries'
 
@@ -14,6 +52,24 @@ class ArticleSummary(Base):
     created_at = Column(DateTime, default=datetime.utcnow)  # 摘要创建时间
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # 摘要更新时间
     from_cache = Column(Boolean, default=False)  # 添加此字段标记是否来自缓存
+    content_hash = Column(String)  # 规范化正文的 SHA-256
+    simhash = Column(String)       # 正文的 64 位 SimHash（十六进制），用于识别近似重复内容
+    article_url = Column(String)   # 文章地址，后台重新生成时用于抓取正文
+    content = Column(CompressedText)  # 生成摘要时使用的正文，后台重新生成时复用
+    model = Column(String)         # 生成摘要的模型
+    prompt_hash = Column(String)   # 生成摘要时系统提示词的哈希，用于找出提示词已过期的摘要
+    last_accessed = Column(DateTime, default=datetime.utcnow)  # 最后一次被读取的时间，批量写入，用于淘汰
+
+    # 管理后台按这些列排序并以 (列, article_id) 作为翻页游标
+    __table_args__ = (
+        Index('ix_article_summaries_last_updated_id', 'last_updated', 'article_id'),
+        Index('ix_article_summaries_created_at_id', 'created_at', 'article_id'),
+        Index('ix_article_summaries_updated_at_id', 'updated_at', 'article_id'),
+        # 统计当前版本摘要数时只读索引
+        Index('ix_article_summaries_version', 'model', 'prompt_hash'),
+        # 按最后访问时间淘汰
+        Index('ix_article_summaries_last_accessed', 'last_accessed', 'article_id'),
+    )
 
 class SystemConfig(Base):
     __tablename__ = 'system_configs'
@@ -23,9 +79,289 @@ class SystemConfig(Base):
     description = Column(String)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-# 创建数据库连接
-engine = create_engine('sqlite:///summaries.db')
-Base.metadata.create_all(engine)
+class GenerationLock(Base):
+    __tablename__ = 'generation_locks'
+
+    key = Column(String, primary_key=True)  # 摘要生成的合并键
+    owner = Column(String)                  # 持有锁的进程
+    expires_at = Column(DateTime, nullable=False)  # 锁过期时间，持有者异常退出后可被回收
+
+class SummaryJob(Base):
+    __tablename__ = 'summary_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    article_id = Column(String, nullable=False, index=True)
+    article_url = Column(String)
+    last_updated = Column(DateTime)  # 为空时沿用已保存的更新时间
+    content = Column(CompressedText)  # 为空时使用已保存的正文或抓取文章地址
+    force = Column(Boolean, default=False)  # 为真时即使摘要未过期也重新生成
+    reason = Column(String)                 # migrate 表示模型或提示词变更后的重新生成，按 RESUMMARIZE_RATE 限速
+    status = Column(String, nullable=False, default='pending', index=True)  # pending / running / done / failed
+    attempts = Column(Integer, default=0)
+    error = Column(Text)
+    run_after = Column(DateTime, default=datetime.utcnow)  # 失败重试的最早执行时间
+    started_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # 每篇文章最多一个等待中的任务，多个进程同时入队时由数据库保证不重复
+    __table_args__ = (
+        Index('ux_summary_jobs_pending_article', 'article_id', unique=True, sqlite_where=text("status = 'pending'")),
+    )
+
+class RequestEvent(Base):
+    __tablename__ = 'request_events'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    kind = Column(String, nullable=False)  # request / llm / generated
+    route = Column(String)                 # 请求事件的接口
+    outcome = Column(String)               # hit / stale / miss / error，模型调用为 success / error / cancelled
+    article_id = Column(String)
+    backend = Column(String)               # 模型调用的上游
+    duration_ms = Column(Float)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+
+# 按分钟和按天汇总的计数器
+ROLLUP_COUNTERS = (
+    'requests', 'cache_hits', 'stale_hits', 'errors', 'generated',
+    'llm_calls', 'llm_errors', 'prompt_tokens', 'completion_tokens'
+)
+
+class StatsRollup(Base):
+    __tablename__ = 'stats_rollups'
+
+    granularity = Column(String, primary_key=True)  # minute / day
+    period = Column(DateTime, primary_key=True)     # 时间段起点（服务器本地时间）
+    requests = Column(Integer, default=0)
+    cache_hits = Column(Integer, default=0)
+    stale_hits = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    generated = Column(Integer, default=0)
+    llm_calls = Column(Integer, default=0)
+    llm_errors = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+
+class StatsLatency(Base):
+    __tablename__ = 'stats_latency'
+
+    granularity = Column(String, primary_key=True)
+    period = Column(DateTime, primary_key=True)
+    metric = Column(String, primary_key=True)  # request / llm
+    le = Column(Integer, primary_key=True)     # 分桶上界（毫秒）
+    count = Column(Integer, default=0)
+
+class StatsTotal(Base):
+    __tablename__ = 'stats_totals'
+
+    key = Column(String, primary_key=True)  # summaries 由触发器维护，其余与 ROLLUP_COUNTERS 对应
+    value = Column(Integer, default=0)
+
+class StatsVersion(Base):
+    __tablename__ = 'stats_versions'
+
+    # 各模型和提示词版本的摘要数，由触发器维护；未记录版本的旧摘要以空字符串计数
+    model = Column(String, primary_key=True)
+    prompt_hash = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+def migrate(engine):
+    """为已有的表补充新增的列和索引"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            if table.name == 'summary_jobs':
+                # 建立唯一索引之前合并重复的等待中任务，只保留最早的一个
+                conn.execute(text(
+                    "DELETE FROM summary_jobs WHERE status = 'pending' AND id NOT IN "
+                    "(SELECT MIN(id) FROM summary_jobs WHERE status = 'pending' GROUP BY article_id)"
+                ))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def install_summary_counter(engine):
+    """用触发器维护摘要总数，统计时不必扫描整张表"""
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM stats_totals WHERE key = 'summaries'")).first()
+        if exists is None:
+            conn.execute(text(
+                "INSERT INTO stats_totals (key, value) SELECT 'summaries', COUNT(*) FROM article_summaries"
+            ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS article_summaries_count_insert AFTER INSERT ON article_summaries "
+            "BEGIN UPDATE stats_totals SET value = value + 1 WHERE key = 'summaries'; END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS article_summaries_count_delete AFTER DELETE ON article_summaries "
+            "BEGIN UPDATE stats_totals SET value = value - 1 WHERE key = 'summaries'; END"
+        ))
+
+# 摘要的版本键，未记录模型或提示词的旧摘要以空字符串计数
+_VERSION_KEY = "coalesce({row}.model, ''), coalesce({row}.prompt_hash, '')"
+
+def install_version_counter(engine):
+    """用触发器维护各模型和提示词版本的摘要数，统计迁移进度时不必扫描摘要表"""
+    add = ("INSERT INTO stats_versions (model, prompt_hash, count) VALUES ({key}, 1) "
+           "ON CONFLICT (model, prompt_hash) DO UPDATE SET count = count + 1;").format(key=_VERSION_KEY.format(row='new'))
+    remove = ("UPDATE stats_versions SET count = count - 1 "
+              "WHERE (model, prompt_hash) = ({key});").format(key=_VERSION_KEY.format(row='old'))
+    with engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'article_summaries_version_insert'"
+        )).first()
+        if exists is None:
+            # 首次安装时按已有的摘要计数
+            conn.execute(text("DELETE FROM stats_versions"))
+            conn.execute(text(
+                "INSERT INTO stats_versions (model, prompt_hash, count) "
+                f"SELECT {_VERSION_KEY.format(row='article_summaries')}, COUNT(*) FROM article_summaries "
+                "GROUP BY 1, 2"
+            ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS article_summaries_version_insert AFTER INSERT ON article_summaries "
+            f"BEGIN {add} END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS article_summaries_version_delete AFTER DELETE ON article_summaries "
+            f"BEGIN {remove} END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS article_summaries_version_update "
+            "AFTER UPDATE OF model, prompt_hash ON article_summaries "
+            f"WHEN ({_VERSION_KEY.format(row='old')}) IS NOT ({_VERSION_KEY.format(row='new')}) "
+            f"BEGIN {remove} {add} END"
+        ))
+
+def install_search_index(engine):
+    """建立摘要的 FTS5 全文索引，由触发器与摘要表保持同步；SQLite 不支持 FTS5 时返回 False
+
+    使用 trigram 分词，中文也能按子串搜索，但搜索词至少需要 3 个字符
+    """
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'article_summaries_fts'"
+            )).first()
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS article_summaries_fts USING fts5("
+                "article_id, summary, content='article_summaries', content_rowid='rowid', tokenize='trigram')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS article_summaries_fts_insert AFTER INSERT ON article_summaries BEGIN "
+                "INSERT INTO article_summaries_fts (rowid, article_id, summary) "
+                "VALUES (new.rowid, new.article_id, new.summary); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS article_summaries_fts_delete AFTER DELETE ON article_summaries BEGIN "
+                "INSERT INTO article_summaries_fts (article_summaries_fts, rowid, article_id, summary) "
+                "VALUES ('delete', old.rowid, old.article_id, old.summary); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS article_summaries_fts_update "
+                "AFTER UPDATE OF article_id, summary ON article_summaries BEGIN "
+                "INSERT INTO article_summaries_fts (article_summaries_fts, rowid, article_id, summary) "
+                "VALUES ('delete', old.rowid, old.article_id, old.summary); "
+                "INSERT INTO article_summaries_fts (rowid, article_id, summary) "
+                "VALUES (new.rowid, new.article_id, new.summary); END"
+            ))
+            if exists is None:
+                # 首次建立索引时导入已有的摘要
+                conn.execute(text("INSERT INTO article_summaries_fts (article_summaries_fts) VALUES ('rebuild')"))
+    except OperationalError as e:
+        logger.warning("全文索引不可用，摘要搜索将使用 LIKE: %s", e)
+        return False
+    return True
+
+def sqlite_pragmas(journal_mode='WAL', busy_timeout=5000):
+    """返回连接建立时设置 SQLite 参数的回调：WAL 模式下读写互不阻塞"""
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        cursor.close()
+    return on_connect
+
+def make_async_engine(url, journal_mode='WAL', busy_timeout=5000, pool_size=10, max_overflow=20, pool_timeout=30):
+    async_engine = create_async_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        connect_args={"timeout": busy_timeout / 1000}
+    )
+    event.listen(async_engine.sync_engine, "connect", sqlite_pragmas(journal_mode, busy_timeout))
+    return async_engine
+
+# 触发器和全文索引的版本，修改 install_summary_counter、install_version_counter 或 install_search_index 时递增
+TRIGGERS_VERSION = 2
+
+def schema_version() -> int:
+    """由表、列、索引和触发器版本计算的表结构版本号，保存在 SQLite 的 user_version 中"""
+    digest = hashlib.sha1(f"triggers:{TRIGGERS_VERSION}".encode())
+    for table in Base.metadata.sorted_tables:
+        digest.update(table.name.encode())
+        for column in table.columns:
+            digest.update(f"{column.name}:{column.type.compile(engine.dialect)}".encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(index.name.encode())
+    return int(digest.hexdigest()[:7], 16)
+
+# 全文索引是否可用，由 init_db 设置
+FTS_ENABLED = False
+_initialized = False
+
+def init_db():
+    """建表、迁移并安装触发器，由应用启动时调用一次
+
+    数据库记录的表结构版本与当前一致时跳过，只检查全文索引是否存在
+    """
+    global FTS_ENABLED, _initialized
+    if _initialized:
+        return
+    version = schema_version()
+    with engine.connect() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        if current == version:
+            FTS_ENABLED = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'article_summaries_fts'"
+            )).first() is not None
+    if current != version:
+        Base.metadata.create_all(engine)
+        migrate(engine)
+        install_summary_counter(engine)
+        install_version_counter(engine)
+        FTS_ENABLED = install_search_index(engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+    _initialized = True
+
+DATABASE_PATH = 'summaries.db'
+_db_config = config_store.get()
+
+# 同步连接，用于建表和迁移；创建引擎时不连接数据库
+engine = create_engine(f'sqlite:///{DATABASE_PATH}')
+event.listen(engine, "connect", sqlite_pragmas(busy_timeout=_db_config['DB_BUSY_TIMEOUT']))
 
 # 创建会话工厂
 SessionLocal = sessionmaker(bind=engine)
+
+# 异步连接，所有请求路径使用
+async_engine = make_async_engine(
+    f'sqlite+aiosqlite:///{DATABASE_PATH}',
+    busy_timeout=_db_config['DB_BUSY_TIMEOUT'],
+    pool_size=_db_config['DB_POOL_SIZE'],
+    max_overflow=_db_config['DB_MAX_OVERFLOW'],
+    pool_timeout=_db_config['DB_POOL_TIMEOUT']
+)
+instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
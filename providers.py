@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque, namedtuple
+
+import httpx
+
+from events import event_log
+from metrics import add_time, llm_duration, record_error, record_usage
+from scheduler import llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 估算对冲延迟所需的最少样本数
+HEDGE_MIN_SAMPLES = 20
+
+
+class NoBackendAvailable(Exception):
+    """所有上游都处于熔断状态"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却结束后放行一次试探请求"""
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        # 试探请求失败时重新计时
+        if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.trips += 1
+        self.probing = False
+
+    def cancel(self):
+        """请求被取消（如对冲落败）时不计入成败，释放试探机会"""
+        self.probing = False
+
+
+# 影响客户端构建的配置项，任一项变化时重建该上游的客户端
+BackendSettings = namedtuple('BackendSettings', [
+    'api_key', 'base_url', 'max_connections', 'max_keepalive', 'keepalive_expiry', 'timeout', 'connect_timeout',
+    'max_retries',
+])
+
+
+def _settings(spec, config, retries):
+    """提取影响客户端构建的配置项，未单独配置的字段沿用全局设置"""
+    return BackendSettings(
+        api_key=spec.get('API_KEY') or config.get('DASHSCOPE_API_KEY', ''),
+        base_url=spec.get('BASE_URL') or config.get('BASE_URL', ''),
+        max_connections=int(config.get('HTTP_MAX_CONNECTIONS', 100)),
+        max_keepalive=int(config.get('HTTP_MAX_KEEPALIVE', 20)),
+        keepalive_expiry=float(config.get('HTTP_KEEPALIVE_EXPIRY', 30)),
+        timeout=float(spec.get('timeout') or config.get('HTTP_TIMEOUT', 60)),
+        connect_timeout=float(config.get('HTTP_CONNECT_TIMEOUT', 10)),
+        max_retries=int(spec.get('max_retries', retries)),
+    )
+
+
+def openai_module():
+    """首次构建客户端时才导入 openai，导入耗时较长，不计入服务启动时间"""
+    import openai
+    return openai
+
+
+def _build_client(settings):
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.timeout, connect=settings.connect_timeout),
+    )
+    return openai_module().AsyncOpenAI(
+        # 未配置密钥时使用占位值，避免在导入阶段直接抛错
+        api_key=settings.api_key or "missing-api-key",
+        base_url=settings.base_url,
+        http_client=http_client,
+        max_retries=settings.max_retries,
+    )
+
+
+class Backend:
+    """一个 OpenAI 兼容的上游，持有自己的连接池、熔断器和延迟样本"""
+
+    def __init__(self, name, model, weight, settings):
+        self.name = name
+        self.model = model
+        self.weight = weight
+        self.settings = settings
+        self.client = _build_client(settings)
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=200)
+        self.stats = {"requests": 0, "errors": 0, "wins": 0}
+
+    def p95(self):
+        """最近请求耗时的 p95（秒），样本不足时返回 None"""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _observe(self, outcome, elapsed, usage=None):
+        llm_duration.observe(self.name, self.model, outcome, value=elapsed)
+        add_time("llm", elapsed)
+        record_usage(self.name, self.model, usage)
+        event_log.record(
+            'llm', outcome, backend=self.name, duration=elapsed,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None
+        )
+
+    async def complete(self, messages):
+        self.stats["requests"] += 1
+        start = time.monotonic()
+        try:
+            completion = await self.client.chat.completions.create(model=self.model, messages=messages)
+        except asyncio.CancelledError:
+            self.breaker.cancel()
+            self._observe("cancelled", time.monotonic() - start)
+            raise
+        except openai_module().BadRequestError as error:
+            # 请求本身有问题，不是上游故障
+            self.breaker.cancel()
+            self._observe("error", time.monotonic() - start)
+            record_error('llm', error)
+            raise
+        except Exception as error:
+            self.stats["errors"] += 1
+            self.breaker.failure()
+            self._observe("error", time.monotonic() - start)
+            record_error('llm', error)
+            raise
+        elapsed = time.monotonic() - start
+        self.latencies.append(elapsed)
+        self.breaker.success()
+        self._observe("success", elapsed, completion.usage)
+        return completion.choices[0].message.content
+
+    async def stream(self, messages):
+        self.stats["requests"] += 1
+        start = time.monotonic()
+        usage = None
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model, messages=messages, stream=True,
+                # 让上游在最后一个分片中返回 token 用量
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.cancel()
+            self._observe("cancelled", time.monotonic() - start, usage)
+            raise
+        except openai_module().BadRequestError as error:
+            self.breaker.cancel()
+            self._observe("error", time.monotonic() - start, usage)
+            record_error('llm', error)
+            raise
+        except Exception as error:
+            self.stats["errors"] += 1
+            self.breaker.failure()
+            self._observe("error", time.monotonic() - start, usage)
+            record_error('llm', error)
+            raise
+        self.breaker.success()
+        self._observe("success", time.monotonic() - start, usage)
+
+    def get_stats(self):
+        p95 = self.p95()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "state": self.breaker.state,
+            "trips": self.breaker.trips,
+            **self.stats,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+        }
+
+
+class ProviderPool:
+    """按配置中的 PROVIDERS 列表路由模型调用，支持故障转移、熔断和对冲请求"""
+
+    def __init__(self, scheduler=None):
+        self.backends = []
+        self.hedge = False
+        self.hedge_delay = 0.0
+        # 对冲请求另外占用的调度名额
+        self.scheduler = scheduler or llm_scheduler
+        self.stats = {"failovers": 0, "hedged": 0, "hedge_wins": 0, "hedge_skipped": 0}
+
+    def configure(self, config):
+        """按配置重建上游列表，设置未变化的上游沿用原有连接和统计"""
+        specs = config.get('PROVIDERS') or [{}]
+        # 配置了多个上游时由故障转移代替客户端自身的重试
+        retries = 0 if len(specs) > 1 else 2
+        existing = {(b.name, b.model, b.settings): b for b in self.backends}
+        backends = []
+        for index, spec in enumerate(specs):
+            name = spec.get('name') or f"provider-{index + 1}"
+            model = spec.get('MODEL') or config['MODEL']
+            settings = _settings(spec, config, retries)
+            backend = existing.pop((name, model, settings), None)
+            if backend is None:
+                backend = Backend(name, model, float(spec.get('weight', 1)), settings)
+            backend.weight = float(spec.get('weight', 1))
+            backend.breaker.threshold = int(config.get('CIRCUIT_FAILURES', 5))
+            backend.breaker.cooldown = float(config.get('CIRCUIT_COOLDOWN', 30))
+            backends.append(backend)
+        self.backends = backends
+        self.hedge = bool(config.get('HEDGE_REQUESTS', False))
+        self.hedge_delay = float(config.get('HEDGE_DELAY_MS', 0)) / 1000
+        return list(existing.values())
+
+    def _ordered(self):
+        """有权重的上游按权重随机排序，权重为 0 的作为备用排在最后"""
+        weighted = [b for b in self.backends if b.weight > 0]
+        standby = [b for b in self.backends if b.weight <= 0]
+        ordered = []
+        while weighted:
+            backend = random.choices(weighted, weights=[b.weight for b in weighted])[0]
+            weighted.remove(backend)
+            ordered.append(backend)
+        return ordered + standby
+
+    def _hedge_after(self, backend):
+        """对冲等待时间：固定值，或该上游最近请求耗时的 p95"""
+        if not self.hedge:
+            return None
+        return self.hedge_delay or backend.p95()
+
+    def _launch_hedge(self, launch, tokens):
+        """对冲请求同样受并发数和每分钟配额限制，没有空闲名额时不对冲"""
+        if not self.scheduler.try_acquire(tokens):
+            self.stats["hedge_skipped"] += 1
+            return
+        task = launch()
+        if task is None:
+            self.scheduler.release()
+            return
+        # 对冲请求结束或被取消时归还名额
+        task.add_done_callback(lambda _: self.scheduler.release())
+        self.stats["hedged"] += 1
+
+    async def complete(self, messages, tokens=0):
+        """调用方已占用一个调度名额；tokens 为本次调用预计消耗的 token 数，对冲请求按同样的数量计入配额"""
+        candidates = iter(self._ordered())
+        pending = {}
+        last_error = None
+        hedged = False
+
+        def launch():
+            for backend in candidates:
+                if backend.breaker.allow():
+                    task = asyncio.ensure_future(backend.complete(messages))
+                    pending[task] = backend
+                    return task
+            return None
+
+        if launch() is None:
+            raise NoBackendAvailable("所有上游均已熔断")
+        try:
+            while pending:
+                timeout = None
+                if not hedged and len(pending) == 1:
+                    timeout = self._hedge_after(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首个请求超过对冲阈值仍未返回，向下一个上游再发一次
+                    hedged = True
+                    self._launch_hedge(launch, tokens)
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        backend.stats["wins"] += 1
+                        if hedged and pending:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+                    if isinstance(last_error, openai_module().BadRequestError):
+                        raise last_error
+                    logger.warning("上游 %s 调用失败: %s", backend.name, last_error)
+                if not pending and launch() is not None:
+                    self.stats["failovers"] += 1
+            raise last_error or NoBackendAvailable("所有上游均已熔断")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, messages):
+        """流式调用；在收到首个分片前失败时切换到下一个上游"""
+        last_error = None
+        for backend in self._ordered():
+            if not backend.breaker.allow():
+                continue
+            if last_error is not None:
+                self.stats["failovers"] += 1
+            started = False
+            try:
+                async for delta in backend.stream(messages):
+                    started = True
+                    yield delta
+                backend.stats["wins"] += 1
+                return
+            except (openai_module().BadRequestError, GeneratorExit):
+                raise
+            except Exception as error:
+                if started:
+                    raise
+                last_error = error
+                logger.warning("上游 %s 流式调用失败: %s", backend.name, error)
+        raise last_error or NoBackendAvailable("所有上游均已熔断")
+
+    async def close(self, backends=None):
+        if backends is None:
+            backends, self.backends = self.backends, []
+        for backend in backends:
+            await backend.client.close()
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "backends": [backend.get_stats() for backend in self.backends],
+        }
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from config_store import config_store
+from metrics import llm_queue_wait
+
+# 优先级，数值越小越先执行
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# 等待时间指标的标签
+PRIORITY_LABELS = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# 当前调用链的优先级，后台刷新和管理后台任务通过 background() 降级
+_priority = contextvars.ContextVar('llm_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """在此范围内发起的模型调用排在访客请求之后"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class SchedulerBusy(Exception):
+    """等待队列已满或排队超时"""
+
+    def __init__(self, reason, retry_after=1):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶，rate 为 0 时不限制"""
+
+    def __init__(self, rate=0):
+        self.configure(rate)
+
+    def configure(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """距离可以取出 amount 个令牌还需等待的秒数，超过桶容量时按桶容量计算"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.rate) - self.tokens
+        return max(0.0, missing * 60 / self.rate)
+
+    def take(self, amount):
+        if self.rate > 0:
+            self.tokens -= min(amount, self.rate)
+
+
+class Scheduler:
+    """模型调用调度：限制并发数和每分钟请求数/token 数，超出时按优先级排队"""
+
+    def __init__(self):
+        self.max_concurrency = 8
+        self.queue_size = 100
+        self.queue_timeout = 30.0
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self._active = 0
+        self._queued = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.stats = {
+            "started": 0, "queued": 0, "rejected": 0, "timeouts": 0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+        }
+
+    def configure(self, config):
+        self.max_concurrency = max(1, int(config.get('LLM_MAX_CONCURRENCY', 8)))
+        self.queue_size = int(config.get('LLM_QUEUE_SIZE', 100))
+        self.queue_timeout = float(config.get('LLM_QUEUE_TIMEOUT', 30))
+        rpm = int(config.get('LLM_RPM', 0))
+        tpm = int(config.get('LLM_TPM', 0))
+        if rpm != self.requests.rate:
+            self.requests.configure(rpm)
+        if tpm != self.tokens.rate:
+            self.tokens.configure(tpm)
+        self._dispatch()
+
+    def _wait_time(self, tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _grant(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self._active += 1
+        self.stats["started"] += 1
+
+    def _dispatch(self):
+        """按优先级唤醒等待者，配额不足时定时重试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters and self._active < self.max_concurrency:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._wait_time(tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._queued -= 1
+            self._grant(tokens)
+            future.set_result(None)
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def try_acquire(self, tokens=0):
+        """不排队地占用一个名额，没有空闲名额或配额不足时返回 False；占用后由调用方 release()"""
+        if self._waiters or self._active >= self.max_concurrency or self._wait_time(tokens) > 0:
+            return False
+        self._grant(tokens)
+        return True
+
+    async def _acquire(self, tokens, priority):
+        if not self._waiters and self._active < self.max_concurrency and self._wait_time(tokens) == 0:
+            self._grant(tokens)
+            llm_queue_wait.observe(PRIORITY_LABELS.get(priority, str(priority)), value=0.0)
+            return
+        if self._queued >= self.queue_size:
+            self.stats["rejected"] += 1
+            raise SchedulerBusy("queue_full", retry_after=max(1, round(self._wait_time(tokens))))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._queued += 1
+        self.stats["queued"] += 1
+        self._dispatch()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            self.stats["timeouts"] += 1
+            raise SchedulerBusy("queue_timeout", retry_after=max(1, round(self.queue_timeout / 2)))
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        finally:
+            waited = time.monotonic() - start
+            llm_queue_wait.observe(PRIORITY_LABELS.get(priority, str(priority)), value=waited)
+            self.stats["wait_ms_total"] += waited * 1000
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited * 1000)
+
+    def _abandon(self, future):
+        """放弃等待；若名额恰好已经分配，则立即归还"""
+        if future.done():
+            self.release()
+        else:
+            future.cancel()
+            self._queued -= 1
+
+    @asynccontextmanager
+    async def slot(self, tokens=0, priority=None):
+        """占用一个调用名额，tokens 为本次调用预计消耗的 token 数"""
+        await self._acquire(tokens, _priority.get() if priority is None else priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self):
+        queued = self.stats["queued"]
+        return {
+            "active": self._active,
+            "queue_depth": self._queued,
+            "max_concurrency": self.max_concurrency,
+            **self.stats,
+            "wait_ms_total": round(self.stats["wait_ms_total"], 2),
+            "wait_ms_max": round(self.stats["wait_ms_max"], 2),
+            "wait_ms_avg": round(self.stats["wait_ms_total"] / queued, 2) if queued else 0,
+        }
+
+
+# 由应用启动时按配置设置，配置变化后重新设置
+llm_scheduler = Scheduler()
+config_store.subscribe(lambda old_config, new_config: llm_scheduler.configure(new_config))
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from cache import CachedSummary, summary_cache
+from config_store import config_store
+from themes import theme_store
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:  # redis 为可选依赖，只在 SHARED_CACHE 为 redis 时需要
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ai-summary:'
+CHANNEL = KEY_PREFIX + 'events'
+# 文件后端的事件日志超过该大小（字节）时从头开始
+EVENT_LOG_MAX_BYTES = 1024 * 1024
+# 文件后端清理过期缓存文件的间隔（秒）
+SWEEP_INTERVAL = 600
+
+
+class MemoryBackend:
+    """进程内的替身后端，接口与其他后端一致，单进程部署和测试时使用"""
+
+    def __init__(self):
+        self._data = {}
+        self._listeners = []
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    async def mget(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def set_many(self, items, ttl):
+        expires_at = time.time() + ttl
+        for key, value in items:
+            self._data[key] = (expires_at, value)
+
+    async def delete(self, keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def publish(self, message):
+        for queue in self._listeners:
+            queue.put_nowait(message)
+
+    async def listen(self, handler, poll_interval):
+        queue = asyncio.Queue()
+        self._listeners.append(queue)
+        try:
+            while True:
+                handler(await queue.get())
+        finally:
+            self._listeners.remove(queue)
+
+    async def close(self):
+        self._data.clear()
+
+
+class FileBackend:
+    """保存在共享目录中的缓存，默认位于 /dev/shm（内存文件系统），同一台机器上的进程共用
+
+    每个键一个文件，首行为过期时间；广播消息追加到事件日志，各进程轮询读取新增的行。
+    文件都很小且位于内存中，读写直接在事件循环中进行
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.events_path = os.path.join(directory, 'events.log')
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                expires_at = float(f.readline())
+                if expires_at < time.time():
+                    return None
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def get(self, key):
+        return self._read(self._path(key))
+
+    async def mget(self, keys):
+        return [self._read(self._path(key)) for key in keys]
+
+    async def set_many(self, items, ttl):
+        expires_at = time.time() + ttl
+        for key, value in items:
+            path = self._path(key)
+            # 先写临时文件再替换，其他进程不会读到写了一半的文件
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(f"{expires_at}\n{value}")
+            os.replace(temp_path, path)
+
+    async def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    async def publish(self, message):
+        # 以追加模式写入单行，多个进程同时写入时不会交错
+        with open(self.events_path, 'a', encoding='utf-8') as f:
+            if f.tell() > EVENT_LOG_MAX_BYTES:
+                f.truncate(0)
+            f.write(message + '\n')
+
+    def _sweep(self):
+        """删除过期的缓存文件"""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name == 'events.log' or entry.name.endswith('.tmp'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    expired = float(f.readline()) < now
+                if expired:
+                    os.remove(entry.path)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    async def listen(self, handler, poll_interval):
+        try:
+            offset = os.path.getsize(self.events_path)
+        except FileNotFoundError:
+            offset = 0
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                size = os.path.getsize(self.events_path)
+            except FileNotFoundError:
+                size = 0
+            if size < offset:
+                # 事件日志已从头开始，期间的消息可能丢失，按全部失效处理
+                offset = 0
+                handler(None)
+            if size > offset:
+                with open(self.events_path, 'r', encoding='utf-8') as f:
+                    f.seek(offset)
+                    data = f.read(size - offset)
+                # 只处理完整的行，写了一半的行留到下次
+                complete = data.rfind('\n') + 1
+                offset += len(data[:complete].encode('utf-8'))
+                for line in data[:complete].splitlines():
+                    if line:
+                        handler(line)
+            if time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                await asyncio.to_thread(self._sweep)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Redis（或兼容协议的服务）后端，可跨机器共用，广播使用 PUBLISH/SUBSCRIBE"""
+
+    def __init__(self, url):
+        if aioredis is None:
+            raise RuntimeError("SHARED_CACHE 为 redis 时需要安装 redis 包")
+        self.client = aioredis.from_url(url, decode_responses=True)
+
+    async def get(self, key):
+        return await self.client.get(key)
+
+    async def mget(self, keys):
+        return await self.client.mget(keys)
+
+    async def set_many(self, items, ttl):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items:
+                pipe.set(key, value, ex=int(ttl))
+            await pipe.execute()
+
+    async def delete(self, keys):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def publish(self, message):
+        await self.client.publish(CHANNEL, message)
+
+    async def listen(self, handler, poll_interval):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    handler(message['data'])
+        finally:
+            await pubsub.unsubscribe(CHANNEL)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def _default_dir():
+    """默认目录按工作目录区分，同一台机器上的多个部署互不影响"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else '.'
+    suffix = hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:8]
+    return os.path.join(base, f'ai-summary-{suffix}')
+
+
+def make_backend(config):
+    kind = config.get('SHARED_CACHE', '')
+    if kind == 'file':
+        return FileBackend(config.get('SHARED_CACHE_DIR') or _default_dir())
+    if kind == 'redis':
+        return RedisBackend(config.get('SHARED_CACHE_URL', 'redis://127.0.0.1:6379/0'))
+    if kind == 'memory':
+        return MemoryBackend()
+    return None
+
+
+def _encode(cached):
+    return json.dumps([
+        cached.summary, cached.last_updated.isoformat(), cached.from_cache, cached.content_hash, cached.simhash
+    ], ensure_ascii=False)
+
+
+def _decode(value):
+    summary, last_updated, from_cache, content_hash, simhash = json.loads(value)
+    return CachedSummary(summary, datetime.fromisoformat(last_updated), from_cache, content_hash, simhash)
+
+
+class SharedCache:
+    """多进程部署时各进程共用的摘要缓存层，位于进程内缓存和数据库之间
+
+    同时负责广播配置、主题和摘要的变化，收到广播的进程丢弃本地缓存中对应的内容。
+    SHARED_CACHE 为空时不启用，所有操作直接返回
+    """
+
+    def __init__(self):
+        self.backend = None
+        self._ttl = 3600
+        self._listener = None
+        # 区分自己发出的广播
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0, "published": 0, "received": 0}
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _error(self, action, error):
+        self.stats["errors"] += 1
+        logger.warning("共享缓存%s失败: %s", action, error)
+
+    async def get_summary(self, article_id):
+        if self.backend is None:
+            return None
+        try:
+            value = await self.backend.get(KEY_PREFIX + article_id)
+        except Exception as error:
+            self._error("读取", error)
+            return None
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return _decode(value)
+
+    async def get_summaries(self, article_ids):
+        """批量读取，返回 {文章ID: CachedSummary}"""
+        if self.backend is None or not article_ids:
+            return {}
+        try:
+            values = await self.backend.mget([KEY_PREFIX + article_id for article_id in article_ids])
+        except Exception as error:
+            self._error("读取", error)
+            return {}
+        found = {article_id: _decode(value) for article_id, value in zip(article_ids, values) if value is not None}
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(article_ids) - len(found)
+        return found
+
+    async def set_summaries(self, cached_summaries):
+        """写入 {文章ID: CachedSummary}"""
+        if self.backend is None or not cached_summaries:
+            return
+        try:
+            await self.backend.set_many(
+                [(KEY_PREFIX + article_id, _encode(cached)) for article_id, cached in cached_summaries.items()],
+                self._ttl
+            )
+            self.stats["sets"] += len(cached_summaries)
+        except Exception as error:
+            self._error("写入", error)
+
+    async def invalidate(self, article_ids, shared=True):
+        """通知其他进程丢弃这些摘要的本地副本，shared 为真时同时删除共享缓存中的副本"""
+        if self.backend is None or not article_ids:
+            return
+        try:
+            if shared:
+                await self.backend.delete([KEY_PREFIX + article_id for article_id in article_ids])
+        except Exception as error:
+            self._error("删除", error)
+        await self.broadcast('summary', article_ids=list(article_ids))
+
+    async def broadcast(self, event, **data):
+        if self.backend is None:
+            return
+        try:
+            await self.backend.publish(json.dumps({"event": event, "origin": self.origin, **data}, ensure_ascii=False))
+            self.stats["published"] += 1
+        except Exception as error:
+            self._error("广播", error)
+
+    def _handle(self, message):
+        if message is None:
+            # 可能漏掉了广播，丢弃全部本地缓存
+            summary_cache.clear()
+            theme_store.invalidate()
+            config_store.refresh()
+            return
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if payload.get("origin") == self.origin:
+            return
+        self.stats["received"] += 1
+        event = payload.get("event")
+        if event == 'summary':
+            for article_id in payload.get("article_ids", ()):
+                summary_cache.delete(article_id)
+        elif event == 'theme':
+            theme_store.invalidate()
+        elif event == 'config':
+            config_store.refresh()
+
+    async def _listen(self, poll_interval):
+        while True:
+            try:
+                await self.backend.listen(self._handle, poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self._error("订阅", error)
+                await asyncio.sleep(poll_interval)
+
+    def start(self, config):
+        """按 SHARED_CACHE 创建后端并开始接收广播，修改后需重启"""
+        self.backend = make_backend(config)
+        self._ttl = float(config.get('SHARED_CACHE_TTL', 3600))
+        if self.backend is not None:
+            self._listener = asyncio.create_task(self._listen(float(config.get('SHARED_CACHE_POLL', 0.5))))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups * 100, 2) if lookups else 0,
+        }
+
+
+shared_cache = SharedCache()
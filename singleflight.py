@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from config_store import config_store
+from models import AsyncSessionLocal, GenerationLock
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """合并同一个键上的并发调用，后到的调用等待第一个调用的结果"""
+
+    def __init__(self):
+        self._calls = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "errors": 0}
+
+    @property
+    def in_flight(self):
+        return len(self._calls)
+
+    def running(self, key):
+        return key in self._calls
+
+    def start(self, key, fn):
+        """启动或加入键上的调用，返回共享的任务"""
+        task = self._calls.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["leaders"] += 1
+            # 在独立任务中执行，发起者断开连接时不会取消其他等待者
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return task
+
+    async def do(self, key, fn):
+        return await asyncio.shield(self.start(key, fn))
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.stats["errors"] += 1
+
+
+class SharedStream:
+    """一次上游流式调用的输出缓冲，多个观看者共享同一个流"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self):
+        """先补发已缓冲的分片，再等待新分片，后加入的观看者也能拿到完整内容"""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamHub:
+    """按合并键登记进行中的流式生成"""
+
+    def __init__(self):
+        self._streams = {}
+        self.stats = {"streams": 0, "joined": 0}
+
+    def get(self, key):
+        stream = self._streams.get(key)
+        if stream is not None:
+            self.stats["joined"] += 1
+        return stream
+
+    def open(self, key):
+        stream = SharedStream()
+        self._streams[key] = stream
+        self.stats["streams"] += 1
+        return stream
+
+    def close(self, key, stream, error=None):
+        stream.finish(error)
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+
+
+def prompt_hash(prompt):
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+
+def flight_key(article_id, last_updated, model, prompt):
+    """由文章、更新时间、模型和提示词组成的合并键"""
+    return f"{article_id}|{last_updated}|{model}|{prompt_hash(prompt)}"
+
+
+class FileLock:
+    """基于独占创建文件的跨进程锁"""
+
+    def __init__(self, lock_dir, ttl):
+        self.lock_dir = lock_dir
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.lock_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+
+    async def try_acquire(self, key):
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._path(key)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # 持有者异常退出时，超时的锁文件视为失效
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            return False
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+
+    async def release(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class DBLock:
+    """基于 SQLite 表主键约束的跨进程锁"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    async def try_acquire(self, key):
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+            try:
+                await db.execute(delete(GenerationLock).where(
+                    GenerationLock.key == key,
+                    GenerationLock.expires_at < now
+                ))
+                db.add(GenerationLock(
+                    key=key,
+                    owner=str(os.getpid()),
+                    expires_at=now + timedelta(seconds=self.ttl)
+                ))
+                await db.commit()
+                return True
+            except IntegrityError:
+                await db.rollback()
+                return False
+
+    async def release(self, key):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(GenerationLock).where(GenerationLock.key == key))
+            await db.commit()
+
+
+class WorkerLock:
+    """多进程部署时的可选跨进程锁，未启用时直接放行"""
+
+    def __init__(self):
+        self.stats = {"acquired": 0, "waited": 0}
+
+    def _backend(self, config):
+        kind = config.get('GENERATION_LOCK', '')
+        ttl = float(config.get('GENERATION_LOCK_TTL', 120))
+        if kind == 'file':
+            return FileLock(config.get('GENERATION_LOCK_DIR', '.locks'), ttl)
+        if kind == 'db':
+            return DBLock(ttl)
+        return None
+
+    @asynccontextmanager
+    async def hold(self, config, key):
+        backend = self._backend(config)
+        if backend is None:
+            yield False
+            return
+        waited = False
+        while not await backend.try_acquire(key):
+            waited = True
+            await asyncio.sleep(float(config.get('GENERATION_LOCK_POLL', 0.2)))
+        self.stats["acquired"] += 1
+        if waited:
+            self.stats["waited"] += 1
+        try:
+            # waited 为真表示其他进程可能已生成结果，调用方应重新检查缓存
+            yield waited
+        finally:
+            await backend.release(key)
+
+
+class Leader:
+    """在多个工作进程中选出一个主进程，负责存储维护和旧版本摘要的重新生成
+
+    主进程在 generation_locks 表中持有一条租约并定期续期，退出后租约过期，由其他进程接替
+    """
+
+    KEY = 'leader'
+
+    def __init__(self):
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._task = None
+
+    async def _renew(self, ttl):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(GenerationLock)
+                .where(GenerationLock.key == self.KEY, GenerationLock.owner == self.owner)
+                .values(expires_at=expires_at)
+            )
+            if result.rowcount == 0:
+                await db.execute(delete(GenerationLock).where(
+                    GenerationLock.key == self.KEY,
+                    GenerationLock.expires_at < now
+                ))
+                db.add(GenerationLock(key=self.KEY, owner=self.owner, expires_at=expires_at))
+            try:
+                await db.commit()
+                return True
+            except IntegrityError:
+                await db.rollback()
+                return False
+
+    async def _run(self):
+        while True:
+            # 顺便检查配置文件，其他进程修改配置后由主进程处理
+            ttl = float(config_store.get().get('LEADER_LEASE_TTL', 30))
+            try:
+                leader = await self._renew(ttl)
+            except Exception as error:
+                logger.warning("续期主进程租约失败: %s", error)
+                leader = False
+            if leader != self.is_leader:
+                logger.info("进程 %s %s主进程", os.getpid(), "成为" if leader else "不再是")
+            self.is_leader = leader
+            await asyncio.sleep(ttl / 3)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止续期，主进程释放租约以便其他进程立即接替"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(GenerationLock).where(
+                    GenerationLock.key == self.KEY, GenerationLock.owner == self.owner
+                ))
+                await db.commit()
+
+
+summary_flight = SingleFlight()
+stream_hub = StreamHub()
+worker_lock = WorkerLock()
+leader = Leader()
+
+
+def get_stats():
+    """合并统计，供管理后台展示"""
+    return {
+        "in_flight": summary_flight.in_flight,
+        **summary_flight.stats,
+        "lock_acquired": worker_lock.stats["acquired"],
+        "lock_waited": worker_lock.stats["waited"],
+        "streams": stream_hub.stats["streams"],
+        "stream_joined": stream_hub.stats["joined"],
+    }
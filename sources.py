@@ -0,0 +1,215 @@
+import asyncio
+import ipaddress
+import json
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from summaries import extract_article_id
+
+# 抓取文章页面时提取正文的容器，与前端脚本读取的元素一致
+ARTICLE_CONTAINER_ID = 'article-container'
+# 抓取文章页面时最多跟随的重定向次数
+MAX_REDIRECTS = 5
+
+_SKIP_TAGS = {'script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside'}
+_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'pre', 'blockquote', 'tr', 'section', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+_VOID_TAGS = {'br', 'img', 'hr', 'input', 'meta', 'link', 'source', 'wbr'}
+
+
+class _TextExtractor(HTMLParser):
+    """提取 HTML 中的可见文字，页面中有正文容器时只保留容器内的内容"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page = []
+        self.article = []
+        self._skip = 0
+        self._article_depth = 0
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            if tag == 'br':
+                self._text('\n')
+            return
+        self._depth += 1
+        attrs = dict(attrs)
+        if not self._article_depth and (attrs.get('id') == ARTICLE_CONTAINER_ID or tag == 'article'):
+            self._article_depth = self._depth
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self._text('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        if tag in _SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in _BLOCK_TAGS:
+            self._text('\n')
+        if self._article_depth and self._depth == self._article_depth:
+            self._article_depth = -1
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._text(data)
+
+    def _text(self, text):
+        self.page.append(text)
+        if self._article_depth > 0:
+            self.article.append(text)
+
+
+def html_to_text(content: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(content)
+    parser.close()
+    text = ''.join(parser.article or parser.page)
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def check_url(url: str) -> str:
+    """只接受 http(s) 地址"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"只能抓取 http(s) 地址: {url}")
+    return url
+
+
+async def _check_host(url):
+    """拒绝解析到内网、回环、链路本地等非公网地址的主机，避免借抓取访问内部服务"""
+    parts = urlsplit(check_url(url))
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, None)
+    except OSError as e:
+        raise ValueError(f"无法解析主机 {parts.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%', 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"不允许抓取内网地址: {parts.hostname}")
+
+
+async def fetch_article(url: str, timeout: float = 30) -> str:
+    """抓取文章页面并提取正文，每次重定向前都重新检查目标地址"""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for _ in range(MAX_REDIRECTS + 1):
+            await _check_host(url)
+            response = await client.get(url)
+            if not response.is_redirect:
+                break
+            url = urljoin(url, response.headers['location'])
+        else:
+            raise ValueError(f"重定向次数过多: {url}")
+        response.raise_for_status()
+    return html_to_text(response.text)
+
+
+def parse_datetime(value):
+    """解析 NDJSON、sitemap 和订阅源中的时间，带时区的时间换算为服务器本地时间"""
+    if not value:
+        return None
+    value = value.strip()
+    for parse in (
+        lambda v: datetime.strptime(v, "%Y-%m-%d %H:%M:%S"),
+        lambda v: datetime.fromisoformat(v.replace('Z', '+00:00')),
+        parsedate_to_datetime,
+    ):
+        try:
+            parsed = parse(value)
+        except (TypeError, ValueError):
+            continue
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        return parsed
+    raise ValueError(f"无法解析时间: {value}")
+
+
+def _item(article_url=None, article_id=None, last_updated=None, content=None):
+    if article_url:
+        check_url(article_url)
+    if not article_id:
+        article_id = extract_article_id(article_url)
+    return {
+        "article_id": article_id,
+        "article_url": article_url,
+        "last_updated": parse_datetime(last_updated),
+        "content": content or None,
+    }
+
+
+def _parse_ndjson(text):
+    """每行一个 JSON 对象，字段为 article_url / id、last_updated 和可选的 content"""
+    items, errors = [], []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            items.append(_item(
+                record.get('article_url') or record.get('url'),
+                record.get('id'),
+                record.get('last_updated'),
+                record.get('content'),
+            ))
+        except (TypeError, ValueError, AttributeError) as e:
+            errors.append(f"第 {number} 行: {e}")
+    return items, errors
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element, *names):
+    for child in element:
+        if _local_name(child.tag) in names and (child.text or '').strip():
+            return child.text
+    return None
+
+
+def _parse_xml(text):
+    """解析 sitemap、RSS 或 Atom 文件，订阅源中带有正文时一并使用"""
+    root = ET.fromstring(text)
+    items, errors = [], []
+    for element in root.iter():
+        name = _local_name(element.tag)
+        if name == 'url':
+            url, updated, content = _child_text(element, 'loc'), _child_text(element, 'lastmod'), None
+        elif name == 'item':
+            url = _child_text(element, 'link')
+            updated = _child_text(element, 'updated', 'pubDate', 'date')
+            content = _child_text(element, 'encoded', 'description')
+        elif name == 'entry':
+            links = [child for child in element if _local_name(child.tag) == 'link']
+            url = next((link.get('href') for link in links if link.get('rel', 'alternate') == 'alternate'), None)
+            updated = _child_text(element, 'updated', 'published')
+            content = _child_text(element, 'content', 'summary')
+        else:
+            continue
+        try:
+            items.append(_item(url and url.strip(), None, updated, content and html_to_text(content)))
+        except (TypeError, ValueError) as e:
+            errors.append(f"{url}: {e}")
+    return items, errors
+
+
+def parse_batch(data: bytes):
+    """解析批量任务文件，根据内容判断是 NDJSON 还是 sitemap / 订阅源，返回 (条目, 错误)"""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("文件不是 UTF-8 编码的文本")
+    if text.lstrip().startswith('<'):
+        try:
+            return _parse_xml(text)
+        except ET.ParseError as e:
+            return [], [f"XML 解析失败: {e}"]
+    return _parse_ndjson(text)
@@ -259,6 +259,22 @@ async function loadDashboardData() {
         document.getElementById('todaySummaries').textContent = data.today_summaries;
         document.getElementById('apiCalls').textContent = data.api_calls;
         document.getElementById('cacheHitRate').textContent = data.cache_hit_rate + '%';
+        if (data.coalescing) {
+            document.getElementById('coalescedCalls').textContent = `已合并 ${data.coalescing.coalesced} 次重复生成`;
+        }
+        if (data.scheduler) {
+            document.getElementById('schedulerQueue').textContent =
+                `进行中 ${data.scheduler.active}，排队 ${data.scheduler.queue_depth}，平均等待 ${data.scheduler.wait_ms_avg}ms`;
+        }
+        if (data.jobs) {
+            updateJobProgress(data.jobs);
+        }
+        if (data.versions) {
+            updateVersionProgress(data.versions);
+        }
+        if (data.requests) {
+            updateTrends(data.requests);
+        }
 
         // 更新最近摘要列表
         const tbody = document.querySelector('#recentSummaries tbody');
@@ -279,6 +295,108 @@ async function loadDashboardData() {
     }
 }
 
+// 按时间段绘制折线图
+const TREND_SERIES = [['requests', '#3b82f6'], ['cache_hits', '#22c55e'], ['llm_calls', '#f97316']];
+
+function drawTrend(svgId, points) {
+    const svg = document.getElementById(svgId);
+    const width = 600, height = 160, padding = 4;
+    const max = Math.max(1, ...points.flatMap(p => TREND_SERIES.map(([key]) => p[key])));
+    const step = points.length > 1 ? width / (points.length - 1) : width;
+    svg.innerHTML = TREND_SERIES.map(([key, color]) => {
+        const coords = points.map((p, i) =>
+            `${(i * step).toFixed(1)},${(height - padding - p[key] / max * (height - padding * 2)).toFixed(1)}`
+        ).join(' ');
+        return `<polyline fill="none" stroke="${color}" stroke-width="2" points="${coords}"></polyline>`;
+    }).join('') + `<text x="4" y="14" font-size="12" fill="currentColor">${max}</text>`;
+    svg.querySelectorAll('polyline').forEach(line => line.setAttribute('vector-effect', 'non-scaling-stroke'));
+}
+
+function formatLatency(latency) {
+    return latency.p50 === null ? '-' : `p50 ${latency.p50}ms / p95 ${latency.p95}ms / p99 ${latency.p99}ms`;
+}
+
+function updateTrends(requests) {
+    const today = requests.today;
+    document.getElementById('requestLatency').textContent = `今日请求耗时 ${formatLatency(requests.latency_ms.request)}`;
+    document.getElementById('trendSummary').textContent =
+        `今日请求 ${today.requests}，命中 ${today.cache_hits}，过期返回 ${today.stale_hits}，错误 ${today.errors}；` +
+        `模型调用 ${today.llm_calls}（失败 ${today.llm_errors}），token ${today.prompt_tokens} + ${today.completion_tokens}；` +
+        `模型耗时 ${formatLatency(requests.latency_ms.llm)}`;
+    drawTrend('minuteTrend', requests.minutes);
+    drawTrend('dayTrend', requests.days);
+}
+
+// 更新预生成队列进度
+function updateJobProgress(jobs) {
+    document.getElementById('jobProgress').value = jobs.progress;
+    document.getElementById('jobCounts').textContent =
+        `等待 ${jobs.pending}，进行中 ${jobs.running}，完成 ${jobs.done}，失败 ${jobs.failed}（共 ${jobs.total}）`;
+}
+
+// 当前模型和提示词生成的摘要占比
+function updateVersionProgress(versions) {
+    document.getElementById('versionProgress').value = versions.progress;
+    document.getElementById('versionCounts').textContent =
+        `当前版本（${versions.model} / ${versions.prompt_hash.slice(0, 8)}）${versions.current} / ${versions.total}，` +
+        `旧版本 ${versions.outdated}，重新生成中 ${versions.migrating}`;
+}
+
+async function loadJobProgress() {
+    const response = await fetch('/admin/api/jobs', { credentials: 'same-origin' });
+    if (!response.ok) return;
+    const jobs = await response.json();
+    updateJobProgress(jobs);
+    // 队列未清空时持续刷新进度
+    if (jobs.pending + jobs.running > 0) {
+        setTimeout(loadJobProgress, 3000);
+    }
+}
+
+async function postJobs(url, options) {
+    const response = await fetch(url, { method: 'POST', credentials: 'same-origin', ...options });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.detail || '操作失败');
+    return data;
+}
+
+async function enqueueOutdated() {
+    try {
+        const data = await postJobs('/admin/api/jobs/outdated');
+        showToast(`已加入 ${data.queued} 篇文章`, 'success');
+        loadJobProgress();
+    } catch (error) {
+        showToast(error.message, 'error');
+    }
+}
+
+async function uploadJobBatch(event) {
+    const file = event.target.files[0];
+    if (!file) return;
+    const formData = new FormData();
+    formData.append('file', file);
+    try {
+        const data = await postJobs('/admin/api/jobs/batch', { body: formData });
+        showToast(`已加入 ${data.queued} 篇文章` + (data.error_count ? `，${data.error_count} 条无法解析` : ''),
+            data.error_count ? 'warning' : 'success');
+        loadJobProgress();
+    } catch (error) {
+        showToast(error.message, 'error');
+    } finally {
+        event.target.value = '';
+    }
+}
+
+async function clearJobs() {
+    try {
+        const response = await fetch('/admin/api/jobs', { method: 'DELETE', credentials: 'same-origin' });
+        if (!response.ok) throw new Error('清除失败');
+        loadJobProgress();
+    } catch (error) {
+        showToast(error.message, 'error');
+    }
+}
+
 // 保存配置
 async function saveConfig(event) {
     event.preventDefault();
@@ -290,7 +408,8 @@ async function saveConfig(event) {
         SYSTEM_CONTENT: formData.get('system_content'),
         CORS_ORIGIN: formData.get('cors_origin'),
         THEME: document.querySelector('#themeSelect')?.value || 'light',
-        MODEL: formData.get('model')  // 添加模型配置
+        MODEL: formData.get('model'),  // 添加模型配置
+        MAX_INPUT_TOKENS: parseInt(formData.get('max_input_tokens'), 10) || 0
     };
 
     try {
@@ -485,8 +604,8 @@ async function refreshSummary(articleId) {
             throw new Error(error.detail || '刷新失败');
         }
         
-        showToast('摘要刷新成功', 'success');
-        setTimeout(() => location.reload(), 1000);
+        showToast('已加入重新生成队列', 'success');
+        loadJobProgress();
     } catch (error) {
         showToast(error.message, 'error');
     }
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func, bindparam, cast, LargeBinary
+
+from cache import summary_cache
+from config_store import config_store
+from models import engine, AsyncSessionLocal, ArticleSummary, StatsTotal, compression_stats
+from shared_cache import shared_cache
+from singleflight import leader
+
+logger = logging.getLogger(__name__)
+
+# 每次删除或重新压缩的行数，避免超过 SQLite 的参数个数限制，也避免长时间占用写锁
+BATCH = 500
+
+_table = ArticleSummary.__table__
+
+# 只更新访问时间，保持 updated_at 不变
+_touch_statement = (
+    update(_table)
+    .where(_table.c.article_id == bindparam('b_article_id'))
+    .values(last_accessed=bindparam('b_last_accessed'), updated_at=_table.c.updated_at)
+)
+
+
+def _row_bytes():
+    """单条摘要占用的字节数（摘要加正文，压缩后按压缩大小计算）"""
+    return (
+        func.length(cast(ArticleSummary.summary, LargeBinary)) +
+        func.coalesce(func.length(cast(ArticleSummary.content, LargeBinary)), 0)
+    )
+
+
+class StorageManager:
+    """摘要表的存储策略：批量记录访问时间，按 TTL、条数和大小淘汰，压缩旧正文并在空闲页过多时 VACUUM"""
+
+    def __init__(self):
+        self._accessed = {}
+        self._task = None
+        self._last_maintenance = None
+        self.stats = {
+            "accesses_written": 0,
+            "evicted_ttl": 0,
+            "evicted_rows": 0,
+            "evicted_bytes": 0,
+            "recompressed": 0,
+            "vacuums": 0,
+            "reclaimed_bytes": 0,
+            "last_maintenance": None,
+        }
+
+    def touch(self, article_ids):
+        """记录摘要被读取，访问时间由后台协程批量写入"""
+        now = datetime.utcnow()
+        for article_id in article_ids:
+            self._accessed[article_id] = now
+
+    async def flush_access(self):
+        """把内存中的访问时间写入数据库"""
+        accessed, self._accessed = self._accessed, {}
+        if not accessed:
+            return 0
+        rows = [{"b_article_id": article_id, "b_last_accessed": time} for article_id, time in accessed.items()]
+        try:
+            async with AsyncSessionLocal() as db:
+                for start in range(0, len(rows), BATCH):
+                    await db.execute(_touch_statement, rows[start:start + BATCH])
+                await db.commit()
+        except asyncio.CancelledError:
+            self._requeue(accessed)
+            raise
+        except Exception as error:
+            logger.warning("写入摘要访问时间失败: %s", error)
+            self._requeue(accessed)
+            return 0
+        self.stats["accesses_written"] += len(rows)
+        return len(rows)
+
+    def _requeue(self, accessed):
+        for article_id, time in accessed.items():
+            self._accessed.setdefault(article_id, time)
+
+    async def _delete(self, article_ids, reason):
+        if not article_ids:
+            return 0
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(ArticleSummary).where(ArticleSummary.article_id.in_(article_ids)))
+            await db.commit()
+        for article_id in article_ids:
+            summary_cache.delete(article_id)
+        await shared_cache.invalidate(article_ids)
+        self.stats[f"evicted_{reason}"] += len(article_ids)
+        return len(article_ids)
+
+    async def _oldest(self, limit, condition=None):
+        """按最后访问时间从旧到新取出文章ID和占用字节数"""
+        query = select(ArticleSummary.article_id, _row_bytes())
+        if condition is not None:
+            query = query.where(condition)
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(
+                query.order_by(ArticleSummary.last_accessed, ArticleSummary.article_id).limit(limit)
+            )).all()
+
+    async def evict(self, config):
+        """按 TTL、最大条数和最大字节数依次淘汰最久未访问的摘要，返回淘汰条数"""
+        evicted = 0
+        async with AsyncSessionLocal() as db:
+            # 新增 last_accessed 列之前的摘要以更新时间作为访问时间
+            await db.execute(
+                update(_table).where(_table.c.last_accessed.is_(None))
+                .values(last_accessed=func.coalesce(_table.c.updated_at, _table.c.created_at, _table.c.last_updated),
+                        updated_at=_table.c.updated_at)
+            )
+            await db.commit()
+
+        ttl_days = float(config.get('SUMMARY_TTL_DAYS', 0))
+        if ttl_days > 0:
+            expired_before = datetime.utcnow() - timedelta(days=ttl_days)
+            while True:
+                rows = await self._oldest(BATCH, ArticleSummary.last_accessed < expired_before)
+                if not rows:
+                    break
+                evicted += await self._delete([row[0] for row in rows], 'ttl')
+
+        max_rows = int(config.get('SUMMARY_MAX_ROWS', 0))
+        if max_rows > 0:
+            async with AsyncSessionLocal() as db:
+                total = await db.scalar(select(StatsTotal.value).where(StatsTotal.key == 'summaries')) or 0
+            excess = total - max_rows
+            while excess > 0:
+                rows = await self._oldest(min(excess, BATCH))
+                if not rows:
+                    break
+                excess -= await self._delete([row[0] for row in rows], 'rows')
+                evicted += len(rows)
+
+        max_bytes = int(config.get('SUMMARY_MAX_BYTES', 0))
+        if max_bytes > 0:
+            async with AsyncSessionLocal() as db:
+                excess = (await db.scalar(select(func.sum(_row_bytes())))) or 0
+            excess -= max_bytes
+            while excess > 0:
+                article_ids = []
+                for article_id, size in await self._oldest(BATCH):
+                    article_ids.append(article_id)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                if not article_ids:
+                    break
+                evicted += await self._delete(article_ids, 'bytes')
+        return evicted
+
+    async def recompress(self, config):
+        """压缩启用压缩之前保存的未压缩正文，返回处理的条数"""
+        threshold = int(config.get('COMPRESS_MIN_BYTES', 0))
+        if threshold <= 0:
+            return 0
+        done = 0
+        last_id = ''
+        while True:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(ArticleSummary.article_id, ArticleSummary.content).where(
+                        ArticleSummary.article_id > last_id,
+                        func.typeof(ArticleSummary.content) == 'text',
+                        func.length(cast(ArticleSummary.content, LargeBinary)) >= threshold
+                    ).order_by(ArticleSummary.article_id).limit(BATCH)
+                )).all()
+                if not rows:
+                    break
+                # 绑定参数时由 CompressedText 压缩
+                await db.execute(
+                    update(_table).where(_table.c.article_id == bindparam('b_article_id'))
+                    .values(content=bindparam('b_content', type_=_table.c.content.type), updated_at=_table.c.updated_at),
+                    [{"b_article_id": row.article_id, "b_content": row.content} for row in rows]
+                )
+                await db.commit()
+            last_id = rows[-1].article_id
+            done += len(rows)
+        self.stats["recompressed"] += done
+        return done
+
+    def _file_stats(self):
+        with engine.connect() as conn:
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+            freelist = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return page_size, page_count, freelist
+
+    def _vacuum(self):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def compact(self, config):
+        """空闲页比例超过 VACUUM_FREE_RATIO 时执行 VACUUM，返回回收的字节数"""
+        page_size, page_count, freelist = await asyncio.to_thread(self._file_stats)
+        if not page_count or freelist / page_count < float(config.get('VACUUM_FREE_RATIO', 0.25)):
+            return 0
+        await asyncio.to_thread(self._vacuum)
+        _, new_count, _ = await asyncio.to_thread(self._file_stats)
+        reclaimed = max(page_count - new_count, 0) * page_size
+        self.stats["vacuums"] += 1
+        self.stats["reclaimed_bytes"] += reclaimed
+        logger.info("VACUUM 完成，回收 %d 字节", reclaimed)
+        return reclaimed
+
+    async def maintain(self, config):
+        """执行一次完整的存储维护：写入访问时间、淘汰、压缩旧正文、VACUUM"""
+        await self.flush_access()
+        evicted = await self.evict(config)
+        recompressed = await self.recompress(config)
+        reclaimed = await self.compact(config)
+        self.stats["last_maintenance"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if evicted or recompressed:
+            logger.info("存储维护：淘汰 %d 条摘要，压缩 %d 条正文", evicted, recompressed)
+        return {"evicted": evicted, "recompressed": recompressed, "reclaimed_bytes": reclaimed}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            config = config_store.get()
+            await asyncio.sleep(float(config.get('ACCESS_FLUSH_INTERVAL', 60)))
+            interval = float(config.get('STORAGE_MAINTENANCE_INTERVAL', 3600))
+            # 多进程部署时只由主进程执行维护，避免同时淘汰和 VACUUM；各进程仍各自写入访问时间
+            due = self._last_maintenance is None or loop.time() - self._last_maintenance >= interval
+            if interval > 0 and leader.is_leader and due:
+                self._last_maintenance = loop.time()
+                try:
+                    await self.maintain(config)
+                except Exception as error:
+                    logger.warning("存储维护失败: %s", error)
+            else:
+                await self.flush_access()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台维护，并写入剩余的访问时间"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_access()
+
+    async def get_stats(self):
+        page_size, page_count, freelist = await asyncio.to_thread(self._file_stats)
+        async with AsyncSessionLocal() as db:
+            rows = await db.scalar(select(StatsTotal.value).where(StatsTotal.key == 'summaries')) or 0
+        raw, stored = compression_stats["raw_bytes"], compression_stats["stored_bytes"]
+        return {
+            "rows": rows,
+            "file_bytes": page_size * page_count,
+            "free_bytes": page_size * freelist,
+            "accesses_pending": len(self._accessed),
+            "compressed": compression_stats["compressed"],
+            # 本进程压缩的正文压缩后与压缩前的大小之比
+            "compression_ratio": round(stored / raw, 3) if raw else None,
+            **self.stats,
+        }
+
+
+storage = StorageManager()
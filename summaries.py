@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+import chunking
+import fingerprint
+import llm_client
+from cache import summary_cache, CachedSummary
+from events import event_log
+from fingerprint import Fingerprint
+from metrics import cache_lookups, record_error
+from models import AsyncSessionLocal, ArticleSummary
+from scheduler import background
+from shared_cache import shared_cache
+from singleflight import summary_flight, stream_hub, worker_lock, flight_key, prompt_hash
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+def extract_article_id(url: str) -> str:
+    """从URL中提取文章ID"""
+    match = re.search(r'/archives/([^/]+)/?$', url)
+    if match:
+        return match.group(1)
+    raise ValueError("无法从URL中提取文章ID")
+
+async def save_summary(article_id: str, last_updated: datetime, summary: str, fp: Fingerprint = None,
+                       config: dict = None, content: str = None, article_url: str = None):
+    """写入或更新文章摘要及正文指纹，同时记录生成时的模型、提示词和正文"""
+    fp = fp or Fingerprint(None, None)
+    values = dict(
+        article_id=article_id,
+        last_updated=last_updated,
+        summary=summary,
+        from_cache=False,
+        content_hash=fp.content_hash,
+        simhash=fp.simhash,
+        last_accessed=datetime.utcnow()
+    )
+    if config is not None:
+        values.update(model=config['MODEL'], prompt_hash=prompt_hash(config['SYSTEM_CONTENT']))
+    if content is not None:
+        values.update(content=content)
+    if article_url:
+        values.update(article_url=article_url)
+    async with AsyncSessionLocal() as db:
+        await db.merge(ArticleSummary(**values))
+        await db.commit()
+    cached = CachedSummary(summary, last_updated, False, fp.content_hash, fp.simhash)
+    summary_cache.set(article_id, cached)
+    # 写入共享缓存，并让其他进程丢弃旧的本地副本
+    await shared_cache.set_summaries({article_id: cached})
+    await shared_cache.invalidate((article_id,), shared=False)
+    event_log.record('generated', 'success', article_id=article_id)
+
+async def touch_summary(article_id: str, cached_summary: CachedSummary, last_updated: datetime):
+    """正文未变化时只刷新更新时间，沿用旧摘要"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ArticleSummary)
+            .where(ArticleSummary.article_id == article_id)
+            .values(last_updated=last_updated)
+        )
+        await db.commit()
+    cached_summary = cached_summary._replace(last_updated=last_updated)
+    summary_cache.set(article_id, cached_summary)
+    await shared_cache.set_summaries({article_id: cached_summary})
+
+async def reuse_if_unchanged(article_id: str, cached_summary: CachedSummary, content: str,
+                             last_updated: datetime, config: dict) -> bool:
+    """比较正文指纹，内容相同或近似时刷新时间戳并返回 True"""
+    if not config.get('CONTENT_FINGERPRINT'):
+        return False
+    current = await asyncio.to_thread(fingerprint.compute, content)
+    stored = Fingerprint(cached_summary.content_hash, cached_summary.simhash)
+    decision = fingerprint.compare(stored, current, int(config['SIMHASH_THRESHOLD']))
+    logger.debug("文章 %s 正文指纹比对结果: %s", article_id, decision)
+    if decision in ("unchanged", "near_duplicate"):
+        await touch_summary(article_id, cached_summary, last_updated)
+        return True
+    return False
+
+async def get_cached_summary(article_id: str, min_updated: datetime = None):
+    """查询摘要缓存，依次读取进程内缓存、多进程共享缓存和数据库，未命中或副本过旧时查询下一级并回填"""
+    cached = summary_cache.get(article_id)
+    if cached is not None and (min_updated is None or cached.last_updated >= min_updated):
+        cache_lookups.inc('memory', 'hit')
+        storage.touch((article_id,))
+        return cached
+    cache_lookups.inc('memory', 'miss')
+    if shared_cache.enabled:
+        cached = await shared_cache.get_summary(article_id)
+        if cached is not None and (min_updated is None or cached.last_updated >= min_updated):
+            cache_lookups.inc('shared', 'hit')
+            summary_cache.set(article_id, cached)
+            storage.touch((article_id,))
+            return cached
+        cache_lookups.inc('shared', 'miss')
+    async with AsyncSessionLocal() as db:
+        # 只查询需要的列，不构建 ORM 对象
+        row = (await db.execute(
+            select(
+                ArticleSummary.summary,
+                ArticleSummary.last_updated,
+                ArticleSummary.from_cache,
+                ArticleSummary.content_hash,
+                ArticleSummary.simhash
+            ).where(ArticleSummary.article_id == article_id)
+        )).first()
+    if row is None:
+        cache_lookups.inc('db', 'miss')
+        return None
+    cache_lookups.inc('db', 'hit')
+    cached = CachedSummary(row.summary, row.last_updated, bool(row.from_cache), row.content_hash, row.simhash)
+    summary_cache.set(article_id, cached)
+    await shared_cache.set_summaries({article_id: cached})
+    storage.touch((article_id,))
+    return cached
+
+# 批量查询时每条 IN 语句包含的文章数，避免超过 SQLite 的参数个数限制
+IN_QUERY_BATCH = 500
+
+async def get_cached_summaries(article_ids):
+    """批量查询摘要，内存未命中的文章先批量读取共享缓存，再合并为 IN 查询，返回 {文章ID: CachedSummary}"""
+    found = {}
+    missing = []
+    for article_id in dict.fromkeys(article_ids):
+        cached = summary_cache.get(article_id)
+        if cached is not None:
+            found[article_id] = cached
+        else:
+            missing.append(article_id)
+    memory_hits = len(found)
+    cache_lookups.inc('memory', 'hit', amount=memory_hits)
+    cache_lookups.inc('memory', 'miss', amount=len(missing))
+    if shared_cache.enabled and missing:
+        shared = await shared_cache.get_summaries(missing)
+        for article_id, cached in shared.items():
+            summary_cache.set(article_id, cached)
+        found.update(shared)
+        cache_lookups.inc('shared', 'hit', amount=len(shared))
+        cache_lookups.inc('shared', 'miss', amount=len(missing) - len(shared))
+        missing = [article_id for article_id in missing if article_id not in shared]
+    loaded = {}
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(missing), IN_QUERY_BATCH):
+            rows = (await db.execute(
+                select(
+                    ArticleSummary.article_id,
+                    ArticleSummary.summary,
+                    ArticleSummary.last_updated,
+                    ArticleSummary.from_cache,
+                    ArticleSummary.content_hash,
+                    ArticleSummary.simhash
+                ).where(ArticleSummary.article_id.in_(missing[start:start + IN_QUERY_BATCH]))
+            )).all()
+            for row in rows:
+                cached = CachedSummary(row.summary, row.last_updated, bool(row.from_cache), row.content_hash, row.simhash)
+                summary_cache.set(row.article_id, cached)
+                loaded[row.article_id] = cached
+    found.update(loaded)
+    await shared_cache.set_summaries(loaded)
+    cache_lookups.inc('db', 'hit', amount=len(loaded))
+    cache_lookups.inc('db', 'miss', amount=len(missing) - len(loaded))
+    storage.touch(found)
+    return found
+
+async def preload_recent(limit: int) -> int:
+    """把最近访问的摘要载入进程内缓存，启动后的首批请求不必查询数据库"""
+    limit = min(limit, summary_cache.maxsize)
+    if limit <= 0:
+        return 0
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(
+                ArticleSummary.article_id,
+                ArticleSummary.summary,
+                ArticleSummary.last_updated,
+                ArticleSummary.from_cache,
+                ArticleSummary.content_hash,
+                ArticleSummary.simhash
+            ).order_by(ArticleSummary.last_accessed.desc()).limit(limit)
+        )).all()
+    # 最近访问的最后写入，在 LRU 中最晚被淘汰
+    for row in reversed(rows):
+        summary_cache.set(
+            row.article_id,
+            CachedSummary(row.summary, row.last_updated, bool(row.from_cache), row.content_hash, row.simhash)
+        )
+    return len(rows)
+
+async def mark_from_cache(article_id: str):
+    """标记摘要曾被缓存命中，每条记录只写一次数据库"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ArticleSummary)
+            .where(ArticleSummary.article_id == article_id)
+            .values(from_cache=True)
+        )
+        await db.commit()
+
+async def mark_many_from_cache(cached_summaries: dict):
+    """批量标记缓存命中，只更新尚未标记的记录"""
+    article_ids = [article_id for article_id, cached in cached_summaries.items() if not cached.from_cache]
+    if not article_ids:
+        return
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(article_ids), IN_QUERY_BATCH):
+            await db.execute(
+                update(ArticleSummary)
+                .where(ArticleSummary.article_id.in_(article_ids[start:start + IN_QUERY_BATCH]))
+                .values(from_cache=True)
+            )
+        await db.commit()
+    for article_id in article_ids:
+        summary_cache.set(article_id, cached_summaries[article_id]._replace(from_cache=True))
+
+async def _generate(article_id: str, last_updated, content: str, config: dict, key: str,
+                    article_url: str = None) -> str:
+    async with worker_lock.hold(config, key) as waited:
+        if waited:
+            # 等待过其他进程的锁，结果可能已经写入
+            cached_summary = await get_cached_summary(article_id, last_updated)
+            if cached_summary and (last_updated is None or cached_summary.last_updated >= last_updated):
+                return cached_summary.summary
+        # 异步调用，等待模型响应期间不阻塞其他请求
+        # 超长文章先分段摘要，再合并为最终摘要
+        model_input = await chunking.prepare_input(config, content)
+        summary = await llm_client.summarize(config, model_input)
+        fp = await asyncio.to_thread(fingerprint.compute, content)
+        await save_summary(article_id, last_updated or datetime.utcnow(), summary, fp, config, content, article_url)
+        return summary
+
+async def generate_and_store(article_id: str, last_updated, content: str, config: dict,
+                             article_url: str = None) -> str:
+    """生成并保存摘要，同一文章的并发请求只调用一次模型"""
+    key = flight_key(article_id, last_updated, config['MODEL'], config['SYSTEM_CONTENT'])
+    return await summary_flight.do(
+        key, lambda: _generate(article_id, last_updated, content, config, key, article_url)
+    )
+
+async def _generate_stream(article_id: str, last_updated: datetime, content: str, config: dict, key: str, stream,
+                           article_url: str = None) -> str:
+    """流式生成，分片推送给所有观看者，结束后只保存一次"""
+    try:
+        async with worker_lock.hold(config, key) as waited:
+            cached_summary = await get_cached_summary(article_id, last_updated) if waited else None
+            if cached_summary and cached_summary.last_updated >= last_updated:
+                summary = cached_summary.summary
+                stream.push(summary)
+            else:
+                parts = []
+                model_input = await chunking.prepare_input(config, content)
+                async for delta in llm_client.stream_summary(config, model_input):
+                    parts.append(delta)
+                    stream.push(delta)
+                summary = "".join(parts)
+                fp = await asyncio.to_thread(fingerprint.compute, content)
+                await save_summary(article_id, last_updated, summary, fp, config, content, article_url)
+    except asyncio.CancelledError:
+        # 生成被取消（如服务关闭）时也要结束共享流，否则其他观看者会一直等待
+        stream_hub.close(key, stream, RuntimeError("摘要生成已取消"))
+        raise
+    except Exception as error:
+        stream_hub.close(key, stream, error)
+        raise
+    stream_hub.close(key, stream)
+    return summary
+
+async def _wait_result(task):
+    yield await asyncio.shield(task)
+
+def open_summary_stream(article_id: str, last_updated: datetime, content: str, config: dict,
+                        article_url: str = None):
+    """加入或启动流式生成，返回摘要分片的异步迭代器"""
+    key = flight_key(article_id, last_updated, config['MODEL'], config['SYSTEM_CONTENT'])
+    stream = stream_hub.get(key)
+    if stream is not None:
+        return stream.subscribe()
+    if summary_flight.running(key):
+        # 同一文章已有非流式生成在进行，等待其结果后一次性返回
+        return _wait_result(summary_flight.start(key, None))
+    stream = stream_hub.open(key)
+    summary_flight.start(
+        key, lambda: _generate_stream(article_id, last_updated, content, config, key, stream, article_url)
+    )
+    return stream.subscribe()
+
+async def lookup_fresh(article_id: str, last_updated: datetime, content_hash: str = None):
+    """查询未过期的摘要；带有 content_hash 且与已保存的正文哈希一致时，视为内容未变化
+
+    供 GET / HEAD 查询使用，不写数据库：访问时间由 storage 批量写入，更新时间在提交正文时由 reuse_if_unchanged 刷新
+    """
+    cached_summary = await get_cached_summary(article_id, last_updated)
+    if not cached_summary:
+        return None, None
+    if cached_summary.last_updated >= last_updated:
+        return cached_summary, cached_summary
+    if content_hash and cached_summary.content_hash == content_hash:
+        return cached_summary, cached_summary
+    return None, cached_summary
+
+async def revalidate_summary(article_id: str, last_updated: datetime, content: str, config: dict,
+                             article_url: str = None):
+    """后台重新生成过期摘要，模型调用排在访客请求之后"""
+    try:
+        with background():
+            await generate_and_store(article_id, last_updated, content, config, article_url)
+        logger.info("后台刷新摘要完成: %s", article_id)
+    except Exception as error:
+        record_error('revalidate', error)
+        logger.warning("后台刷新摘要失败: %s: %s", article_id, error, exc_info=error)
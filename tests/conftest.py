@@ -0,0 +1,88 @@
+"""测试公共设置
+
+各模块以当前目录下的 config.json、summaries.db、themes/ 和 templates/ 为准，
+导入被测模块之前切换到临时工作目录，避免改动仓库中的配置和数据库。
+
+    pip install pytest
+    python -m pytest -q
+"""
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='ai-summary-tests-')
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+
+for name in ('templates', 'themes', 'static'):
+    os.symlink(os.path.join(ROOT, name), os.path.join(WORKDIR, name))
+with open(os.path.join(WORKDIR, 'config.json'), 'w', encoding='utf-8') as f:
+    # 不启动后台消费协程，不连接真实上游
+    json.dump({"JOB_WORKERS": 0, "WARMUP_SUMMARIES": 0, "BASE_URL": "http://127.0.0.1:9/v1"}, f)
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+
+from config_store import config_store
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def config():
+    return config_store.get()
+
+
+@pytest.fixture(scope='session')
+def db():
+    import models
+    models.init_db()
+    return models
+
+
+@pytest.fixture(scope='session')
+def client(db):
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.create_app()) as client:
+        yield client
+
+
+@pytest.fixture
+def admin_client(client):
+    from security import create_access_token
+    client.cookies.set('access_token', create_access_token({"sub": config_store.get()['admin']['username']}))
+    yield client
+    client.cookies.clear()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """替换模型调用：返回固定格式的摘要，正文包含 boom 时抛出异常；返回收到的正文列表"""
+    import llm_client
+    calls = []
+
+    def reply(content):
+        calls.append(content)
+        if 'boom' in content:
+            raise RuntimeError("upstream failed")
+        return f"摘要：{content[:10]}"
+
+    async def summarize(config, content):
+        return reply(content)
+
+    async def stream_summary(config, content):
+        summary = reply(content)
+        for index in range(0, len(summary), 3):
+            yield summary[index:index + 3]
+
+    monkeypatch.setattr(llm_client, 'summarize', summarize)
+    monkeypatch.setattr(llm_client, 'stream_summary', stream_summary)
+    return calls
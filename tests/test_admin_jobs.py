@@ -0,0 +1,72 @@
+import pytest
+
+JOB_ROUTES = [
+    ("get", "/admin/api/jobs"),
+    ("post", "/admin/api/jobs"),
+    ("post", "/admin/api/jobs/batch"),
+    ("post", "/admin/api/jobs/outdated"),
+    ("delete", "/admin/api/jobs"),
+    ("post", "/admin/api/refresh/abc"),
+]
+
+
+@pytest.mark.parametrize("method,url", JOB_ROUTES)
+def test_job_routes_require_admin(client, method, url):
+    response = client.request(method, url, follow_redirects=False)
+    assert response.status_code == 401
+
+
+def test_job_routes_reject_invalid_token(client):
+    client.cookies.set('access_token', 'not-a-token')
+    try:
+        assert client.get("/admin/api/jobs", follow_redirects=False).status_code == 401
+    finally:
+        client.cookies.clear()
+
+
+def test_admin_can_read_progress(admin_client):
+    response = admin_client.get("/admin/api/jobs")
+    assert response.status_code == 200
+
+
+def test_enqueue_rejects_non_http_url(admin_client):
+    response = admin_client.post("/admin/api/jobs", json={"article_url": "file:///etc/passwd"})
+    assert response.status_code == 400
+
+
+def test_batch_upload(admin_client):
+    data = b'{"id": "uploaded-1"}\n{"id": "uploaded-2"}\nnot json\n'
+    response = admin_client.post("/admin/api/jobs/batch", files={"file": ("jobs.ndjson", data)})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["queued"], body["error_count"]) == (2, 1)
+    admin_client.delete("/admin/api/jobs")
+
+
+def test_batch_upload_rejects_binary(admin_client):
+    response = admin_client.post("/admin/api/jobs/batch", files={"file": ("jobs.bin", b"\xff\xfe\x00\x81")})
+    assert response.status_code == 400
+
+
+def test_batch_path_requires_import_dir(admin_client, config, monkeypatch):
+    monkeypatch.setitem(config, 'JOB_IMPORT_DIR', '')
+    response = admin_client.post("/admin/api/jobs/batch", data={"path": "sitemap.xml"})
+    assert response.status_code == 400
+
+
+def test_batch_path_is_confined_to_import_dir(admin_client, config, monkeypatch, tmp_path):
+    import_dir = tmp_path / "imports"
+    import_dir.mkdir()
+    (import_dir / "ok.ndjson").write_text('{"id": "imported-1"}\n', encoding='utf-8')
+    (tmp_path / "secret.ndjson").write_text('{"id": "secret"}\n', encoding='utf-8')
+    (import_dir / "link.ndjson").symlink_to(tmp_path / "secret.ndjson")
+    monkeypatch.setitem(config, 'JOB_IMPORT_DIR', str(import_dir))
+
+    for path in ("../secret.ndjson", str(tmp_path / "secret.ndjson"), "link.ndjson", "missing.ndjson"):
+        response = admin_client.post("/admin/api/jobs/batch", data={"path": path})
+        assert response.status_code == 404, path
+
+    response = admin_client.post("/admin/api/jobs/batch", data={"path": "ok.ndjson"})
+    assert response.status_code == 200
+    assert response.json()["queued"] == 1
+    admin_client.delete("/admin/api/jobs")
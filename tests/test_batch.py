@@ -0,0 +1,54 @@
+import json
+
+
+def post_batch(client, items):
+    response = client.post("/api/api/summary/batch", json={"items": items})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return {line["id"]: line for line in lines}, lines
+
+
+def test_failing_items_do_not_abort_the_batch(client, upstream):
+    results, lines = post_batch(client, [
+        {"id": "batch-good", "content": "正常的文章正文", "last_updated": "2024-05-01 12:00:00"},
+        {"id": "batch-invalid", "content": "正文", "last_updated": "not a date"},
+        {"id": "batch-boom", "content": "boom 上游出错", "last_updated": "2024-05-01 12:00:00"},
+    ])
+    # 每篇文章一行
+    assert len(lines) == 3
+    assert results["batch-good"] == {"id": "batch-good", "summary": "摘要：正常的文章正文", "cached": False}
+    assert "error" in results["batch-invalid"] and "summary" not in results["batch-invalid"]
+    assert results["batch-boom"] == {"id": "batch-boom", "error": "处理请求时发生错误。"}
+    # 日期无效的文章不调用模型
+    assert sorted(upstream) == ["boom 上游出错", "正常的文章正文"]
+
+
+def test_cached_items_are_streamed_first(client, upstream):
+    post_batch(client, [{"id": "batch-cached", "content": "已生成的文章", "last_updated": "2024-05-01 12:00:00"}])
+    upstream.clear()
+    results, lines = post_batch(client, [
+        {"id": "batch-new", "content": "新文章", "last_updated": "2024-05-01 12:00:00"},
+        {"id": "batch-cached", "content": "已生成的文章", "last_updated": "2024-05-01 12:00:00"},
+    ])
+    assert lines[0] == {"id": "batch-cached", "summary": "摘要：已生成的文章", "cached": True}
+    assert results["batch-new"]["cached"] is False
+    assert upstream == ["新文章"]
+
+
+def test_scheduler_busy_is_reported_per_item(client, upstream, monkeypatch):
+    import llm_client
+    from scheduler import SchedulerBusy
+
+    async def busy(config, content):
+        raise SchedulerBusy("queue_full")
+
+    monkeypatch.setattr(llm_client, 'summarize', busy)
+    results, lines = post_batch(client, [{"id": "batch-busy", "content": "正文"}])
+    assert results["batch-busy"] == {"id": "batch-busy", "error": "摘要服务繁忙，请稍后重试。"}
+
+
+def test_too_many_items_is_rejected(client, config, monkeypatch):
+    monkeypatch.setitem(config, 'BATCH_MAX_ITEMS', 1)
+    items = [{"id": "a", "content": "正文"}, {"id": "b", "content": "正文"}]
+    assert client.post("/api/api/summary/batch", json={"items": items}).status_code == 413
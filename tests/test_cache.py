@@ -0,0 +1,47 @@
+import cache
+from cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert lru.stats["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set("a", 1)
+    now[0] += 4
+    assert lru.get("a") == 1
+    now[0] += 2
+    assert lru.get("a") is None
+    assert lru.stats["expired"] == 1
+    assert lru.get_stats()["size"] == 0
+
+
+def test_configure_shrinks_and_zero_size_disables():
+    lru = LRUCache(maxsize=3, ttl=60)
+    for key in "abc":
+        lru.set(key, key)
+    lru.configure(1, 60)
+    assert lru.get_stats()["size"] == 1
+    assert lru.get("c") == "c"
+    lru.configure(0, 60)
+    lru.set("d", "d")
+    assert lru.get("d") is None
+
+
+def test_hit_rate():
+    lru = LRUCache(maxsize=10, ttl=60)
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("missing")
+    assert lru.get_stats()["hit_rate"] == 50.0
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+import anyio
+import pytest
+
+import chunking
+import llm_client
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    # 按字符计数，结果不受是否安装 tiktoken 影响
+    monkeypatch.setattr(chunking, 'count_tokens', len)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    async def complete(config, system, content):
+        calls.append(content)
+        return config['STUB_REPLY']
+
+    monkeypatch.setattr(llm_client, 'complete', complete)
+    return calls
+
+
+def make_config(**overrides):
+    return {"MAX_INPUT_TOKENS": 100, "CHUNK_MAX_ROUNDS": 3, "CHUNK_CONCURRENCY": 4, "STUB_REPLY": "摘要",
+            **overrides}
+
+
+def article(paragraphs, length=90):
+    return "\n\n".join(str(i % 10) * length for i in range(paragraphs))
+
+
+async def test_short_article_is_passed_through(calls):
+    assert await chunking.prepare_input(make_config(), "短文") == "短文"
+    content = article(5)
+    assert await chunking.prepare_input(make_config(MAX_INPUT_TOKENS=0), content) == content
+    assert calls == []
+
+
+def test_split_chunks_respects_budget():
+    chunks = chunking.split_chunks(article(10) + "\n\n" + "句子。" * 100, 100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == (article(10) + "句子。" * 100).replace("\n", "")
+
+
+async def test_long_article_is_reduced_over_rounds(calls):
+    result = await chunking.prepare_input(make_config(STUB_REPLY="摘" * 8), article(10))
+    assert len(result) <= 100
+    first_round = [call for call in calls if "/10 段" in call]
+    assert len(first_round) == 10
+    # 第一轮合并后仍超过上限，第二轮对各部分的摘要再分段摘要
+    assert len(calls) > len(first_round)
+    assert any("第 1 部分" in call for call in calls[len(first_round):])
+
+
+async def test_still_over_budget_after_max_rounds_is_truncated(calls, caplog):
+    config = make_config(CHUNK_MAX_ROUNDS=1, STUB_REPLY="长" * 200)
+    with caplog.at_level(logging.WARNING, logger='chunking'):
+        result = await chunking.prepare_input(config, article(4))
+    assert len(calls) == 4
+    assert 0 < len(result) <= 100
+    assert result.startswith("以下是一篇长文章各部分的摘要")
+    assert "截断" in caplog.text
+
+
+async def test_chunk_concurrency_is_limited(monkeypatch):
+    active = peak = 0
+
+    async def complete(config, system, content):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return "摘要"
+
+    monkeypatch.setattr(llm_client, 'complete', complete)
+    await chunking.prepare_input(make_config(CHUNK_CONCURRENCY=2), article(8))
+    assert peak == 2
+
+    # 0 按 1 处理，不会一直等待
+    peak = 0
+    with anyio.fail_after(5):
+        await chunking.prepare_input(make_config(CHUNK_CONCURRENCY=0), article(8))
+    assert peak == 1
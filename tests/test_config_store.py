@@ -0,0 +1,147 @@
+import copy
+import json
+import os
+
+import pytest
+
+from config_store import DEFAULT_CONFIG, ConfigStore, config_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConfigStore(str(tmp_path / "config.json"), check_interval=0)
+    store.changes = []
+    store.subscribe(lambda old, new: store.changes.append((old, new)))
+    return store
+
+
+def write(path, data, bump_mtime=True):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    if bump_mtime:
+        # 同一时钟周期内的两次写入 mtime 可能相同，手动推进
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_missing_file_is_created_with_defaults(store):
+    config = store.get()
+    assert config == DEFAULT_CONFIG
+    assert os.path.exists(store.path)
+    assert len(store.changes) == 1 and store.changes[0][0] is None
+
+
+def test_missing_fields_are_filled_from_defaults(store):
+    write(store.path, {"MODEL": "qwen-max"})
+    config = store.get()
+    assert config["MODEL"] == "qwen-max"
+    assert config["THEME"] == DEFAULT_CONFIG["THEME"]
+
+
+def test_unchanged_file_is_not_reparsed(store, monkeypatch):
+    config = store.get()
+    monkeypatch.setattr(json, 'load', lambda f: pytest.fail("config.json re-read"))
+    assert store.get() is config
+    assert len(store.changes) == 1
+
+
+def test_edit_on_disk_is_picked_up_once(store):
+    first = store.get()
+    version = store.version
+    write(store.path, {**first, "MODEL": "qwen-max"})
+    config = store.get()
+    assert config["MODEL"] == "qwen-max"
+    assert store.version == version + 1
+    assert store.get() is config
+    assert len(store.changes) == 2
+    assert (store.changes[1][0]["MODEL"], store.changes[1][1]["MODEL"]) == (first["MODEL"], "qwen-max")
+
+
+def test_size_change_is_detected_without_mtime_change(store):
+    store.get()
+    stat = os.stat(store.path)
+    write(store.path, {"MODEL": "a-much-longer-model-name"}, bump_mtime=False)
+    os.utime(store.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert store.get()["MODEL"] == "a-much-longer-model-name"
+
+
+def test_rewrite_with_same_content_does_not_notify(store):
+    config = store.get()
+    write(store.path, config)
+    store.get()
+    assert len(store.changes) == 1
+
+
+def test_check_interval_and_refresh(tmp_path):
+    store = ConfigStore(str(tmp_path / "config.json"), check_interval=3600)
+    store.get()
+    write(store.path, {"MODEL": "qwen-max"})
+    # 检查间隔内不读取文件，refresh() 后立即检查（其他进程修改配置后使用）
+    assert store.get()["MODEL"] == DEFAULT_CONFIG["MODEL"]
+    store.refresh()
+    assert store.get()["MODEL"] == "qwen-max"
+
+
+def test_save_replaces_file_atomically(store, tmp_path):
+    config = copy.deepcopy(store.get())
+    config["MODEL"] = "qwen-turbo"
+    store.save(config)
+    assert len(store.changes) == 2
+    assert store.get()["MODEL"] == "qwen-turbo"
+    # 没有遗留的临时文件，其他进程读到完整的新配置
+    assert os.listdir(tmp_path) == ["config.json"]
+    assert ConfigStore(store.path).get()["MODEL"] == "qwen-turbo"
+    # 保存后不会因为文件时间变化再次通知
+    store.get()
+    assert len(store.changes) == 2
+
+
+def test_failed_save_keeps_previous_file(store, monkeypatch):
+    store.get()
+    with open(store.path, encoding='utf-8') as f:
+        before = f.read()
+
+    def broken_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(json, 'dump', broken_dump)
+    with pytest.raises(OSError):
+        store.save({"MODEL": "qwen-turbo"})
+    with open(store.path, encoding='utf-8') as f:
+        assert f.read() == before
+
+
+def test_failing_listener_does_not_block_others(store):
+    calls = []
+
+    def broken(old, new):
+        raise RuntimeError("listener failed")
+
+    store.subscribe(broken)
+    store.subscribe(lambda old, new: calls.append(new["MODEL"]))
+    store.get()
+    assert calls == [DEFAULT_CONFIG["MODEL"]]
+
+
+@pytest.fixture
+def restore_config():
+    original = copy.deepcopy(config_store.get())
+    yield original
+    config_store.save(original)
+
+
+def test_config_change_reconfigures_scheduler_and_llm_client(restore_config):
+    import llm_client
+    from scheduler import llm_scheduler
+
+    old_backend = llm_client.get_pool(config_store.get()).backends[0]
+    config_store.save({**restore_config, "LLM_MAX_CONCURRENCY": 3, "HTTP_TIMEOUT": 12})
+    assert llm_scheduler.max_concurrency == 3
+    backend = llm_client.pool.backends[0]
+    assert backend is not old_backend
+    assert backend.settings.timeout == 12
+
+    # 与客户端无关的设置变化时保留原有连接
+    config_store.save({**config_store.get(), "LLM_MAX_CONCURRENCY": 4})
+    assert llm_client.pool.backends[0] is backend
+    assert llm_scheduler.max_concurrency == 4
@@ -0,0 +1,116 @@
+import html
+import re
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import models
+from summaries import save_summary
+
+TOKEN = "仪表盘测试"
+START = datetime(2023, 3, 1)
+
+
+@pytest.fixture(scope='module')
+def seeded(client):
+    # 25 篇文章，更新时间依次递增；dash-00 与 dash-01 的更新时间相同，由 article_id 决定次序
+    for index in range(25):
+        last_updated = START + timedelta(minutes=max(index, 1))
+        client.portal.call(save_summary, f"dash-{index:02d}", last_updated, f"{TOKEN} 第{index:02d}篇")
+    return [f"dash-{index:02d}" for index in range(25)]
+
+
+def dashboard(client, **params):
+    response = client.get("/admin/dashboard", params=params, follow_redirects=False)
+    assert response.status_code == 200, response.text[:200]
+    body = html.unescape(response.text)
+    ids = re.findall(r'<td>(dash-\d+)</td>', body)
+    next_cursor = re.search(r'[?&]cursor=([^&"]+)', body)
+    prev_cursor = re.search(r'[?&]before=([^&"]+)', body)
+    return ids, next_cursor and next_cursor.group(1), prev_cursor and prev_cursor.group(1)
+
+
+def walk(client, **params):
+    pages, cursor = [], None
+    while True:
+        ids, cursor, _ = dashboard(client, per_page=10, search=TOKEN, **params, **({"cursor": cursor} if cursor else {}))
+        pages.append(ids)
+        if not cursor:
+            return pages
+
+
+@pytest.mark.parametrize("sort,order", [("last_updated", "desc"), ("last_updated", "asc"), ("article_id", "asc"),
+                                        ("created_at", "desc")])
+def test_cursor_pages_cover_every_row_once(admin_client, seeded, sort, order):
+    pages = walk(admin_client, sort=sort, order=order)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    ids = [article_id for page in pages for article_id in page]
+    assert sorted(ids) == seeded
+    if sort == "last_updated":
+        # 更新时间相同的行按 article_id 排序
+        expected = seeded if order == "asc" else list(reversed(seeded))
+        assert ids == expected
+
+
+def test_cursor_is_stable_when_rows_are_added(admin_client, seeded):
+    first, cursor, _ = dashboard(admin_client, per_page=10, search=TOKEN)
+    assert first == list(reversed(seeded))[:10]
+    # 翻页期间新增一篇排在最前面的文章，下一页不会重复上一页的最后一行
+    admin_client.portal.call(save_summary, "dash-99", START + timedelta(days=1), f"{TOKEN} 新文章")
+    try:
+        second, _, before = dashboard(admin_client, per_page=10, search=TOKEN, cursor=cursor)
+        assert second == list(reversed(seeded))[10:20]
+        # 向前翻页回到第一页的内容
+        previous, _, _ = dashboard(admin_client, per_page=10, search=TOKEN, before=before)
+        assert previous == first
+    finally:
+        admin_client.delete("/admin/api/delete/dash-99")
+
+
+def test_invalid_cursor_is_rejected(admin_client, seeded):
+    response = admin_client.get("/admin/dashboard", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("search,expected", [
+    ("第07篇", ["dash-07"]),   # 全文索引
+    ("07", ["dash-07"]),       # 短于 3 个字符，使用 LIKE
+    ("盘", None),              # 单个字符
+    ("dash-1", [f"dash-1{i}" for i in range(10)]),
+    ("不存在的内容", []),
+])
+def test_search(admin_client, seeded, search, expected):
+    ids, _, _ = dashboard(admin_client, per_page=100, search=search, sort="article_id", order="asc")
+    if expected is None:
+        assert set(seeded) <= set(ids)
+    else:
+        assert ids == expected
+
+
+def test_search_uses_full_text_index(seeded):
+    from admin import _search_filter
+    if not models.FTS_ENABLED:
+        pytest.skip("SQLite 不支持 FTS5")
+    assert "MATCH" in str(_search_filter("第07篇"))
+    assert "MATCH" not in str(_search_filter("07"))
+
+
+def test_legacy_page_redirects_to_cursor(admin_client, seeded):
+    params = {"per_page": 10, "search": TOKEN, "page": 2}
+    response = admin_client.get("/admin/dashboard", params=params, follow_redirects=False)
+    assert response.status_code in (302, 307)
+    location = response.headers["location"]
+    query = parse_qs(urlsplit(location).query)
+    assert query["page"] == ["2"] and query["cursor"]
+    ids = re.findall(r'<td>(dash-\d+)</td>', admin_client.get(location).text)
+    assert ids == list(reversed(seeded))[10:20]
+
+
+def test_legacy_page_past_the_end_redirects_to_first_page(admin_client, seeded):
+    response = admin_client.get("/admin/dashboard", params={"per_page": 10, "search": TOKEN, "page": 9},
+                                follow_redirects=False)
+    assert response.status_code in (302, 307)
+    query = parse_qs(urlsplit(response.headers["location"]).query)
+    assert "page" not in query and "cursor" not in query
+    assert query["per_page"] == ["10"]
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from events import EventLog, event_log, percentiles
+from models import ROLLUP_COUNTERS
+
+pytestmark = pytest.mark.anyio
+
+DAY = datetime(2020, 1, 1)
+FIRST, SECOND = DAY.replace(hour=10, second=30), DAY.replace(hour=10, minute=1, second=10)
+
+
+def record(log, at, kind, outcome, duration_ms=None, **fields):
+    log.record(kind, outcome, duration=duration_ms / 1000 if duration_ms is not None else None, **fields)
+    log._pending[-1]['created_at'] = at
+
+
+async def totals(db):
+    async with db.AsyncSessionLocal() as session:
+        return dict((await session.execute(select(db.StatsTotal.key, db.StatsTotal.value))).all())
+
+
+async def rollup(db, granularity, period):
+    async with db.AsyncSessionLocal() as session:
+        row = await session.get(db.StatsRollup, (granularity, period))
+        return {name: getattr(row, name) for name in ROLLUP_COUNTERS} if row else None
+
+
+async def latency(db, granularity, period):
+    async with db.AsyncSessionLocal() as session:
+        rows = (await session.execute(select(db.StatsLatency.metric, db.StatsLatency.le, db.StatsLatency.count).where(
+            db.StatsLatency.granularity == granularity, db.StatsLatency.period == period
+        ))).all()
+    return {(metric, le): count for metric, le, count in rows}
+
+
+@pytest.fixture
+async def log(db):
+    # 先写入应用已记录的事件，避免计入本测试的累计值
+    await event_log.flush()
+    async with db.AsyncSessionLocal() as session:
+        for table in (db.StatsRollup, db.StatsLatency, db.RequestEvent):
+            await session.execute(delete(table))
+        await session.commit()
+    return EventLog()
+
+
+def counters(**values):
+    return {name: values.get(name, 0) for name in ROLLUP_COUNTERS}
+
+
+async def test_flush_rolls_up_by_minute_and_day(db, log):
+    before = await totals(db)
+    record(log, FIRST, 'request', 'hit', 10, route='summary')
+    record(log, FIRST, 'request', 'stale', 300, route='summary')
+    record(log, FIRST, 'llm', 'success', 2000, backend='primary', prompt_tokens=100, completion_tokens=20)
+    record(log, SECOND, 'request', 'error', 1000, route='summary')
+    record(log, SECOND, 'llm', 'error', 500, backend='primary')
+    record(log, SECOND, 'generated', 'success', article_id='a')
+    # 批量请求中的文章不计耗时
+    record(log, SECOND, 'request', 'miss', route='batch')
+    assert await log.flush() == 7
+    assert log.stats["written"] == 7
+
+    minute = FIRST.replace(second=0)
+    assert await rollup(db, 'minute', minute) == counters(
+        requests=2, cache_hits=1, stale_hits=1, llm_calls=1, prompt_tokens=100, completion_tokens=20)
+    assert await rollup(db, 'minute', minute + timedelta(minutes=1)) == counters(
+        requests=2, errors=1, llm_calls=1, llm_errors=1, generated=1)
+    day = counters(requests=4, cache_hits=1, stale_hits=1, errors=1, generated=1, llm_calls=2, llm_errors=1,
+                   prompt_tokens=100, completion_tokens=20)
+    assert await rollup(db, 'day', DAY) == day
+    assert await latency(db, 'day', DAY) == {
+        ('request', 10): 1, ('request', 500): 1, ('request', 1000): 1, ('llm', 2000): 1, ('llm', 500): 1,
+    }
+    after = await totals(db)
+    assert {name: after.get(name, 0) - before.get(name, 0) for name in ROLLUP_COUNTERS} == day
+
+    async with db.AsyncSessionLocal() as session:
+        assert await session.scalar(select(func.count()).select_from(db.RequestEvent)) == 7
+
+
+async def test_flush_adds_to_existing_rollups(db, log):
+    record(log, FIRST, 'request', 'hit', 10)
+    await log.flush()
+    record(log, FIRST, 'request', 'miss', 10)
+    record(log, FIRST, 'request', 'miss', 200000)
+    await log.flush()
+    assert await rollup(db, 'minute', FIRST.replace(second=0)) == counters(requests=3, cache_hits=1)
+    # 超过最后一个分桶的耗时计入最后一个分桶
+    assert await latency(db, 'minute', FIRST.replace(second=0)) == {('request', 10): 2, ('request', 120000): 1}
+
+
+async def test_failed_flush_keeps_events(log, monkeypatch):
+    import events
+
+    class Broken:
+        async def __aenter__(self):
+            raise RuntimeError("database is locked")
+
+        async def __aexit__(self, *exc):
+            return False
+
+    record(log, FIRST, 'request', 'hit', 10)
+    monkeypatch.setattr(events, 'AsyncSessionLocal', Broken)
+    assert await log.flush() == 0
+    assert len(log._pending) == 1
+
+
+def test_percentiles():
+    assert percentiles({10: 50, 100: 45, 1000: 5}) == {"p50": 10, "p95": 100, "p99": 1000}
+    assert percentiles({}) == {"p50": None, "p95": None, "p99": None}
+
+
+async def test_prune_keeps_day_rollups(db, log):
+    now = datetime.now()
+    old, recent = now - timedelta(days=10), now - timedelta(minutes=5)
+    for at in (old, recent):
+        record(log, at, 'request', 'hit', 10)
+    await log.flush()
+    await log.prune({"EVENT_RETENTION_DAYS": 7, "STATS_MINUTE_RETENTION_HOURS": 48})
+
+    async with db.AsyncSessionLocal() as session:
+        events = (await session.scalars(select(db.RequestEvent.created_at))).all()
+        minutes = (await session.scalars(
+            select(db.StatsRollup.period).where(db.StatsRollup.granularity == 'minute'))).all()
+        days = (await session.scalars(select(db.StatsRollup.period).where(db.StatsRollup.granularity == 'day'))).all()
+        latency_minutes = (await session.scalars(
+            select(db.StatsLatency.period).where(db.StatsLatency.granularity == 'minute'))).all()
+    assert events == [recent]
+    assert minutes == latency_minutes == [recent.replace(second=0, microsecond=0)]
+    assert len(days) == 2
+
+
+async def test_summary_counter_triggers_stay_in_sync(db):
+    from summaries import save_summary
+
+    async def counted():
+        async with db.AsyncSessionLocal() as session:
+            total = await session.scalar(select(db.StatsTotal.value).where(db.StatsTotal.key == 'summaries'))
+            actual = await session.scalar(select(func.count()).select_from(db.ArticleSummary))
+        return total, actual
+
+    total, actual = await counted()
+    assert total == actual
+    for article_id in ("counter-a", "counter-b", "counter-c"):
+        await save_summary(article_id, DAY, "摘要")
+    # 更新已有摘要不重复计数
+    await save_summary("counter-a", DAY, "新摘要")
+    assert await counted() == (actual + 3, actual + 3)
+
+    async with db.AsyncSessionLocal() as session:
+        await session.execute(delete(db.ArticleSummary).where(db.ArticleSummary.article_id.in_(("counter-a", "counter-b"))))
+        await session.commit()
+    assert await counted() == (actual + 1, actual + 1)
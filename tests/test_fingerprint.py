@@ -0,0 +1,40 @@
+import fingerprint
+from fingerprint import Fingerprint, compare, compute, distance
+
+ARTICLE = (
+    "SQLite 的 WAL 模式把写入追加到预写日志中，读操作不会被写操作阻塞。"
+    "检查点会把日志中的页写回数据库文件，日志过大时应调整检查点的频率。"
+) * 3
+
+
+def test_normalization_ignores_whitespace_case_and_width():
+    assert compute("Hello  World\n") == compute("hello world")
+    assert compute("ＡＢＣ１２３") == compute("abc123")
+
+
+def test_unchanged_content():
+    assert compare(compute(ARTICLE), compute(ARTICLE + "  \n"), 3) == "unchanged"
+
+
+def test_small_edit_is_near_duplicate():
+    stored, current = compute(ARTICLE), compute(ARTICLE.replace("频率", "周期", 1))
+    assert stored.content_hash != current.content_hash
+    assert distance(stored.simhash, current.simhash) <= 3
+    assert compare(stored, current, 3) == "near_duplicate"
+    # 阈值为 0 时只接受完全相同的正文
+    assert compare(stored, current, 0) == "changed"
+
+
+def test_rewritten_content_is_changed():
+    other = "FastAPI 的依赖注入在每次请求时解析参数，适合做鉴权和数据库会话管理。" * 3
+    assert compare(compute(ARTICLE), compute(other), 3) == "changed"
+
+
+def test_missing_fingerprint():
+    assert compare(Fingerprint(None, None), compute(ARTICLE), 3) == "no_fingerprint"
+
+
+def test_compare_counts_decisions():
+    before = dict(fingerprint.stats)
+    compare(compute(ARTICLE), compute(ARTICLE), 3)
+    assert fingerprint.stats["unchanged"] == before["unchanged"] + 1
@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+from jobs import MIGRATE, JobQueue
+from scheduler import SchedulerBusy
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def queue(db):
+    async with db.AsyncSessionLocal() as session:
+        await session.execute(delete(db.SummaryJob))
+        await session.commit()
+    return JobQueue()
+
+
+async def all_jobs(db):
+    async with db.AsyncSessionLocal() as session:
+        return (await session.scalars(select(db.SummaryJob).order_by(db.SummaryJob.id))).all()
+
+
+async def test_enqueue_merges_pending_jobs(db, queue):
+    await queue.enqueue([{"article_id": "a"}], reason=MIGRATE)
+    await queue.enqueue([{"article_id": "a", "article_url": "https://blog.example/archives/a", "content": "正文"}],
+                        force=True)
+    jobs = await all_jobs(db)
+    assert len(jobs) == 1
+    job = jobs[0]
+    assert job.article_url == "https://blog.example/archives/a"
+    assert job.content == "正文"
+    assert job.force
+    # 与普通任务合并后不再按重新生成限速
+    assert job.reason is None
+
+
+async def test_concurrent_enqueue_keeps_one_pending_job_per_article(db, queue):
+    items = [{"article_id": f"article-{i}"} for i in range(50)]
+    await asyncio.gather(*(JobQueue().enqueue(items) for _ in range(4)))
+    jobs = await all_jobs(db)
+    assert len(jobs) == 50
+    assert {job.status for job in jobs} == {"pending"}
+
+
+async def test_finished_article_can_be_queued_again(db, queue):
+    await queue.enqueue([{"article_id": "a"}])
+    job_id = (await all_jobs(db))[0].id
+    await queue._finish(job_id, status='done')
+    await queue.enqueue([{"article_id": "a"}])
+    assert [job.status for job in await all_jobs(db)] == ["done", "pending"]
+
+
+async def test_failed_job_is_retried_then_marked_failed(db, queue, config, monkeypatch):
+    monkeypatch.setitem(config, 'JOB_MAX_ATTEMPTS', 2)
+    monkeypatch.setitem(config, 'JOB_RETRY_DELAY', 60)
+
+    async def fail(job_id, config):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(queue, '_process', fail)
+    await queue.enqueue([{"article_id": "a"}])
+    job_id = await queue._claim(config)
+    assert job_id is not None
+
+    await queue._run(job_id)
+    job = (await all_jobs(db))[0]
+    assert (job.status, job.attempts, job.error) == ('pending', 1, "upstream down")
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=30)
+    # 重试时间未到，不会被领取
+    assert await queue._claim(config) is None
+
+    await queue._run(job_id)
+    job = (await all_jobs(db))[0]
+    assert (job.status, job.attempts) == ('failed', 2)
+    assert queue.stats == {"succeeded": 0, "skipped": 0, "retried": 1, "failed": 1}
+
+
+async def test_scheduler_busy_does_not_count_as_attempt(db, queue, config, monkeypatch):
+    async def busy(job_id, config):
+        raise SchedulerBusy("queue_full")
+
+    monkeypatch.setattr(queue, '_process', busy)
+    await queue.enqueue([{"article_id": "a"}])
+    await queue._run(await queue._claim(config))
+    job = (await all_jobs(db))[0]
+    assert (job.status, job.attempts) == ('pending', 0)
+
+
+async def test_requeue_yields_to_newer_pending_job(db, queue, config, monkeypatch):
+    await queue.enqueue([{"article_id": "a"}])
+    job_id = await queue._claim(config)
+    # 运行期间同一文章又被排队
+    await queue.enqueue([{"article_id": "a"}])
+    await queue._finish(job_id, status='pending')
+    jobs = await all_jobs(db)
+    assert len(jobs) == 1 and jobs[0].id != job_id
+
+
+async def test_migrate_jobs_are_claimed_by_leader_only(db, queue, config, monkeypatch):
+    import singleflight
+    await queue.enqueue([{"article_id": "a"}], reason=MIGRATE)
+    monkeypatch.setattr(singleflight.leader, 'is_leader', False)
+    assert await queue._claim(config) is None
+    monkeypatch.setattr(singleflight.leader, 'is_leader', True)
+    assert await queue._claim(config) is not None
+
+
+async def test_version_progress_reads_trigger_counts(db, queue, config):
+    from summaries import save_summary
+    before = await queue.version_progress(config)
+    updated = datetime(2024, 1, 1)
+    await save_summary("version-a", updated, "摘要", config=config)
+    await save_summary("version-b", updated, "摘要")
+    progress = await queue.version_progress(config)
+    assert (progress["current"], progress["outdated"]) == (before["current"] + 1, before["outdated"] + 1)
+
+    # 旧版本摘要重新生成后计入当前版本
+    await save_summary("version-b", updated, "新摘要", config=config)
+    progress = await queue.version_progress(config)
+    assert (progress["current"], progress["outdated"]) == (before["current"] + 2, before["outdated"])
+
+    async with db.AsyncSessionLocal() as session:
+        await session.execute(delete(db.ArticleSummary).where(db.ArticleSummary.article_id.in_(("version-a", "version-b"))))
+        await session.commit()
+    progress = await queue.version_progress(config)
+    assert (progress["current"], progress["total"]) == (before["current"], before["total"])
+
+
+def test_version_counter_counts_existing_summaries(db, tmp_path):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(f"sqlite:///{tmp_path / 'summaries.db'}")
+    db.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO article_summaries (article_id, last_updated, summary, model, prompt_hash) VALUES "
+            "('a', '2024-01-01', 's', 'm1', 'p1'), ('b', '2024-01-01', 's', 'm1', 'p1'), "
+            "('c', '2024-01-01', 's', NULL, NULL)"
+        ))
+    db.install_version_counter(engine)
+    db.install_version_counter(engine)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE article_summaries SET model = 'm2' WHERE article_id = 'a'"))
+        conn.execute(text("UPDATE article_summaries SET summary = 't' WHERE article_id = 'b'"))
+        counts = dict(((model, prompt), count) for model, prompt, count in
+                      conn.execute(text("SELECT model, prompt_hash, count FROM stats_versions")))
+    engine.dispose()
+    assert counts == {("m1", "p1"): 1, ("m2", "p1"): 1, ("", ""): 1}
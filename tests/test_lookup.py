@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+
+from summaries import save_summary
+
+ARTICLE_URL = "https://blog.example/archives/lookup-etag"
+LAST_UPDATED = "2024-05-01 12:00:00"
+
+
+@pytest.fixture(scope='module')
+def seeded(client):
+    # 与应用使用同一个事件循环写入数据库
+    client.portal.call(save_summary, "lookup-etag", datetime(2024, 5, 1, 12), "已缓存的摘要")
+    return {"article_url": ARTICLE_URL, "last_updated": LAST_UPDATED}
+
+
+def test_lookup_returns_etag(client, seeded):
+    response = client.get("/api/summary/lookup", params=seeded)
+    assert response.status_code == 200
+    assert response.json() == {"summary": "已缓存的摘要"}
+    assert response.headers["etag"].startswith('"')
+
+
+def test_lookup_revalidates_with_if_none_match(client, seeded):
+    etag = client.get("/api/summary/lookup", params=seeded).headers["etag"]
+    response = client.get("/api/summary/lookup", params=seeded, headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    response = client.get("/api/summary/lookup", params=seeded, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+def test_lookup_head(client, seeded):
+    response = client.head("/api/summary/lookup", params=seeded)
+    assert response.status_code == 200
+    assert "etag" in response.headers
+    assert response.content == b""
+
+
+def test_lookup_miss_asks_for_content(client):
+    params = {"article_url": "https://blog.example/archives/lookup-missing", "last_updated": LAST_UPDATED}
+    response = client.get("/api/summary/lookup", params=params)
+    assert response.status_code == 404
+    assert response.json()["need_content"] is True
+    assert client.head("/api/summary/lookup", params=params).status_code == 404
+
+
+def test_lookup_rejects_bad_url(client):
+    params = {"article_url": "https://blog.example/about", "last_updated": LAST_UPDATED}
+    assert client.get("/api/summary/lookup", params=params).status_code == 400
+
+
+def test_matching_content_hash_is_a_read_only_hit(client, db):
+    import fingerprint
+    from sqlalchemy import select
+
+    fp = fingerprint.Fingerprint(fingerprint.content_hash("未变化的正文"), None)
+    client.portal.call(save_summary, "lookup-hash", datetime(2024, 5, 1, 12), "按哈希命中的摘要", fp)
+    stats = dict(fingerprint.stats)
+    params = {"article_url": "https://blog.example/archives/lookup-hash", "last_updated": "2024-06-01 00:00:00"}
+
+    response = client.get("/api/summary/lookup", params={**params, "content_hash": fp.content_hash})
+    assert response.json() == {"summary": "按哈希命中的摘要"}
+    assert client.head("/api/summary/lookup", params={**params, "content_hash": fp.content_hash}).status_code == 200
+    assert client.get("/api/summary/lookup", params={**params, "content_hash": "0" * 64}).status_code == 404
+
+    # 查询不改写数据库中的更新时间，也不计入指纹比对统计
+    async def stored_last_updated():
+        async with db.AsyncSessionLocal() as session:
+            return await session.scalar(
+                select(db.ArticleSummary.last_updated).where(db.ArticleSummary.article_id == "lookup-hash"))
+
+    assert client.portal.call(stored_last_updated) == datetime(2024, 5, 1, 12)
+    assert dict(fingerprint.stats) == stats
@@ -0,0 +1,181 @@
+import asyncio
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+import providers
+from providers import Backend, CircuitBreaker, NoBackendAvailable, ProviderPool
+from scheduler import Scheduler
+
+pytestmark = pytest.mark.anyio
+
+MESSAGES = [{"role": "user", "content": "text"}]
+
+
+class FakeCompletions:
+    def __init__(self, name, behaviour):
+        self.name = name
+        self.behaviour = behaviour
+        self.calls = 0
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.behaviour == "fail":
+            raise ConnectionError(f"{self.name} down")
+        if isinstance(self.behaviour, (int, float)):
+            await asyncio.sleep(self.behaviour)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"summary from {self.name}"))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5),
+        )
+
+
+class FakeBackend(Backend):
+    """不建立真实连接的上游，behaviour 为 ok、fail 或响应延迟（秒）"""
+
+    def __init__(self, name, behaviour="ok", weight=1, threshold=2, cooldown=30):
+        self.name = name
+        self.model = "test-model"
+        self.weight = weight
+        self.settings = ()
+        self.completions = FakeCompletions(name, behaviour)
+        self.client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        self.breaker = CircuitBreaker(threshold, cooldown)
+        self.latencies = deque(maxlen=200)
+        self.stats = {"requests": 0, "errors": 0, "wins": 0}
+
+
+def make_pool(*backends, hedge_delay_ms=0, scheduler=None):
+    pool = ProviderPool(scheduler)
+    pool.backends = list(backends)
+    pool.hedge = bool(hedge_delay_ms)
+    pool.hedge_delay = hedge_delay_ms / 1000
+    return pool
+
+
+async def test_fails_over_to_next_backend():
+    primary, secondary = FakeBackend("primary", "fail"), FakeBackend("secondary", weight=0)
+    pool = make_pool(primary, secondary)
+    assert await pool.complete(MESSAGES) == "summary from secondary"
+    assert pool.stats["failovers"] == 1
+    assert primary.stats["errors"] == 1
+    assert secondary.stats["wins"] == 1
+
+
+async def test_circuit_opens_after_consecutive_failures():
+    primary, secondary = FakeBackend("primary", "fail", threshold=2), FakeBackend("secondary", weight=0)
+    pool = make_pool(primary, secondary)
+    for _ in range(3):
+        assert await pool.complete(MESSAGES) == "summary from secondary"
+    assert primary.breaker.state == "open"
+    # 熔断后不再调用故障的上游
+    assert primary.completions.calls == 2
+
+
+async def test_half_open_probe_closes_circuit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(providers.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] += 31
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    # 同时只放行一次试探
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
+
+
+async def test_failed_probe_reopens_circuit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(providers.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    now[0] += 31
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+async def test_all_backends_open_raises():
+    backend = FakeBackend("only", "fail", threshold=1)
+    pool = make_pool(backend)
+    with pytest.raises(ConnectionError):
+        await pool.complete(MESSAGES)
+    with pytest.raises(NoBackendAvailable):
+        await pool.complete(MESSAGES)
+
+
+async def test_hedged_request_wins_when_primary_is_slow():
+    slow, fast = FakeBackend("slow", 1.0), FakeBackend("fast", weight=0)
+    pool = make_pool(slow, fast, hedge_delay_ms=20)
+    assert await pool.complete(MESSAGES) == "summary from fast"
+    assert pool.stats["hedged"] == 1
+    assert pool.stats["hedge_wins"] == 1
+    # 落败的请求被取消，不计入熔断
+    await asyncio.sleep(0)
+    assert slow.breaker.failures == 0
+
+
+def make_scheduler(concurrency, rpm=0):
+    scheduler = Scheduler()
+    scheduler.configure({"LLM_MAX_CONCURRENCY": concurrency, "LLM_RPM": rpm})
+    return scheduler
+
+
+async def test_hedge_takes_its_own_scheduler_slot():
+    scheduler = make_scheduler(2)
+    slow, fast = FakeBackend("slow", 1.0), FakeBackend("fast", 0.05, weight=0)
+    pool = make_pool(slow, fast, hedge_delay_ms=20, scheduler=scheduler)
+    async with scheduler.slot():
+        task = asyncio.ensure_future(pool.complete(MESSAGES))
+        await asyncio.sleep(0.04)
+        # 调用方和对冲请求各占一个名额
+        assert scheduler.get_stats()["active"] == 2
+        assert await task == "summary from fast"
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["active"] == 1
+    assert scheduler.get_stats()["active"] == 0
+    assert scheduler.stats["started"] == 2
+
+
+@pytest.mark.parametrize("concurrency,rpm", [(1, 0), (2, 1)])
+async def test_hedge_is_skipped_without_free_slot(concurrency, rpm):
+    scheduler = make_scheduler(concurrency, rpm)
+    slow, fast = FakeBackend("slow", 0.1), FakeBackend("fast", weight=0)
+    pool = make_pool(slow, fast, hedge_delay_ms=20, scheduler=scheduler)
+    async with scheduler.slot():
+        assert await pool.complete(MESSAGES) == "summary from slow"
+    assert fast.completions.calls == 0
+    assert (pool.stats["hedged"], pool.stats["hedge_skipped"]) == (0, 1)
+    assert scheduler.get_stats()["active"] == 0
+
+
+async def test_standby_backends_are_ordered_last():
+    pool = make_pool(FakeBackend("standby", weight=0), FakeBackend("a"), FakeBackend("b"))
+    for _ in range(10):
+        assert pool._ordered()[-1].name == "standby"
+
+
+def test_settings_fall_back_to_global_config():
+    config = {"BASE_URL": "https://global.example/v1", "HTTP_TIMEOUT": 60, "DASHSCOPE_API_KEY": "key"}
+    settings = providers._settings({"timeout": 15}, config, 2)
+    assert (settings.base_url, settings.api_key, settings.timeout, settings.max_retries) == (
+        "https://global.example/v1", "key", 15.0, 2)
+
+
+async def test_removed_backends_close_after_longest_timeout(monkeypatch):
+    import llm_client
+    delays = []
+
+    async def close_after(backends, delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(llm_client, '_close_after', close_after)
+    backends = [SimpleNamespace(settings=providers._settings({"timeout": timeout}, {}, 0)) for timeout in (5, 90, 30)]
+    llm_client._close_later(backends)
+    await asyncio.gather(*llm_client._closing)
+    assert delays == [90.0]
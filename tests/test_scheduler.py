@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from scheduler import BACKGROUND, INTERACTIVE, Scheduler, SchedulerBusy, TokenBucket, background
+
+pytestmark = pytest.mark.anyio
+
+
+def make_scheduler(**overrides):
+    scheduler = Scheduler()
+    scheduler.configure({
+        "LLM_MAX_CONCURRENCY": 1, "LLM_QUEUE_SIZE": 10, "LLM_QUEUE_TIMEOUT": 5, "LLM_RPM": 0, "LLM_TPM": 0,
+        **overrides,
+    })
+    return scheduler
+
+
+async def hold(scheduler, started, release, priority=None):
+    async with scheduler.slot(priority=priority):
+        started.append(priority)
+        await release.wait()
+
+
+async def test_concurrency_limit_queues_callers():
+    scheduler = make_scheduler(LLM_MAX_CONCURRENCY=2)
+    started, release = [], asyncio.Event()
+    tasks = [asyncio.ensure_future(hold(scheduler, started, release)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert len(started) == 2
+    assert scheduler.get_stats()["queue_depth"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert len(started) == 3
+    assert scheduler.get_stats()["active"] == 0
+
+
+async def test_full_queue_rejects():
+    scheduler = make_scheduler(LLM_QUEUE_SIZE=1)
+    started, release = [], asyncio.Event()
+    tasks = [asyncio.ensure_future(hold(scheduler, started, release)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    with pytest.raises(SchedulerBusy) as error:
+        async with scheduler.slot():
+            pass
+    assert error.value.reason == "queue_full"
+    assert scheduler.stats["rejected"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+async def test_queue_timeout_releases_place():
+    scheduler = make_scheduler(LLM_QUEUE_TIMEOUT=0.05)
+    started, release = [], asyncio.Event()
+    running = asyncio.ensure_future(hold(scheduler, started, release))
+    await asyncio.sleep(0.01)
+    with pytest.raises(SchedulerBusy) as error:
+        async with scheduler.slot():
+            pass
+    assert error.value.reason == "queue_timeout"
+    assert scheduler.stats["timeouts"] == 1
+    assert scheduler.get_stats()["queue_depth"] == 0
+    release.set()
+    await running
+    # 超时的等待者不占用名额
+    async with scheduler.slot():
+        assert scheduler.get_stats()["active"] == 1
+
+
+async def test_interactive_calls_go_before_background():
+    scheduler = make_scheduler()
+    started, release = [], asyncio.Event()
+    first = asyncio.ensure_future(hold(scheduler, started, release, INTERACTIVE))
+    await asyncio.sleep(0.01)
+    waiting = [
+        asyncio.ensure_future(hold(scheduler, started, release, BACKGROUND)),
+        asyncio.ensure_future(hold(scheduler, started, release, INTERACTIVE)),
+    ]
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, *waiting)
+    assert started == [INTERACTIVE, INTERACTIVE, BACKGROUND]
+
+
+async def test_background_context_lowers_priority():
+    scheduler = make_scheduler()
+    started, release = [], asyncio.Event()
+    first = asyncio.ensure_future(hold(scheduler, started, release))
+    await asyncio.sleep(0.01)
+
+    async def in_background():
+        with background():
+            async with scheduler.slot():
+                started.append("background")
+
+    async def interactive():
+        async with scheduler.slot():
+            started.append("interactive")
+
+    waiting = [asyncio.ensure_future(in_background()), asyncio.ensure_future(interactive())]
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, *waiting)
+    assert started[1:] == ["interactive", "background"]
+
+
+def test_token_bucket():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(1) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    assert TokenBucket(0).wait_time(10 ** 6) == 0
+
+
+def _metric(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[-1])
+    return None
+
+
+def test_queue_wait_is_exported(client):
+    name = 'ai_summary_llm_queue_wait_seconds'
+    before = _metric(client.get("/metrics").text, name + '_count{priority="background"}') or 0
+
+    async def queue_one():
+        scheduler = make_scheduler()
+        started, release = [], asyncio.Event()
+        first = asyncio.ensure_future(hold(scheduler, started, release, BACKGROUND))
+        second = asyncio.ensure_future(hold(scheduler, started, release, BACKGROUND))
+        await asyncio.sleep(0.02)
+        release.set()
+        await asyncio.gather(first, second)
+
+    client.portal.call(queue_one)
+    text = client.get("/metrics").text
+    assert f"# TYPE {name} histogram" in text
+    # 立即获得名额和排队等待各记录一次
+    assert _metric(text, name + '_count{priority="background"}') == before + 2
+    assert _metric(text, name + '_sum{priority="background"}') >= 0.015
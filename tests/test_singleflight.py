@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, flight_key
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "summary"
+
+    waiters = [asyncio.ensure_future(flight.do("a", generate)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert flight.in_flight == 1
+    release.set()
+    assert await asyncio.gather(*waiters) == ["summary"] * 5
+    assert calls == 1
+    assert flight.stats["leaders"] == 1
+    assert flight.stats["coalesced"] == 4
+    assert flight.in_flight == 0
+
+
+async def test_errors_are_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(*(flight.do("a", fail) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats["errors"] == 1
+    assert not flight.running("a")
+
+    async def succeed():
+        return "ok"
+
+    # 失败后同一个键可以重新发起
+    assert await flight.do("a", succeed) == "ok"
+
+
+async def test_cancelled_waiter_does_not_cancel_others():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def generate():
+        await release.wait()
+        return "summary"
+
+    first = asyncio.ensure_future(flight.do("a", generate))
+    second = asyncio.ensure_future(flight.do("a", generate))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == "summary"
+
+
+def test_flight_key_changes_with_model_and_prompt():
+    base = flight_key("a", "2024-01-01 00:00:00", "qwen-plus", "prompt")
+    assert flight_key("a", "2024-01-01 00:00:00", "qwen-max", "prompt") != base
+    assert flight_key("a", "2024-01-01 00:00:00", "qwen-plus", "other prompt") != base
+    assert flight_key("a", "2024-01-01 00:00:00", "qwen-plus", "prompt") == base
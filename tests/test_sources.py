@@ -0,0 +1,98 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+import sources
+from sources import check_url, html_to_text, parse_batch
+
+
+def test_parse_ndjson():
+    data = "\n".join([
+        json.dumps({"article_url": "https://blog.example/archives/first/", "last_updated": "2024-05-01 08:00:00"}),
+        "",
+        json.dumps({"id": "second", "content": "正文"}),
+        "not json",
+        json.dumps({"article_url": "https://blog.example/about"}),
+    ]).encode()
+    items, errors = parse_batch(data)
+    assert [item["article_id"] for item in items] == ["first", "second"]
+    assert items[0]["last_updated"] == datetime(2024, 5, 1, 8)
+    assert items[1]["content"] == "正文"
+    assert [error.split(":")[0] for error in errors] == ["第 4 行", "第 5 行"]
+
+
+def test_parse_ndjson_with_bom():
+    items, errors = parse_batch('\ufeff{"id": "a"}\n'.encode('utf-8'))
+    assert [item["article_id"] for item in items] == ["a"] and not errors
+
+
+def test_parse_sitemap():
+    data = b"""<?xml version="1.0" encoding="UTF-8"?>
+    <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+      <url><loc>https://blog.example/archives/a/</loc><lastmod>2024-05-01T08:00:00</lastmod></url>
+      <url><loc>https://blog.example/archives/b</loc></url>
+    </urlset>"""
+    items, errors = parse_batch(data)
+    assert [(item["article_id"], item["last_updated"]) for item in items] == [
+        ("a", datetime(2024, 5, 1, 8)), ("b", None)
+    ]
+    assert not errors
+
+
+def test_parse_rss_with_content():
+    data = """<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/"><channel>
+      <item>
+        <link>https://blog.example/archives/rss-post/</link>
+        <pubDate>Wed, 01 May 2024 08:00:00 GMT</pubDate>
+        <content:encoded><![CDATA[<p>第一段</p><script>x()</script><p>第二段</p>]]></content:encoded>
+      </item>
+    </channel></rss>""".encode()
+    items, errors = parse_batch(data)
+    assert items[0]["article_id"] == "rss-post"
+    assert items[0]["content"] == "第一段\n第二段"
+    assert items[0]["last_updated"] is not None
+
+
+def test_parse_atom():
+    data = b"""<feed xmlns="http://www.w3.org/2005/Atom"><entry>
+      <link rel="alternate" href="https://blog.example/archives/atom-post"/>
+      <updated>2024-05-01T08:00:00Z</updated>
+    </entry></feed>"""
+    items, errors = parse_batch(data)
+    assert [item["article_id"] for item in items] == ["atom-post"]
+
+
+def test_invalid_xml_and_bad_urls_are_reported():
+    assert parse_batch(b"<urlset><url>")[1][0].startswith("XML 解析失败")
+    items, errors = parse_batch(b'{"article_url": "file:///archives/x"}')
+    assert not items and "http(s)" in errors[0]
+
+
+def test_binary_data_raises_value_error():
+    with pytest.raises(ValueError):
+        parse_batch(b"\xff\xfe\x00\x81")
+
+
+def test_html_to_text_prefers_article_container():
+    page = '<nav>菜单</nav><div id="article-container"><h1>标题</h1><p>正文</p></div><footer>页脚</footer>'
+    assert html_to_text(page) == "标题\n正文"
+
+
+@pytest.mark.parametrize("url", ["ftp://blog.example/a", "file:///etc/passwd", "https://", "javascript:alert(1)"])
+def test_check_url_rejects_non_http(url):
+    with pytest.raises(ValueError):
+        check_url(url)
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/archives/a",
+    "http://localhost:8080/",
+    "http://10.1.2.3/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/",
+])
+def test_fetch_article_refuses_internal_hosts(url):
+    with pytest.raises(ValueError):
+        asyncio.run(sources.fetch_article(url))
@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+
+URL = "https://blog.example/archives/{}"
+FIRST = "第一版正文介绍了缓存的基本原理，以及如何设置过期时间。"
+SECOND = "全新改写：本文改为讨论数据库索引的设计、维护成本和查询计划分析。"
+
+
+def ask(client, article_id, message, last_updated):
+    response = client.post("/api/summary", json={
+        "article_url": URL.format(article_id), "message": message, "last_updated": last_updated,
+    })
+    assert response.status_code == 200, response.text
+    return response
+
+
+@pytest.fixture
+def stale_config(config, monkeypatch):
+    monkeypatch.setitem(config, 'STALE_WHILE_REVALIDATE', True)
+    return config
+
+
+def test_stale_summary_is_served_then_refreshed(client, upstream, stale_config):
+    assert ask(client, "swr-1", FIRST, "2024-01-01 00:00:00").json() == {"summary": f"摘要：{FIRST[:10]}"}
+
+    # 文章更新后先返回旧摘要，后台用新正文重新生成
+    response = ask(client, "swr-1", SECOND, "2024-02-01 00:00:00")
+    assert response.json() == {"summary": f"摘要：{FIRST[:10]}", "stale": True}
+    assert response.headers["X-Summary-Stale"] == "1"
+    assert upstream == [FIRST, SECOND]
+
+    # 下一次请求拿到刷新后的摘要，不再调用模型
+    response = ask(client, "swr-1", SECOND, "2024-02-01 00:00:00")
+    assert response.json() == {"summary": f"摘要：{SECOND[:10]}"}
+    assert "X-Summary-Stale" not in response.headers
+    assert len(upstream) == 2
+
+
+def test_failed_refresh_keeps_serving_stale(client, upstream, stale_config, caplog):
+    ask(client, "swr-2", FIRST, "2024-01-01 00:00:00")
+    with caplog.at_level(logging.WARNING, logger='summaries'):
+        response = ask(client, "swr-2", "boom " + SECOND, "2024-02-01 00:00:00")
+    assert response.json()["stale"] is True
+    assert "后台刷新摘要失败" in caplog.text
+    # 刷新失败后旧摘要保留，下次请求再次尝试
+    response = ask(client, "swr-2", "boom " + SECOND, "2024-02-01 00:00:00")
+    assert response.json() == {"summary": f"摘要：{FIRST[:10]}", "stale": True}
+    assert len(upstream) == 3
+
+
+def test_without_stale_while_revalidate_updates_synchronously(client, upstream, config, monkeypatch):
+    monkeypatch.setitem(config, 'STALE_WHILE_REVALIDATE', False)
+    ask(client, "swr-3", FIRST, "2024-01-01 00:00:00")
+    response = ask(client, "swr-3", SECOND, "2024-02-01 00:00:00")
+    assert response.json() == {"summary": f"摘要：{SECOND[:10]}"}
+
+
+def test_unchanged_content_reuses_summary(client, upstream, stale_config):
+    ask(client, "swr-4", FIRST, "2024-01-01 00:00:00")
+    response = ask(client, "swr-4", FIRST, "2024-02-01 00:00:00")
+    assert response.json() == {"summary": f"摘要：{FIRST[:10]}"}
+    assert upstream == [FIRST]
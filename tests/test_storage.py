@@ -0,0 +1,147 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select, text
+
+from cache import CachedSummary, summary_cache
+from storage import StorageManager
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime.utcnow()
+
+
+@pytest.fixture
+async def rows(db, config, monkeypatch):
+    """清空摘要表，写入最后访问时间分别为 10、5、1、0 天前，摘要各 100 字节的四条摘要"""
+    # 不压缩，每条摘要占用的字节数固定
+    monkeypatch.setitem(config, 'COMPRESS_MIN_BYTES', 0)
+    async with db.AsyncSessionLocal() as session:
+        await session.execute(delete(db.ArticleSummary))
+        for article_id, days in (("a", 10), ("b", 5), ("c", 1), ("d", 0)):
+            session.add(db.ArticleSummary(
+                article_id=article_id, last_updated=NOW, summary=article_id * 100,
+                last_accessed=NOW - timedelta(days=days)
+            ))
+        await session.commit()
+    return db
+
+
+async def remaining(db):
+    async with db.AsyncSessionLocal() as session:
+        return (await session.scalars(select(db.ArticleSummary.article_id).order_by(db.ArticleSummary.article_id))).all()
+
+
+async def stored_type(db, article_id):
+    async with db.AsyncSessionLocal() as session:
+        return await session.scalar(
+            text("SELECT typeof(content) FROM article_summaries WHERE article_id = :id"), {"id": article_id}
+        )
+
+
+async def test_ttl_eviction(rows):
+    storage = StorageManager()
+    summary_cache.set("a", CachedSummary("a" * 100, NOW, False, None, None))
+    assert await storage.evict({"SUMMARY_TTL_DAYS": 3}) == 2
+    assert await remaining(rows) == ["c", "d"]
+    assert storage.stats["evicted_ttl"] == 2
+    # 淘汰的摘要同时从进程内缓存中删除
+    assert summary_cache.get("a") is None
+
+
+async def test_rows_eviction_removes_least_recently_accessed(rows):
+    storage = StorageManager()
+    assert await storage.evict({"SUMMARY_MAX_ROWS": 3}) == 1
+    assert await remaining(rows) == ["b", "c", "d"]
+    assert await storage.evict({"SUMMARY_MAX_ROWS": 3}) == 0
+    assert storage.stats["evicted_rows"] == 1
+
+
+@pytest.mark.parametrize("max_bytes,expected", [(400, ["a", "b", "c", "d"]), (300, ["b", "c", "d"]),
+                                                (250, ["c", "d"])])
+async def test_bytes_eviction(rows, max_bytes, expected):
+    storage = StorageManager()
+    await storage.evict({"SUMMARY_MAX_BYTES": max_bytes})
+    assert await remaining(rows) == expected
+    assert storage.stats["evicted_bytes"] == 4 - len(expected)
+
+
+async def test_rows_without_access_time_use_updated_at(rows):
+    async with rows.AsyncSessionLocal() as session:
+        await session.execute(text(
+            "INSERT INTO article_summaries (article_id, last_updated, summary, updated_at) "
+            "VALUES ('legacy', :now, 'x', :old)"
+        ), {"now": NOW, "old": NOW - timedelta(days=30)})
+        await session.commit()
+    assert await StorageManager().evict({"SUMMARY_TTL_DAYS": 7}) == 2
+    assert await remaining(rows) == ["b", "c", "d"]
+
+
+async def test_no_policy_keeps_everything(rows):
+    assert await StorageManager().evict({}) == 0
+    assert await remaining(rows) == ["a", "b", "c", "d"]
+
+
+async def test_compressed_text_round_trip(rows, config):
+    config['COMPRESS_MIN_BYTES'] = 1024
+    long_content, short_content = "长文章正文。" * 200, "短正文"
+    async with rows.AsyncSessionLocal() as session:
+        (await session.get(rows.ArticleSummary, "a")).content = long_content
+        (await session.get(rows.ArticleSummary, "b")).content = short_content
+        await session.commit()
+    assert await stored_type(rows, "a") == "blob"
+    assert await stored_type(rows, "b") == "text"
+    async with rows.AsyncSessionLocal() as session:
+        session.expunge_all()
+        assert (await session.get(rows.ArticleSummary, "a")).content == long_content
+        assert (await session.get(rows.ArticleSummary, "b")).content == short_content
+
+
+async def test_recompress_legacy_plaintext(rows, config):
+    long_content = "启用压缩之前保存的正文。" * 200
+    async with rows.AsyncSessionLocal() as session:
+        (await session.get(rows.ArticleSummary, "a")).content = long_content
+        (await session.get(rows.ArticleSummary, "b")).content = "短正文"
+        await session.commit()
+        updated_at = (await session.get(rows.ArticleSummary, "a")).updated_at
+    assert await stored_type(rows, "a") == "text"
+
+    storage = StorageManager()
+    assert await storage.recompress({"COMPRESS_MIN_BYTES": 0}) == 0
+    config['COMPRESS_MIN_BYTES'] = 1024
+    assert await storage.recompress(config) == 1
+    assert await stored_type(rows, "a") == "blob"
+    assert await stored_type(rows, "b") == "text"
+    async with rows.AsyncSessionLocal() as session:
+        summary = await session.get(rows.ArticleSummary, "a")
+        assert summary.content == long_content
+        assert summary.updated_at == updated_at
+    # 已压缩的正文不再处理
+    assert await storage.recompress(config) == 0
+
+
+@pytest.mark.parametrize("is_leader", [False, True])
+async def test_maintenance_runs_on_leader_only(rows, config, monkeypatch, is_leader):
+    import singleflight
+    monkeypatch.setattr(singleflight.leader, 'is_leader', is_leader)
+    monkeypatch.setitem(config, 'ACCESS_FLUSH_INTERVAL', 0.01)
+    monkeypatch.setitem(config, 'STORAGE_MAINTENANCE_INTERVAL', 3600)
+    storage = StorageManager()
+    maintained, flushed = [], []
+
+    async def maintain(config):
+        maintained.append(config)
+
+    async def flush_access():
+        flushed.append(True)
+        return 0
+
+    monkeypatch.setattr(storage, 'maintain', maintain)
+    monkeypatch.setattr(storage, 'flush_access', flush_access)
+    storage.start()
+    await asyncio.sleep(0.1)
+    await storage.stop()
+    # 主进程只维护一次，之后与其他进程一样只写入访问时间
+    assert len(maintained) == (1 if is_leader else 0)
+    assert len(flushed) > 2
@@ -0,0 +1,63 @@
+import json
+
+URL = "https://blog.example/archives/{}"
+
+
+def stream(client, article_id, message, last_updated="2024-01-01 00:00:00"):
+    response = client.post("/api/summary/stream", json={
+        "article_url": URL.format(article_id), "message": message, "last_updated": last_updated,
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    events = []
+    # 每个事件为 event 和 data 两行，以空行结束
+    assert response.text.endswith("\n\n")
+    for block in response.text.split("\n\n")[:-1]:
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_deltas_then_done(client, upstream):
+    events = stream(client, "sse-1", "流式生成的文章正文内容")
+    names = [name for name, _ in events]
+    assert names[-1] == "done" and set(names[:-1]) == {"delta"} and len(names) > 2
+    summary = "".join(data["delta"] for name, data in events[:-1])
+    assert events[-1][1] == {"summary": summary}
+    assert summary == "摘要：流式生成的文章正文内"
+
+
+def test_cached_summary_is_a_single_done_event(client, upstream):
+    stream(client, "sse-2", "已经生成过的文章")
+    assert stream(client, "sse-2", "已经生成过的文章") == [("done", {"summary": "摘要：已经生成过的文章"})]
+    assert len(upstream) == 1
+
+
+def test_upstream_error_is_an_error_event(client, upstream):
+    events = stream(client, "sse-3", "boom 上游出错的文章")
+    assert events == [("error", {"detail": "处理请求时发生错误。"})]
+    # 失败的生成不保存，下次请求重新生成
+    stream(client, "sse-3", "boom 上游出错的文章")
+    assert len(upstream) == 2
+
+
+def test_scheduler_busy_is_an_error_event(client, monkeypatch):
+    import llm_client
+    from scheduler import SchedulerBusy
+
+    async def busy(config, content):
+        raise SchedulerBusy("queue_full", retry_after=7)
+        yield
+
+    monkeypatch.setattr(llm_client, 'stream_summary', busy)
+    events = stream(client, "sse-4", "排队已满时的文章")
+    assert events == [("error", {"detail": "摘要服务繁忙，请稍后重试。", "retry_after": 7})]
+
+
+def test_stale_summary_is_streamed_as_done(client, upstream, config, monkeypatch):
+    monkeypatch.setitem(config, 'STALE_WHILE_REVALIDATE', True)
+    stream(client, "sse-5", "第一版：讨论缓存的过期策略和失效方式。")
+    events = stream(client, "sse-5", "彻底重写：改为介绍消息队列的重试与死信处理。", "2024-02-01 00:00:00")
+    assert events == [("done", {"summary": "摘要：第一版：讨论缓存的过", "stale": True})]
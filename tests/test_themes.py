@@ -0,0 +1,68 @@
+import gzip
+
+import pytest
+
+from themes import ThemeEntry, parse_accept_encoding
+
+TEMPLATE = '<div class="card"><div class="summary"><span class="typing-effect">…</span></div></div>'
+
+
+@pytest.fixture
+def entry():
+    entry = ThemeEntry(TEMPLATE)
+    # 未安装 brotli 时也能测试编码选择
+    entry.encoded.setdefault("br", b"br-body")
+    entry.etags.setdefault("br", entry.etag[:-1] + '-br"')
+    return entry
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, br;q=0, *;q=0.1") == {"gzip": 1.0, "br": 0.0, "*": 0.1}
+    assert parse_accept_encoding("GZIP ; q=0.5") == {"gzip": 0.5}
+    assert parse_accept_encoding("") == {}
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("br, gzip", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip", "gzip"),
+    ("identity", None),
+    ("", None),
+    ("*;q=0", None),
+    ("gzip;q=0, *", "br"),
+    ("xbr, gzipx", None),
+])
+def test_select_encoding(entry, header, expected):
+    assert entry.select_encoding(header) == expected
+
+
+def test_etag_differs_per_representation(entry):
+    assert len({entry.etag, *entry.etags.values()}) == 1 + len(entry.encoded)
+    assert entry.etags["gzip"].endswith('-gzip"')
+
+
+def test_render_escapes_summary(entry):
+    assert "&lt;b&gt;" in entry.render("<b>")
+
+
+def test_card_template_revalidation(client):
+    response = client.get("/api/card-template", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    gzip_etag = response.headers["etag"]
+    assert gzip_etag.endswith('-gzip"')
+
+    cached = client.get("/api/card-template", headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    # 代理可能把 ETag 改为弱校验
+    weak = client.get("/api/card-template", headers={"Accept-Encoding": "gzip", "If-None-Match": "W/" + gzip_etag})
+    assert weak.status_code == 304
+
+    # 不同表示的 ETag 不能互相验证
+    identity = client.get("/api/card-template", headers={"Accept-Encoding": "identity", "If-None-Match": gzip_etag})
+    assert identity.status_code == 200
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["etag"] != gzip_etag
+    assert gzip.decompress(ThemeEntry(identity.json()["card"]).encoded["gzip"]) == identity.content
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+
+from fastapi import Request, Response
+
+from metrics import cache_lookups
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+DEFAULT_THEME = 'light'
+
+_DIV_TAG = re.compile(r'<div\b|</div\s*>')
+
+
+def split_summary_slot(content: str):
+    """找到模板中 .summary 元素的内容区域，返回 (前缀, 后缀, 原内容)，找不到时返回 None"""
+    start = re.search(r'<div[^>]*class="[^"]*\bsummary\b[^"]*"[^>]*>', content)
+    if not start:
+        return None
+    depth = 1
+    for tag in _DIV_TAG.finditer(content, start.end()):
+        depth += 1 if tag.group().startswith('<div') else -1
+        if depth == 0:
+            return content[:start.end()], content[tag.start():], content[start.end():tag.start()]
+    return None
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """解析 Accept-Encoding，返回 {编码: q 值}"""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def _accepts(codings: dict, encoding: str) -> bool:
+    """未单独列出的编码按 * 的 q 值处理，q=0 表示拒绝"""
+    return codings.get(encoding, codings.get('*', 0)) > 0
+
+
+class ThemeEntry:
+    """预先序列化并压缩好的 /card-template 响应"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.body = json.dumps({"card": content}, ensure_ascii=False).encode('utf-8')
+        digest = hashlib.sha1(self.body).hexdigest()
+        self.etag = f'"{digest}"'
+        self.encoded = {"gzip": gzip.compress(self.body, compresslevel=9)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.body)
+        # 强校验的 ETag 按表示区分，压缩后的响应带上编码
+        self.etags = {encoding: f'"{digest}-{encoding}"' for encoding in self.encoded}
+        self.slot = split_summary_slot(content)
+        # 沿用主题中摘要文字的样式类
+        match = self.slot and re.search(r'<span class="(typing-effect[^"]*)"', self.slot[2])
+        self.summary_class = match.group(1) if match else 'typing-effect'
+
+    def render(self, summary: str) -> str:
+        """返回已填入摘要的卡片"""
+        if self.slot is None:
+            return self.content
+        prefix, suffix, _ = self.slot
+        return f'{prefix}<span class="{self.summary_class}">{html.escape(summary)}</span>{suffix}'
+
+    def select_encoding(self, accept_encoding: str):
+        """按 Accept-Encoding 选择压缩方式，都不接受时返回 None（不压缩）"""
+        codings = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.encoded and _accepts(codings, encoding):
+                return encoding
+        return None
+
+    def response(self, request: Request, max_age: int) -> Response:
+        encoding = self.select_encoding(request.headers.get("accept-encoding", ""))
+        etag = self.etags[encoding] if encoding else self.etag
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match:
+            # 浏览器缓存这一级的命中情况；If-None-Match 按弱比较，忽略 W/ 前缀
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if etag in tags or "*" in tags:
+                cache_lookups.inc('http', 'hit')
+                return Response(status_code=304, headers=headers)
+            cache_lookups.inc('http', 'miss')
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(self.encoded[encoding], media_type="application/json", headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+class ThemeStore:
+    """主题模板的内存缓存，管理后台修改主题后失效"""
+
+    def __init__(self, themes_dir='themes'):
+        self.themes_dir = themes_dir
+        self._entries = {}
+
+    def _path(self, theme):
+        return os.path.join(os.getcwd(), self.themes_dir, f"{theme}.html")
+
+    def _load(self, theme):
+        path = self._path(theme)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return ThemeEntry(f.read())
+
+    def get(self, theme) -> ThemeEntry:
+        entry = self._entries.get(theme)
+        if entry is None:
+            entry = self._load(theme)
+            if entry is None:
+                if theme == DEFAULT_THEME:
+                    raise FileNotFoundError(self._path(theme))
+                # 主题不存在时使用默认主题，创建该主题后缓存会失效
+                entry = self.get(DEFAULT_THEME)
+            self._entries[theme] = entry
+        return entry
+
+    def invalidate(self, theme=None):
+        if theme is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(theme, None)
+
+
+theme_store = ThemeStore()